@@ -1,38 +1,166 @@
+import asyncio
 import json
+import re
+import threading
+import time
 import requests
+from google.auth import jwt as google_jwt
 from django.http import JsonResponse
 from django.conf import settings
 from functools import wraps
-from .services.mongodb_service import MongoDBService
+from .services.mongodb_service import get_mongodb_service
+from .services.async_mongodb_service import get_async_mongodb_service
+from .services.user_cache import verified_user_cache
+from .structured_logging import bind_user
 
 
-def verify_google_token(id_token):
+GOOGLE_CERTS_URL = 'https://www.googleapis.com/oauth2/v1/certs'
+GOOGLE_TOKENINFO_URL = 'https://oauth2.googleapis.com/tokeninfo'
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+
+# Keep serving cached certs for this long past expiry if Google is unreachable
+CERTS_STALE_GRACE_SECONDS = 6 * 60 * 60
+CERTS_DEFAULT_MAX_AGE = 60 * 60
+# Tokens with unknown key ids can force at most one refetch per interval
+CERTS_MIN_FORCED_REFRESH_SECONDS = 60
+TOKEN_CLOCK_SKEW_SECONDS = 10
+HTTP_TIMEOUT_SECONDS = 5
+
+_http_session = requests.Session()
+
+
+def fetch_google_certs():
+    """Fetch Google's signing certificates and how long they may be cached"""
+    response = _http_session.get(getattr(settings, 'GOOGLE_CERTS_URL', GOOGLE_CERTS_URL), timeout=HTTP_TIMEOUT_SECONDS)
+    response.raise_for_status()
+    
+    max_age = CERTS_DEFAULT_MAX_AGE
+    match = re.search(r'max-age=(\d+)', response.headers.get('Cache-Control', ''))
+    if match:
+        max_age = int(match.group(1))
+    
+    return response.json(), max_age
+
+
+class GoogleCertCache:
+    """Caches Google's ID-token signing certificates, refreshed per Cache-Control"""
+    
+    def __init__(self, fetcher=fetch_google_certs, clock=time.time, stale_grace=CERTS_STALE_GRACE_SECONDS,
+                 min_forced_refresh=CERTS_MIN_FORCED_REFRESH_SECONDS):
+        self.fetcher = fetcher
+        self.clock = clock
+        self.stale_grace = stale_grace
+        self.min_forced_refresh = min_forced_refresh
+        self._certs = {}
+        self._expires_at = 0
+        self._forced_at = None
+        self._lock = threading.Lock()
+    
+    def get_certs(self, force_refresh=False):
+        """Return a mapping of key id to PEM certificate, refreshing when expired.
+
+        force_refresh refetches at most once per min_forced_refresh seconds, so
+        a stream of tokens with made-up key ids cannot hammer Google's endpoint.
+        """
+        if not force_refresh and self._certs and self.clock() < self._expires_at:
+            return self._certs
+        
+        with self._lock:
+            now = self.clock()
+            if force_refresh and self._certs:
+                if self._forced_at is not None and now - self._forced_at < self.min_forced_refresh:
+                    force_refresh = False
+                else:
+                    self._forced_at = now
+            if not force_refresh and self._certs and now < self._expires_at:
+                return self._certs
+            
+            try:
+                certs, max_age = self.fetcher()
+                self._certs = certs
+                self._expires_at = now + max_age
+            except Exception:
+                # Ride out short Google outages with the certs we already have
+                if not self._certs or now > self._expires_at + self.stale_grace:
+                    raise
+            return self._certs
+    
+    def clear(self):
+        """Drop cached certificates"""
+        with self._lock:
+            self._certs = {}
+            self._expires_at = 0
+            self._forced_at = None
+
+
+google_cert_cache = GoogleCertCache()
+
+
+def _decode_google_token(id_token, certs):
+    """Verify the token signature, exp and aud locally, then check the issuer"""
+    claims = google_jwt.decode(
+        id_token,
+        certs=certs,
+        audience=settings.GOOGLE_CLIENT_ID,
+        clock_skew_in_seconds=TOKEN_CLOCK_SKEW_SECONDS
+    )
+    if claims.get('iss') not in GOOGLE_ISSUERS:
+        raise ValueError(f"Invalid token issuer: {claims.get('iss')}")
+    return claims
+
+
+def _verify_with_tokeninfo(id_token):
+    """Verify the token remotely; only used when no signing certs are available"""
+    response = _http_session.get(
+        getattr(settings, 'GOOGLE_TOKENINFO_URL', GOOGLE_TOKENINFO_URL),
+        params={'id_token': id_token},
+        timeout=HTTP_TIMEOUT_SECONDS
+    )
+    
+    if response.status_code == 200:
+        token_info = response.json()
+        if token_info.get('aud') == settings.GOOGLE_CLIENT_ID:
+            return token_info
+    return None
+
+
+def verify_google_token(id_token, cert_cache=None):
     """
-    Verify Google ID token with Google's servers
+    Verify Google ID token locally against Google's cached signing certificates
     """
+    cert_cache = cert_cache or google_cert_cache
+    
     try:
-        # Verify the token with Google
-        response = requests.get(
-            f'https://oauth2.googleapis.com/tokeninfo?id_token={id_token}'
-        )
+        try:
+            certs = cert_cache.get_certs()
+        except Exception:
+            certs = None
         
-        if response.status_code == 200:
-            token_info = response.json()
-            
-            # Check if token is valid and not expired
-            if token_info.get('aud') == settings.GOOGLE_CLIENT_ID:
-                return {
-                    'success': True,
-                    'user_info': {
-                        'email': token_info.get('email'),
-                        'name': token_info.get('name'),
-                        'picture': token_info.get('picture'),
-                        'sub': token_info.get('sub')  # Google user ID
-                    }
-                }
+        if certs is None:
+            token_info = _verify_with_tokeninfo(id_token)
+        else:
+            # An unknown key id usually means Google rotated keys; refetch once
+            header = google_jwt.decode_header(id_token)
+            if header.get('kid') not in certs:
+                certs = cert_cache.get_certs(force_refresh=True)
+            token_info = _decode_google_token(id_token, certs)
+        
+        if token_info:
+            return {
+                'success': True,
+                'user_info': {
+                    'email': token_info.get('email'),
+                    'name': token_info.get('name'),
+                    'picture': token_info.get('picture'),
+                    'sub': token_info.get('sub')  # Google user ID
+                },
+                'expires_at': int(token_info.get('exp', 0))
+            }
         
         return {'success': False, 'error': 'Invalid or expired token'}
         
+    except ValueError:
+        return {'success': False, 'error': 'Invalid or expired token'}
     except Exception as e:
         return {'success': False, 'error': f'Token verification failed: {str(e)}'}
 
@@ -41,54 +169,60 @@ def require_auth(view_func):
     """
     Decorator to require authentication for API endpoints
     """
+    if asyncio.iscoroutinefunction(view_func):
+        return _require_auth_async(view_func)
+    
     @wraps(view_func)
     def wrapper(request, *args, **kwargs):
         # Get the Authorization header
         auth_header = request.headers.get('Authorization', '')
         
         if not auth_header.startswith('Bearer '):
-            return JsonResponse({
-                'success': False,
-                'error': 'Authorization header required'
-            }, status=401)
+            return _missing_token_response()
         
         # Extract the token
         id_token = auth_header.split(' ')[1]
         
-        # Verify the token
-        token_verification = verify_google_token(id_token)
-        
-        if not token_verification['success']:
-            return JsonResponse({
-                'success': False,
-                'error': token_verification['error']
-            }, status=401)
+        # A token verified earlier in this process skips signature checks until it expires
+        cached = verified_user_cache.get(id_token)
+        if cached:
+            user_info, user = cached
+        else:
+            token_verification = verify_google_token(id_token)
+            
+            if not token_verification['success']:
+                return JsonResponse({
+                    'success': False,
+                    'error': token_verification['error']
+                }, status=401)
+            
+            user_info, user = token_verification['user_info'], None
         
-        # Get or create user
-        user_info = token_verification['user_info']
-        mongodb_service = MongoDBService()
+        mongodb_service = get_mongodb_service()
         
         try:
-            # Check if user exists
-            user = mongodb_service.get_user_by_email(user_info['email'])
+            if user is None:
+                # Check if user exists
+                user = mongodb_service.get_user_by_email(user_info['email'])
+                
+                if not user:
+                    # Create new user
+                    user_id = mongodb_service.create_user(_new_user_data(user_info))
+                    user = mongodb_service.get_user_by_id(user_id)
+                
+                if cached:
+                    verified_user_cache.store_user(user)
+                else:
+                    verified_user_cache.put(id_token, user_info, user, token_verification['expires_at'])
             
-            if not user:
-                # Create new user
-                user_data = {
-                    'email': user_info['email'],
-                    'name': user_info['name'],
-                    'picture': user_info['picture'],
-                    'google_id': user_info['sub']
-                }
-                user_id = mongodb_service.create_user(user_data)
-                user = mongodb_service.get_user_by_id(user_id)
-            else:
-                # Update last login
+            # Coalesce last_login writes to at most one per user per window
+            if verified_user_cache.should_record_login(user['_id']):
                 mongodb_service.update_user_login(user['_id'])
             
             # Add user info to request
             request.user = user
             request.user_info = user_info
+            bind_user(user['_id'])
             
             mongodb_service.close()
             
@@ -105,6 +239,76 @@ def require_auth(view_func):
     return wrapper
 
 
+def _missing_token_response():
+    """401 returned when the request carries no bearer token"""
+    return JsonResponse({
+        'success': False,
+        'error': 'Authorization header required'
+    }, status=401)
+
+
+def _new_user_data(user_info):
+    """User fields taken from a verified Google token"""
+    return {
+        'email': user_info['email'],
+        'name': user_info['name'],
+        'picture': user_info['picture'],
+        'google_id': user_info['sub']
+    }
+
+
+def _require_auth_async(view_func):
+    """require_auth for async views; user lookups go through AsyncMongoDBService"""
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        auth_header = request.headers.get('Authorization', '')
+        if not auth_header.startswith('Bearer '):
+            return _missing_token_response()
+        id_token = auth_header.split(' ')[1]
+        
+        cached = verified_user_cache.get(id_token)
+        if cached:
+            user_info, user = cached
+        else:
+            # Verification may refresh Google's certs over blocking HTTP
+            token_verification = await asyncio.to_thread(verify_google_token, id_token)
+            if not token_verification['success']:
+                return JsonResponse({
+                    'success': False,
+                    'error': token_verification['error']
+                }, status=401)
+            user_info, user = token_verification['user_info'], None
+        
+        mongodb_service = get_async_mongodb_service()
+        
+        try:
+            if user is None:
+                user = await mongodb_service.get_user_by_email(user_info['email'])
+                if not user:
+                    user_id = await mongodb_service.create_user(_new_user_data(user_info))
+                    user = await mongodb_service.get_user_by_id(user_id)
+                
+                if cached:
+                    verified_user_cache.store_user(user)
+                else:
+                    verified_user_cache.put(id_token, user_info, user, token_verification['expires_at'])
+            
+            if verified_user_cache.should_record_login(user['_id']):
+                await mongodb_service.update_user_login(user['_id'])
+        except Exception as e:
+            return JsonResponse({
+                'success': False,
+                'error': f'Authentication failed: {str(e)}'
+            }, status=500)
+        
+        request.user = user
+        request.user_info = user_info
+        bind_user(user['_id'])
+        return await view_func(request, *args, **kwargs)
+    
+    return wrapper
+
+
 def get_user_from_request(request):
     """
     Helper function to get user from request
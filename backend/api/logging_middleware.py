@@ -0,0 +1,54 @@
+import logging
+import re
+from asgiref.sync import iscoroutinefunction
+from django.utils.decorators import sync_and_async_middleware
+from .structured_logging import begin_request, end_request
+
+
+logger = logging.getLogger(__name__)
+
+# Accept a caller's request id only if it cannot smuggle anything into the log line
+_REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+
+def _request_id_from(request):
+    request_id = request.headers.get('X-Request-ID', '')
+    return request_id if _REQUEST_ID_PATTERN.match(request_id) else None
+
+
+def _log_response(request, response, request_id):
+    response['X-Request-ID'] = request_id
+    resolver_match = getattr(request, 'resolver_match', None)
+    logger.info('request finished', extra={
+        'method': request.method,
+        'path': request.path,
+        'url_name': resolver_match.url_name if resolver_match else None,
+        'status': response.status_code
+    })
+
+
+@sync_and_async_middleware
+def request_logging_middleware(get_response):
+    """
+    Middleware giving each request an id for its log lines and logging one summary line per request; the line's elapsed_ms is the request duration
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            request_id, tokens = begin_request(_request_id_from(request))
+            try:
+                response = await get_response(request)
+                _log_response(request, response, request_id)
+                return response
+            finally:
+                end_request(tokens)
+    else:
+        def middleware(request):
+            request_id, tokens = begin_request(_request_id_from(request))
+            try:
+                response = get_response(request)
+                _log_response(request, response, request_id)
+                return response
+            finally:
+                end_request(tokens)
+    
+    return middleware
@@ -1,31 +1,52 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from api.services.mongodb_service import MongoDBService
+from api.services.index_migrations import LATEST_VERSION, get_applied_version, check_query_plans
 
 
 class Command(BaseCommand):
-    help = 'Initialize MongoDB database with collections and indexes'
+    help = 'Initialize MongoDB: apply pending index migrations and optionally verify query plans'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check-plans',
+            action='store_true',
+            help='Explain every service query and fail on a COLLSCAN or in-memory SORT'
+        )
+        parser.add_argument(
+            '--status',
+            action='store_true',
+            help='Only report the applied index migration version'
+        )
 
     def handle(self, *args, **options):
         self.stdout.write('🔄 Initializing MongoDB database...')
         
         try:
-            # This will automatically create collections and indexes
+            # Indexes are migrated here at deploy time rather than per request
             mongodb_service = MongoDBService()
+            mongodb_service.ping()
+            
+            if options['status']:
+                self.stdout.write(f'📊 Index migrations: version {get_applied_version(mongodb_service)} of {LATEST_VERSION}')
+                return
             
+            version = mongodb_service.ensure_indexes(log=self.stdout.write)
             self.stdout.write(
-                self.style.SUCCESS('✅ Database initialized successfully!')
+                self.style.SUCCESS(f'✅ Database initialized at index migration version {version}')
             )
-            self.stdout.write('📊 Collections created:')
-            self.stdout.write('   - users')
-            self.stdout.write('   - ideas') 
-            self.stdout.write('   - debates')
-            self.stdout.write('   - requirements')
-            self.stdout.write('   - credit_transactions')
-            self.stdout.write('')
-            self.stdout.write('🔍 Indexes created for optimal performance')
+            
+            if options['check_plans']:
+                failures = check_query_plans(mongodb_service)
+                for name, problems in failures.items():
+                    self.stdout.write(self.style.ERROR(f'❌ {name}: {", ".join(problems)}'))
+                if failures:
+                    raise CommandError(f'{len(failures)} service queries are not fully served by an index')
+                self.stdout.write(self.style.SUCCESS('🔍 Every service query is served by an index'))
             
             mongodb_service.close()
             
+        except CommandError:
+            raise
         except Exception as e:
             self.stdout.write(
                 self.style.ERROR(f'❌ Failed to initialize database: {str(e)}')
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from api.services.mongodb_service import MongoDBService
+
+
+class Command(BaseCommand):
+    help = 'Regroup per-message debates into one debate_iterations document per idea iteration'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--drop-legacy',
+            action='store_true',
+            help='Delete the per-message debates documents once their iteration documents are written'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('🔄 Migrating debates to per-iteration documents...')
+        
+        try:
+            mongodb_service = MongoDBService()
+            ideas, buckets, turns = mongodb_service.migrate_debates_to_buckets(
+                drop_legacy=options['drop_legacy'],
+                log=self.stdout.write
+            )
+            
+            self.stdout.write(
+                self.style.SUCCESS(f'✅ Migrated {turns} debate turns of {ideas} ideas into {buckets} iteration documents')
+            )
+            
+            mongodb_service.close()
+            
+        except Exception as e:
+            self.stdout.write(
+                self.style.ERROR(f'❌ Failed to migrate debates: {str(e)}')
+            )
+            raise e
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from api.services.mongodb_service import MongoDBService
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the idea_summaries read model used by the history endpoint'
+
+    def handle(self, *args, **options):
+        self.stdout.write('🔄 Rebuilding idea summaries...')
+        
+        try:
+            mongodb_service = MongoDBService()
+            count = mongodb_service.rebuild_idea_summaries()
+            
+            self.stdout.write(
+                self.style.SUCCESS(f'✅ Rebuilt summaries for {count} ideas')
+            )
+            
+            mongodb_service.close()
+            
+        except Exception as e:
+            self.stdout.write(
+                self.style.ERROR(f'❌ Failed to rebuild idea summaries: {str(e)}')
+            )
+            raise e
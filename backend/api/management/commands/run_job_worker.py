@@ -0,0 +1,110 @@
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.services.mongodb_service import get_mongodb_service
+from api.services.job_queue import JobQueue
+from api.structured_logging import begin_request, end_request, bind_user
+
+
+logger = logging.getLogger(__name__)
+
+
+def _worker_loop(worker_index, poll_interval, stop_event):
+    """Claim and execute refine jobs until asked to stop"""
+    # Children get their own MongoClient; get_mongodb_service() rebuilds it after fork
+    job_queue = JobQueue(get_mongodb_service())
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{worker_index}"
+    logger.info("Job worker started", extra={'worker_id': worker_id})
+
+    while not stop_event.is_set():
+        try:
+            job_queue.fail_abandoned()
+            job = job_queue.claim_next(worker_id)
+        except Exception as e:
+            logger.error("Job worker failed to poll queue: %s", e, extra={'worker_id': worker_id})
+            job = None
+
+        if job is None:
+            stop_event.wait(poll_interval)
+            continue
+
+        # Log lines written while the job runs carry the job id in place of a request id
+        _, tokens = begin_request(f"job-{job['_id']}")
+        try:
+            bind_user(job['user_id'])
+            logger.info("Job started", extra={'worker_id': worker_id, 'job_type': job['job_type']})
+            result = job_queue.process(job, worker_id)
+            logger.info("Job finished", extra={
+                'worker_id': worker_id,
+                'job_type': job['job_type'],
+                'status': 'succeeded' if result['success'] else 'failed'
+            })
+        finally:
+            end_request(tokens)
+
+    logger.info("Job worker stopped", extra={'worker_id': worker_id})
+
+
+class Command(BaseCommand):
+    help = 'Run a pool of worker processes that execute queued refine jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=settings.JOB_WORKER_PROCESSES,
+            help='Number of worker processes to start'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=settings.JOB_POLL_INTERVAL_SECONDS,
+            help='Seconds to wait between polls when the queue is empty'
+        )
+
+    def handle(self, *args, **options):
+        processes = max(1, options['processes'])
+        poll_interval = options['poll_interval']
+        stop_event = multiprocessing.Event()
+
+        def request_stop(signum, frame):
+            stop_event.set()
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+
+        self.stdout.write(f'🚀 Starting {processes} job worker process(es)...')
+        workers = [
+            multiprocessing.Process(
+                target=_worker_loop,
+                args=(index, poll_interval, stop_event),
+                name=f'refine-job-worker-{index}'
+            )
+            for index in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+
+        # Restart any worker that dies until a shutdown is requested
+        while not stop_event.is_set():
+            for index, worker in enumerate(workers):
+                if not worker.is_alive() and not stop_event.is_set():
+                    self.stdout.write(
+                        self.style.WARNING(f'⚠️ Job worker {index} exited with code {worker.exitcode}, restarting')
+                    )
+                    workers[index] = multiprocessing.Process(
+                        target=_worker_loop,
+                        args=(index, poll_interval, stop_event),
+                        name=f'refine-job-worker-{index}'
+                    )
+                    workers[index].start()
+            stop_event.wait(1.0)
+
+        self.stdout.write('🛑 Stopping job workers...')
+        for worker in workers:
+            worker.join()
+        self.stdout.write(self.style.SUCCESS('✅ Job workers stopped'))
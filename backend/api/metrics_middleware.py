@@ -0,0 +1,25 @@
+import time
+from asgiref.sync import iscoroutinefunction
+from django.utils.decorators import sync_and_async_middleware
+from .services.metrics import observe_request
+
+
+@sync_and_async_middleware
+def request_metrics_middleware(get_response):
+    """
+    Middleware recording request latency per URL name; streaming responses are timed until their headers
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            started = time.perf_counter()
+            response = await get_response(request)
+            observe_request(request, response, time.perf_counter() - started)
+            return response
+    else:
+        def middleware(request):
+            started = time.perf_counter()
+            response = get_response(request)
+            observe_request(request, response, time.perf_counter() - started)
+            return response
+    
+    return middleware
@@ -0,0 +1,525 @@
+import asyncio
+import logging
+import os
+import threading
+from datetime import datetime
+from bson import ObjectId
+from django.conf import settings
+from pymongo import AsyncMongoClient, ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError, OperationFailure
+from .pagination import akeyset_page, InvalidCursor
+from .user_cache import verified_user_cache
+from .metrics import mongo_command_metrics, CREDIT_RESERVATION_FAILURES
+from .unit_of_work import UnitOfWork, transactions_unsupported
+from .read_cache import get_read_cache, idea_iterations_key, idea_keys, chat_sessions_key
+from .job_queue import job_filter
+from .mongodb_service import (
+    _idea_summary_document,
+    _refinement_update,
+    _debates_bucketed,
+    _debate_bucket,
+    _debate_documents,
+    _stage_refinement,
+    _stage_feedback_refinement,
+    _group_debate_rounds,
+    _group_debate_buckets,
+    _attach_latest_requirement,
+    _new_user_document,
+    _last_login_filter,
+    _credit_change,
+    _serialize_session,
+    _serialize_message,
+    DEBATE_BUCKET_PROJECTION,
+    CACHED_SESSION_PAGE_LIMIT,
+    SESSION_LIST_PROJECTION,
+    MESSAGE_PROJECTION,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+# Async clients are bound to the event loop that created them, so there is one
+# per loop, closed when that loop shuts down
+_async_clients = {}
+_async_services = {}
+_async_clients_pid = None
+_async_clients_lock = threading.Lock()
+
+
+def get_async_mongo_client():
+    """Return the AsyncMongoClient for the running event loop, creating it on first use.
+
+    Under an ASGI server there is one loop per worker, so this is a single
+    pooled client. Under WSGI, asgiref runs each async view in its own
+    asyncio.run loop; that loop's client is closed as the loop shuts down
+    rather than leaking its pool and monitor tasks.
+    """
+    global _async_clients_pid
+    loop = asyncio.get_running_loop()
+    with _async_clients_lock:
+        if _async_clients_pid != os.getpid():
+            # A forked worker must not share its parent's sockets
+            _async_clients.clear()
+            _async_services.clear()
+            _async_clients_pid = os.getpid()
+        for closed_loop in [other for other in _async_clients if other.is_closed()]:
+            # Closed without cancelling its tasks; nothing left to await the close on
+            _drop_loop(closed_loop)
+
+        entry = _async_clients.get(loop)
+        if entry is not None:
+            return entry[0]
+
+        if not settings.MONGODB_URI:
+            raise ValueError("MONGODB_URI is not configured in settings")
+
+        client = AsyncMongoClient(
+            settings.MONGODB_URI,
+            serverSelectionTimeoutMS=10000,
+            connectTimeoutMS=10000,
+            socketTimeoutMS=20000,
+            maxPoolSize=getattr(settings, 'MONGODB_MAX_POOL_SIZE', 10),
+            minPoolSize=getattr(settings, 'MONGODB_MIN_POOL_SIZE', 0),
+            maxIdleTimeMS=getattr(settings, 'MONGODB_MAX_IDLE_TIME_MS', None),
+            retryWrites=True,
+            w='majority',
+            connect=False,  # Defer connecting until the first operation
+            event_listeners=[mongo_command_metrics]
+        )
+        # The loop only keeps a weak reference to its tasks, so the entry holds the closer
+        _async_clients[loop] = (client, loop.create_task(_close_with_loop(loop, client)))
+        return client
+
+
+async def _close_with_loop(loop, client):
+    """Wait until the loop shuts down, then close its client.
+
+    asyncio.run (and so asgiref and uvicorn) cancels every pending task
+    before closing the loop, which is what ends the wait.
+    """
+    try:
+        await loop.create_future()
+    finally:
+        with _async_clients_lock:
+            if _async_clients.get(loop, (None,))[0] is client:
+                _drop_loop(loop)
+        await client.close()
+
+
+def _drop_loop(loop):
+    """Forget a loop's client and service; caller holds _async_clients_lock"""
+    _async_clients.pop(loop, None)
+    _async_services.pop(loop, None)
+
+
+def get_async_mongodb_service():
+    """Return the AsyncMongoDBService shared by all requests on this event loop"""
+    client = get_async_mongo_client()
+    loop = asyncio.get_running_loop()
+    service = _async_services.get(loop)
+    if service is None or service.client is not client:
+        service = _async_services[loop] = AsyncMongoDBService(client=client)
+    return service
+
+
+class AsyncMongoDBService:
+    """Async counterpart of MongoDBService for the request paths served by async views.
+
+    Management commands, the job worker and the sync views keep using
+    MongoDBService; both write the same documents.
+    """
+
+    def __init__(self, client=None):
+        self.db_name = settings.MONGODB_DB_NAME
+        self.client = client if client is not None else get_async_mongo_client()
+        self.db = self.client[self.db_name]
+
+        self.ideas_collection = self.db.ideas
+        self.debates_collection = self.db.debates
+        self.debate_iterations_collection = self.db.debate_iterations
+        self.requirements_collection = self.db.requirements
+        self.users_collection = self.db.users
+        self.credit_transactions_collection = self.db.credit_transactions
+        self.chat_sessions_collection = self.db.chat_sessions
+        self.chat_messages_collection = self.db.chat_messages
+        self.idea_summaries_collection = self.db.idea_summaries
+        self.refine_jobs_collection = self.db.refine_jobs
+        self.llm_cache_collection = self.db.llm_cache
+        self.llm_quota_collection = self.db.llm_quota
+
+        # Cleared for the life of the process once the deployment turns a transaction down
+        self.use_transactions = getattr(settings, 'MONGODB_USE_TRANSACTIONS', True)
+
+    async def _invalidate(self, *keys):
+        """Drop read cache entries a write has made stale"""
+        cache = get_read_cache()
+        if cache is not None:
+            await cache.ainvalidate(*keys)
+
+    # Units of work
+    async def commit(self, unit_of_work):
+        """Write a UnitOfWork's staged operations; returns the number of round trips taken"""
+        if not len(unit_of_work):
+            return 0
+
+        if self.use_transactions:
+            try:
+                round_trips = await self._commit_in_transaction(unit_of_work)
+            except OperationFailure as e:
+                if not transactions_unsupported(e):
+                    raise
+                logger.warning("MongoDB deployment does not support transactions; committing units of work as bulk writes")
+                self.use_transactions = False
+            else:
+                unit_of_work.observe('transaction', round_trips)
+                return round_trips
+
+        round_trips = 0
+        for collection, operations in unit_of_work.batches.items():
+            await self.db[collection].bulk_write(operations, ordered=True)
+            round_trips += 1
+        unit_of_work.observe('bulk', round_trips)
+        return round_trips
+
+    async def _commit_in_transaction(self, unit_of_work):
+        """Run the bulk writes in one transaction; counts retried attempts and the commit itself"""
+        round_trips = 0
+
+        async def write_batches(session):
+            nonlocal round_trips
+            for collection, operations in unit_of_work.batches.items():
+                await self.db[collection].bulk_write(operations, ordered=True, session=session)
+                round_trips += 1
+
+        async with self.client.start_session() as session:
+            await session.with_transaction(write_batches)
+        return round_trips + 1
+
+    async def save_refinement(self, idea_data, debates, requirements_data):
+        """Save a new idea with its debate and PRD in one unit of work; returns the idea id"""
+        unit_of_work = UnitOfWork('refine')
+        idea_id = _stage_refinement(unit_of_work, idea_data, debates, requirements_data)
+        await self.commit(unit_of_work)
+        return idea_id
+
+    async def save_feedback_refinement(self, idea_id, debates, iteration_data):
+        """Save a feedback iteration's debate and PRD in one unit of work"""
+        unit_of_work = UnitOfWork('feedback')
+        _stage_feedback_refinement(unit_of_work, idea_id, debates, iteration_data)
+        await self.commit(unit_of_work)
+        await self._invalidate(*idea_keys(idea_id))
+
+    # Ideas
+    async def save_idea(self, idea_data):
+        """Save idea to MongoDB"""
+        idea_data['created_at'] = datetime.utcnow()
+        idea_data['updated_at'] = datetime.utcnow()
+        if 'user_id' not in idea_data:
+            raise ValueError("user_id is required for idea creation")
+        result = await self.ideas_collection.insert_one(idea_data)
+
+        summary = _idea_summary_document(idea_data, debate_count=0, iteration_count=0)
+        await self.idea_summaries_collection.update_one({'_id': result.inserted_id}, {'$set': summary}, upsert=True)
+        return str(result.inserted_id)
+
+    async def save_debates(self, idea_id, debates, iteration_number=None):
+        """Save an iteration's debate entries to MongoDB; iteration_number defaults to the next one"""
+        if not debates:
+            return []
+
+        if _debates_bucketed():
+            if iteration_number is None:
+                iteration_number = await self.debate_iterations_collection.count_documents({'idea_id': idea_id}) + 1
+            result = await self.debate_iterations_collection.insert_one(_debate_bucket(idea_id, iteration_number, debates))
+            inserted_ids = [str(result.inserted_id)]
+        else:
+            result = await self.debates_collection.insert_many(_debate_documents(idea_id, debates))
+            inserted_ids = [str(id) for id in result.inserted_ids]
+
+        await self.idea_summaries_collection.update_one(
+            {'_id': ObjectId(idea_id)},
+            {'$inc': {'debate_count': len(debates)}, '$set': {'updated_at': datetime.utcnow()}}
+        )
+        await self._invalidate(*idea_keys(idea_id))
+        return inserted_ids
+
+    async def _load_debate_rounds(self, idea_id):
+        """Read an idea's debates, one document per iteration when bucketed, organized by round"""
+        if _debates_bucketed():
+            buckets = await self.debate_iterations_collection.find(
+                {'idea_id': idea_id}, DEBATE_BUCKET_PROJECTION
+            ).sort('iteration_number', 1).to_list(None)
+            return _group_debate_buckets(buckets)
+        debates = await self.debates_collection.find({'idea_id': idea_id}).sort([('round_number', 1), ('timestamp', 1)]).to_list(None)
+        return _group_debate_rounds(debates)
+
+    async def save_requirements(self, idea_id, requirements_data):
+        """Save refined requirements to MongoDB"""
+        requirements_data['idea_id'] = idea_id
+        requirements_data['created_at'] = datetime.utcnow()
+        result = await self.requirements_collection.insert_one(requirements_data)
+        await self.idea_summaries_collection.update_one({'_id': ObjectId(idea_id)}, _refinement_update(requirements_data))
+        await self._invalidate(*idea_keys(idea_id))
+        return str(result.inserted_id)
+
+    async def save_feedback_iteration(self, idea_id, iteration_data):
+        """Save a feedback iteration with user feedback and new requirements"""
+        return await self.save_requirements(idea_id, iteration_data)
+
+    async def get_idea_history(self, user_id, limit=10, cursor=None):
+        """Get a page of a user's ideas, newest first, as (summaries, next_cursor)"""
+        summaries, next_cursor = await akeyset_page(
+            self.idea_summaries_collection,
+            {'user_id': user_id},
+            'created_at',
+            DESCENDING,
+            limit=limit,
+            cursor=cursor
+        )
+        return _attach_latest_requirement(summaries), next_cursor
+
+    async def get_idea_with_iterations(self, idea_id):
+        """Get idea with all its requirement iterations, through the read cache"""
+        cache = get_read_cache()
+        if cache is None:
+            return await self._load_idea_with_iterations(idea_id)
+        return await cache.aget_or_load(idea_iterations_key(idea_id), lambda: self._load_idea_with_iterations(idea_id))
+
+    async def _load_idea_with_iterations(self, idea_id):
+        """Read an idea, every PRD iteration and its debates from MongoDB"""
+        idea = await self.ideas_collection.find_one({'_id': ObjectId(idea_id)})
+        if not idea:
+            return None
+
+        # The two reads are independent, so they share one round trip of latency
+        requirements, debate_rounds = await asyncio.gather(
+            self.requirements_collection.find({'idea_id': idea_id}).sort('created_at', 1).to_list(None),
+            self._load_debate_rounds(idea_id)
+        )
+        return {
+            'idea': idea,
+            'requirements_iterations': requirements,
+            'debate_rounds': debate_rounds
+        }
+
+    # Refine jobs
+    async def get_refine_job(self, job_id, user_id=None):
+        """Get a refine job by ID, optionally scoped to its owner"""
+        query = job_filter(job_id, user_id)
+        return await self.refine_jobs_collection.find_one(query) if query else None
+
+    # Users
+    async def create_user(self, user_data):
+        """Create a new user with initial 10 credits"""
+        result = await self.users_collection.insert_one(_new_user_document(user_data))
+        user_id = str(result.inserted_id)
+        try:
+            await self.credit_transactions_collection.insert_one({
+                'user_id': user_id,
+                'transaction_type': 'initial',
+                'amount': 10,
+                'description': 'Initial credits upon account creation',
+                'created_at': datetime.utcnow()
+            })
+        except Exception as e:
+            logger.error("Error logging credit transaction: %s", e)
+        return user_id
+
+    async def get_user_by_email(self, email):
+        """Get user by email"""
+        try:
+            user = await self.users_collection.find_one({'email': email}, {'credit_outbox': 0})
+            if user:
+                user['_id'] = str(user['_id'])
+            else:
+                logger.info("User not found")
+            return user
+        except Exception as e:
+            logger.error("Error getting user by email: %s", e)
+            return None
+
+    async def get_user_by_id(self, user_id):
+        """Get user by ID"""
+        try:
+            user = await self.users_collection.find_one({'_id': ObjectId(user_id)}, {'credit_outbox': 0})
+            if user:
+                user['_id'] = str(user['_id'])
+            return user
+        except:
+            return None
+
+    async def update_user_login(self, user_id):
+        """Update user's last login time, at most once per LAST_LOGIN_WRITE_INTERVAL_SECONDS across workers"""
+        try:
+            await self.users_collection.update_one(_last_login_filter(user_id), {'$set': {'last_login': datetime.utcnow()}})
+            return True
+        except:
+            return False
+
+    # Credits
+    async def get_user_credits(self, user_id):
+        """Get user's current credit balance"""
+        try:
+            user = await self.users_collection.find_one({'_id': ObjectId(user_id)}, {'credits': 1})
+            return user.get('credits', 0) if user else 0
+        except:
+            return 0
+
+    async def _change_credits(self, user_id, amount, transaction_type, description, require_balance=False):
+        """Apply a credit delta and queue its ledger entry in one atomic update (see MongoDBService)"""
+        query, update = _credit_change(user_id, amount, transaction_type, description, require_balance)
+        user = await self.users_collection.find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
+        if user is None:
+            return None
+
+        outbox = user.pop('credit_outbox', [])
+        if len(outbox) >= getattr(settings, 'CREDIT_OUTBOX_FLUSH_SIZE', 20):
+            await self._flush_entries(user['_id'], outbox)
+        user['_id'] = str(user['_id'])
+
+        verified_user_cache.update_user(user)
+        return user
+
+    async def reserve_credits(self, user_id, amount, description='Requirement generation'):
+        """Atomically deduct credits if the balance covers them; returns the updated user or None"""
+        user = await self._change_credits(user_id, -amount, 'deduction', description, require_balance=True)
+        if user is None:
+            CREDIT_RESERVATION_FAILURES.inc()
+        return user
+
+    async def refund_credits(self, user_id, amount, description):
+        """Return reserved credits after a failed operation; returns the updated user or None"""
+        return await self._change_credits(user_id, amount, 'refund', description)
+
+    async def _flush_entries(self, user_oid, entries):
+        """Insert outbox entries into the ledger, then drop them from the user document"""
+        try:
+            await self.credit_transactions_collection.insert_many(entries, ordered=False)
+        except BulkWriteError as e:
+            if any(error.get('code') != 11000 for error in e.details.get('writeErrors', [])):
+                logger.error("Error flushing credit ledger: %s", e)
+                return
+        await self.users_collection.update_one(
+            {'_id': user_oid},
+            {'$pull': {'credit_outbox': {'_id': {'$in': [entry['_id'] for entry in entries]}}}}
+        )
+
+    # Chat sessions
+    async def create_chat_session(self, user_id, title="New Chat", idea_summary=""):
+        """Create a new chat session"""
+        try:
+            result = await self.chat_sessions_collection.insert_one({
+                'user_id': user_id,
+                'title': title,
+                'idea_summary': idea_summary,
+                'status': 'active',
+                'created_at': datetime.utcnow(),
+                'updated_at': datetime.utcnow()
+            })
+            await self._invalidate(chat_sessions_key(user_id))
+            return str(result.inserted_id)
+        except Exception as e:
+            logger.error("Error creating chat session: %s", e)
+            return None
+
+    async def get_user_chat_sessions(self, user_id, limit=50, cursor=None):
+        """Get a page of a user's chat sessions, most recently updated first, as (sessions, next_cursor)"""
+        try:
+            cache = get_read_cache()
+            if cache is None or cursor is not None or limit != CACHED_SESSION_PAGE_LIMIT:
+                return await self._load_user_chat_sessions(user_id, limit, cursor)
+            return await cache.aget_or_load(chat_sessions_key(user_id), lambda: self._load_user_chat_sessions(user_id, limit, cursor))
+        except InvalidCursor:
+            raise
+        except Exception as e:
+            logger.error("Error getting user chat sessions: %s", e)
+            return [], None
+
+    async def _load_user_chat_sessions(self, user_id, limit, cursor):
+        """Read a page of chat sessions from MongoDB; errors propagate so they are never cached"""
+        sessions, next_cursor = await akeyset_page(
+            self.chat_sessions_collection,
+            {'user_id': user_id},
+            'updated_at',
+            DESCENDING,
+            limit=limit,
+            cursor=cursor,
+            projection=SESSION_LIST_PROJECTION
+        )
+        return [_serialize_session(session) for session in sessions], next_cursor
+
+    async def get_chat_session(self, session_id):
+        """Get a specific chat session by ID"""
+        try:
+            session = await self.chat_sessions_collection.find_one({'_id': ObjectId(session_id)})
+            return _serialize_session(session) if session else None
+        except Exception as e:
+            logger.error("Error getting chat session: %s", e)
+            return None
+
+    async def update_chat_session(self, session_id, updates):
+        """Update a chat session"""
+        try:
+            updates['updated_at'] = datetime.utcnow()
+            # Return the owner so their cached session list can be dropped
+            session = await self.chat_sessions_collection.find_one_and_update(
+                {'_id': ObjectId(session_id)},
+                {'$set': updates},
+                projection={'user_id': 1}
+            )
+            if session is None:
+                return False
+            await self._invalidate(chat_sessions_key(session['user_id']))
+            return True
+        except Exception as e:
+            logger.error("Error updating chat session: %s", e)
+            return False
+
+    async def delete_chat_session(self, session_id):
+        """Delete a chat session and all its messages"""
+        try:
+            await self.chat_messages_collection.delete_many({'session_id': session_id})
+            session = await self.chat_sessions_collection.find_one_and_delete({'_id': ObjectId(session_id)}, projection={'user_id': 1})
+            if session is None:
+                return False
+            await self._invalidate(chat_sessions_key(session['user_id']))
+            return True
+        except Exception as e:
+            logger.error("Error deleting chat session: %s", e)
+            return False
+
+    async def add_chat_message(self, session_id, role, content, round_number=1):
+        """Add a new message to a chat session"""
+        try:
+            result = await self.chat_messages_collection.insert_one({
+                'session_id': session_id,
+                'role': role,
+                'content': content,
+                'round_number': round_number,
+                'timestamp': datetime.utcnow()
+            })
+            await self.update_chat_session(session_id, {})
+            return str(result.inserted_id)
+        except Exception as e:
+            logger.error("Error adding chat message: %s", e)
+            return None
+
+    async def get_chat_messages(self, session_id, limit=100, cursor=None):
+        """Get a page of a chat session's messages, oldest first, as (messages, next_cursor)"""
+        try:
+            messages, next_cursor = await akeyset_page(
+                self.chat_messages_collection,
+                {'session_id': session_id},
+                'timestamp',
+                ASCENDING,
+                limit=limit,
+                cursor=cursor,
+                projection=MESSAGE_PROJECTION
+            )
+            return [_serialize_message(message) for message in messages], next_cursor
+        except InvalidCursor:
+            raise
+        except Exception as e:
+            logger.error("Error getting chat messages: %s", e)
+            return [], None
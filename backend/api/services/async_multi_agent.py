@@ -0,0 +1,286 @@
+import asyncio
+import logging
+from .multi_agent import MultiAgentSystem, AggregationError, DEBATE_MODE_PANEL, PRD_FORMAT_TEXT, ROUNDS
+from .llm_providers import is_rate_limit_error
+from .metrics import llm_call
+from .debate_context import build_debate_context
+from .prd_parser import PrdSectionParser, parse_prd_sections
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncMultiAgentSystem(MultiAgentSystem):
+    """MultiAgentSystem whose LLM calls are awaited instead of holding a thread each.
+
+    Prompts, fallbacks, convergence and quota rules are inherited unchanged.
+    The shared quota ledger and response cache are awaited through their
+    async methods, so no thread is held while Mongo answers either.
+    """
+
+    async def _acached_response(self, messages):
+        """Async _get_cached_response"""
+        if self.cache is None:
+            return None, None
+        key = self._cache_key(messages)
+        return key, self._count_cache_hit(await self.cache.aget(key))
+
+    async def _astore_cached_response(self, key, content):
+        """Async _store_cached_response"""
+        if self.cache is not None and key is not None and content:
+            await self.cache.aset(key, content)
+
+    async def _aledger_call(self, operation, default=None):
+        """Async _ledger_call"""
+        try:
+            return await getattr(self.quota_ledger, f'a{operation}')(self.model_name)
+        except Exception as e:
+            logger.warning("Quota ledger %s failed: %s", operation, e)
+            return default
+
+    async def _areserve_api_call(self):
+        """Async _reserve_api_call"""
+        if not self._claim_request_call():
+            return False
+
+        if await self._aledger_call('reserve', default=True):
+            return True
+
+        self._release_request_call()
+        return False
+
+    async def _acommit_api_call(self):
+        """Async _commit_api_call"""
+        await self._aledger_call('commit')
+
+    async def _amark_quota_exhausted(self, error_msg=""):
+        """Async _mark_quota_exhausted"""
+        if self._stop_api_calls(error_msg):
+            await self._aledger_call('mark_exhausted')
+
+    async def _astart_session(self, planned_rounds):
+        """Async _start_session"""
+        self._reset_session()
+        return self._rounds_for_quota(planned_rounds, await self._aledger_call('remaining'))
+
+    async def _ainvoke_llm(self, messages, agent_key, llm=None):
+        """Async _invoke_llm"""
+        with llm_call(self.model_name, agent_key, messages) as call:
+            response = await (llm or self.llm).ainvoke(messages)
+            call.record(response)
+        return response
+
+    async def _astream_llm(self, messages, agent_key):
+        """Async _stream_llm"""
+        with llm_call(self.model_name, agent_key, messages) as call:
+            chunks = []
+            try:
+                async for chunk in self.llm.astream(messages):
+                    chunks.append(chunk.content or "")
+                    yield chunk
+            finally:
+                call.record_text("".join(chunks))
+
+    async def _acall_llm(self, messages, agent_key, llm=None):
+        """Reserve quota and await one LLM call; returns (content, error_msg), content None if no call was made"""
+        if not await self._areserve_api_call():
+            return None, None
+
+        try:
+            response = await self._ainvoke_llm(messages, agent_key, llm=llm)
+        except Exception as e:
+            error_msg = str(e)
+            if is_rate_limit_error(error_msg):
+                await self._amark_quota_exhausted(error_msg)
+                return None, None
+            await self._acommit_api_call()  # The request reached the provider and still counts
+            return None, error_msg
+
+        await self._acommit_api_call()
+        return response.content, None
+
+    async def _aget_agent_turn(self, agent_key, idea, context="", user_feedback=""):
+        """Async _get_agent_turn"""
+        messages = self._build_agent_messages(agent_key, idea, context, user_feedback=user_feedback)
+
+        cache_key, cached = await self._acached_response(messages)
+        if cached is not None:
+            return cached, False
+
+        content, error_msg = await self._acall_llm(messages, agent_key)
+        if error_msg is not None:
+            return f"Error getting response from {self.agents[agent_key]['name']}: {error_msg}", False
+        if content is None:
+            return self._get_fallback_response(agent_key, idea), True
+
+        await self._astore_cached_response(cache_key, content)
+        return content, False
+
+    async def _aget_panel_turns(self, idea, context="", user_feedback=""):
+        """Async _get_panel_turns"""
+        messages = self._build_panel_messages(idea, context, user_feedback)
+
+        cache_key, cached = await self._acached_response(messages)
+        if cached is not None:
+            return self._parse_panel_response(cached)
+
+        content, _ = await self._acall_llm(messages, 'panel')
+        if content is None:
+            return {}
+
+        panel = self._parse_panel_response(content)
+        if len(panel) == len(self.agents):
+            await self._astore_cached_response(cache_key, content)
+        else:
+            logger.warning("Panel response covered %d/%d agents, falling back per agent", len(panel), len(self.agents))
+        return panel
+
+    async def _arun_round(self, idea, round_number, context="", user_feedback="", on_event=None):
+        """Async _run_round; at most max_concurrency agent calls are in flight at once"""
+        turns = {}
+
+        if self.debate_mode == DEBATE_MODE_PANEL:
+            panel = await self._aget_panel_turns(idea, context=context, user_feedback=user_feedback)
+            for agent_key in self.agents.keys():
+                if agent_key in panel:
+                    turns[agent_key] = (panel[agent_key], False)
+                    self._emit_turn(agent_key, turns[agent_key], round_number, on_event)
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def agent_turn(agent_key):
+            async with semaphore:
+                turn = await self._aget_agent_turn(agent_key, idea, context=context, user_feedback=user_feedback)
+            turns[agent_key] = turn
+            self._emit_turn(agent_key, turn, round_number, on_event)
+
+        await asyncio.gather(*(agent_turn(agent_key) for agent_key in self.agents.keys() if agent_key not in turns))
+        return self._round_log(turns, round_number)
+
+    async def _arun_rounds(self, idea, rounds, history, round_offset=0, user_feedback="", on_event=None):
+        """Run debate rounds until the round limit, convergence or the quota stops them"""
+        debate_log = []
+        tracker = self._convergence_tracker(rounds)
+        for round_num in range(1, rounds + 1):
+            context = build_debate_context(history + debate_log, self.context_token_budget)
+            round_responses = await self._arun_round(
+                idea,
+                round_offset + round_num,
+                context=context,
+                user_feedback=user_feedback,
+                on_event=on_event
+            )
+            debate_log.extend(round_responses)
+            self.rounds_executed += 1
+
+            # Stop early once the panel's positions have settled
+            if tracker.observe(round_offset + round_num, round_responses):
+                logger.info("Debate converged after round %d, skipping %d round(s)", round_offset + round_num, rounds - round_num)
+                break
+
+            if not self.check_api_quota():
+                break
+
+        self.convergence_scores = tracker.scores
+        return debate_log
+
+    async def arun_debate(self, idea, rounds=ROUNDS, on_event=None):
+        """Async run_debate"""
+        if not self.check_api_quota():
+            debate_log = self._fallback_debate_log(idea, 1)
+            self._emit_turns(debate_log, on_event)
+            return debate_log
+        return await self._arun_rounds(idea, rounds, [], on_event=on_event)
+
+    async def arun_feedback_debate(self, idea, previous_debate_log, user_feedback, rounds=ROUNDS, on_event=None):
+        """Async run_feedback_debate"""
+        round_offset = len(previous_debate_log) // len(self.agents)
+        if not self.check_api_quota():
+            debate_log = self._fallback_debate_log(idea, round_offset + 1)
+            self._emit_turns(debate_log, on_event)
+            return debate_log
+        return await self._arun_rounds(
+            idea, rounds, previous_debate_log, round_offset=round_offset, user_feedback=user_feedback, on_event=on_event
+        )
+
+    async def _aaggregate(self, idea, debate_log, on_event=None):
+        """Async _aggregate"""
+        if on_event is not None:
+            section_parser = PrdSectionParser()
+            async for chunk in self.astream_aggregate_results(idea, debate_log):
+                self._emit_prd_chunk(section_parser, chunk, on_event)
+            return self._streamed_sections(section_parser, on_event)
+
+        messages = self._build_aggregation_prompt(idea, debate_log).format_messages()
+        cache_key, cached = await self._acached_response(messages)
+        if cached is not None:
+            return self._prd_sections(cached)
+
+        content, error_msg = await self._acall_llm(messages, 'aggregator', llm=self._aggregation_llm())
+        if error_msg is not None:
+            raise AggregationError(f"Error aggregating results: {error_msg}")
+        if content is None:
+            return parse_prd_sections(self._get_fallback_aggregation(idea, debate_log))
+
+        sections = self._prd_sections(content)
+        await self._astore_cached_response(cache_key, content)
+        return sections
+
+    async def astream_aggregate_results(self, idea, debate_log):
+        """Async stream_aggregate_results"""
+        messages = self._build_aggregation_prompt(idea, debate_log, prd_format=PRD_FORMAT_TEXT).format_messages()
+        cache_key, cached = await self._acached_response(messages)
+        if cached is not None:
+            yield cached
+            return
+
+        if not await self._areserve_api_call():
+            yield self._get_fallback_aggregation(idea, debate_log)
+            return
+
+        chunks = []
+        committed = False
+
+        try:
+            async for chunk in self._astream_llm(messages, 'aggregator'):
+                if not committed:
+                    # The provider accepted the call once the first chunk arrives
+                    await self._acommit_api_call()
+                    committed = True
+                if chunk.content:
+                    chunks.append(chunk.content)
+                    yield chunk.content
+            if not committed:
+                await self._acommit_api_call()
+            await self._astore_cached_response(cache_key, "".join(chunks))
+        except Exception as e:
+            error_msg = str(e)
+            if not is_rate_limit_error(error_msg):
+                if not committed:
+                    await self._acommit_api_call()  # The request reached the provider and still counts
+                raise AggregationError(f"Error aggregating results: {error_msg}") from e
+            await self._amark_quota_exhausted(error_msg)
+            # Part of the PRD already reached the client; a fallback appended to it would read as one document
+            if chunks:
+                raise AggregationError(f"Error aggregating results: cut off after {len(chunks)} chunk(s): {error_msg}") from e
+            yield self._get_fallback_aggregation(idea, debate_log)
+
+    async def arefine_requirements(self, idea, on_event=None):
+        """Async refine_requirements"""
+        try:
+            rounds = await self._astart_session(self.max_rounds)
+            debate_log = await self.arun_debate(idea, rounds=rounds, on_event=on_event)
+            sections = await self._aaggregate(idea, debate_log, on_event)
+            return self._session_result(debate_log, sections)
+        except Exception as e:
+            return self._session_error(e)
+
+    async def arefine_requirements_with_feedback(self, idea, previous_debate_log, user_feedback, on_event=None):
+        """Async refine_requirements_with_feedback"""
+        try:
+            rounds = await self._astart_session(ROUNDS)
+            debate_log = await self.arun_feedback_debate(idea, previous_debate_log, user_feedback, rounds=rounds, on_event=on_event)
+            sections = await self._aaggregate(idea, debate_log, on_event)
+            return self._session_result(debate_log, sections)
+        except Exception as e:
+            return self._session_error(e)
@@ -0,0 +1,69 @@
+import re
+from django.conf import settings
+
+
+SHINGLE_SIZE = 3
+
+_WORD = re.compile(r"[a-z0-9']+")
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    """Return the set of overlapping word n-grams in text, ignoring case and punctuation"""
+    words = _WORD.findall((text or '').lower())
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def jaccard_similarity(text_a, text_b, size=SHINGLE_SIZE):
+    """Shingled Jaccard similarity between two texts, from 0.0 (disjoint) to 1.0 (identical)"""
+    a, b = shingles(text_a, size), shingles(text_b, size)
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def round_change(previous_round, current_round):
+    """Measure how much each agent's response moved between two rounds of debate entries.
+
+    Returns (panel_change, agent_changes) where each change is 1 - Jaccard
+    similarity and panel_change is the mean over agents present in both rounds,
+    or None when no agent can be compared.
+    """
+    previous = {entry['agent']: entry['response'] for entry in previous_round}
+    agent_changes = {
+        entry['agent']: round(1.0 - jaccard_similarity(previous[entry['agent']], entry['response']), 4)
+        for entry in current_round
+        if entry['agent'] in previous
+    }
+    if not agent_changes:
+        return None, agent_changes
+    return round(sum(agent_changes.values()) / len(agent_changes), 4), agent_changes
+
+
+class ConvergenceTracker:
+    """Decides when a debate has settled enough that further rounds add little"""
+
+    def __init__(self, threshold=None, min_rounds=None):
+        if threshold is None:
+            threshold = getattr(settings, 'DEBATE_CONVERGENCE_THRESHOLD', 0.35)
+        if min_rounds is None:
+            min_rounds = getattr(settings, 'DEBATE_MIN_ROUNDS', 2)
+        self.threshold = threshold
+        self.min_rounds = max(1, int(min_rounds))
+        self.scores = []
+        self.rounds_observed = 0
+        self._previous_round = None
+
+    def observe(self, round_number, round_entries):
+        """Record a finished round; returns True when the debate has converged"""
+        self.rounds_observed += 1
+        previous_round, self._previous_round = self._previous_round, round_entries
+        if previous_round is None:
+            return False
+
+        panel_change, agent_changes = round_change(previous_round, round_entries)
+        if panel_change is None:
+            return False
+        self.scores.append({'round': round_number, 'change': panel_change, 'agents': agent_changes})
+        return self.rounds_observed >= self.min_rounds and panel_change < self.threshold
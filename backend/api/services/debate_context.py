@@ -0,0 +1,94 @@
+import re
+from django.conf import settings
+
+
+# Rough English average for Gemini/SentencePiece tokenizers; good enough for budgeting
+CHARS_PER_TOKEN = 4
+STANCE_SUMMARY_MAX_CHARS = 320
+STANCE_KEYWORDS = ('suggest', 'recommend', 'should', 'must', 'propose', 'priorit')
+
+_SENTENCE_SPLIT = re.compile(r'(?<=[.!?])\s+')
+_MARKDOWN_NOISE = re.compile(r'[*#>`_]+')
+
+
+def estimate_tokens(text):
+    """Estimate the token count of text without calling the tokenizer"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _truncate(text, max_chars):
+    """Cut text to max_chars on a word boundary"""
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max(0, max_chars - 1)].rsplit(' ', 1)[0]
+    return cut + '…'
+
+
+def summarize_stance(response, max_chars=STANCE_SUMMARY_MAX_CHARS):
+    """Extract a compact stance from an agent response: its opening sentence plus its key recommendation"""
+    text = _MARKDOWN_NOISE.sub('', response or '')
+    sentences = [sentence.strip() for sentence in _SENTENCE_SPLIT.split(' '.join(text.split())) if sentence.strip()]
+    if not sentences:
+        return ''
+
+    picked = [sentences[0]]
+    for sentence in sentences[1:]:
+        if any(keyword in sentence.lower() for keyword in STANCE_KEYWORDS):
+            picked.append(sentence)
+            break
+
+    return _truncate(' '.join(picked), max_chars)
+
+
+def _group_rounds(debate_log):
+    """Group debate entries by round number, preserving order within a round"""
+    rounds = {}
+    for entry in debate_log:
+        rounds.setdefault(int(entry['round']), []).append(entry)
+    return rounds
+
+
+def build_debate_context(debate_log, token_budget=None):
+    """Build a prompt context that stays within token_budget however long the debate gets.
+
+    The latest round is kept verbatim; every earlier round is folded into one
+    stance line per agent, using the summary stored with each debate entry.
+    """
+    if not debate_log:
+        return ""
+    if token_budget is None:
+        token_budget = getattr(settings, 'DEBATE_CONTEXT_TOKEN_BUDGET', 3000)
+    budget_chars = token_budget * CHARS_PER_TOKEN
+
+    rounds = _group_rounds(debate_log)
+    latest_round = max(rounds)
+
+    # Each agent's most recent stance from the older rounds
+    stances = {}
+    for round_num in sorted(rounds):
+        if round_num == latest_round:
+            continue
+        for entry in rounds[round_num]:
+            stance = entry.get('summary') or summarize_stance(entry['response'])
+            if stance:
+                stances[entry['agent']] = (round_num, stance)
+
+    parts = []
+    if stances:
+        stance_lines = "\n".join(
+            f"- {agent} (as of round {round_num}): {stance}"
+            for agent, (round_num, stance) in stances.items()
+        )
+        # Stances never take more than a third of the budget
+        parts.append(_truncate(f"Earlier positions:\n{stance_lines}", budget_chars // 3))
+
+    latest = rounds[latest_round]
+    header = f"Latest round ({latest_round}):"
+    overhead = len(header) + sum(len(entry['agent']) + 4 for entry in latest) + sum(len(part) + 2 for part in parts)
+    per_response = max((budget_chars - overhead) // len(latest), 0)
+    parts.append(header + "\n" + "\n\n".join(
+        f"{entry['agent']}: {_truncate(entry['response'], per_response)}"
+        for entry in latest
+    ))
+
+    return "\n\n".join(parts)
@@ -0,0 +1,186 @@
+from datetime import datetime
+from django.conf import settings
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+
+# Stored in schema_migrations under this _id
+MIGRATION_STATE_ID = 'indexes'
+
+# Index-not-found error code from the server
+INDEX_NOT_FOUND = 27
+
+
+def _drop_index_if_exists(collection, name):
+    """Drop an index by name, ignoring indexes that were never created"""
+    try:
+        collection.drop_index(name)
+    except OperationFailure as e:
+        if e.code != INDEX_NOT_FOUND:
+            raise
+
+
+def _initial_indexes(service):
+    """Single-field indexes the service created on every startup before migrations existed"""
+    service.users_collection.create_index("email", unique=True)
+    service.users_collection.create_index("created_at")
+    service.ideas_collection.create_index("created_at")
+    service.ideas_collection.create_index("user_id")
+    service.debates_collection.create_index("idea_id")
+    service.debates_collection.create_index("round_number")
+    service.requirements_collection.create_index("idea_id")
+    service.requirements_collection.create_index("created_at")
+    service.credit_transactions_collection.create_index("user_id")
+    service.credit_transactions_collection.create_index("created_at")
+    service.chat_sessions_collection.create_index("user_id")
+    service.chat_sessions_collection.create_index("created_at")
+    service.chat_sessions_collection.create_index("status")
+    service.chat_messages_collection.create_index("session_id")
+    service.chat_messages_collection.create_index("round_number")
+    service.chat_messages_collection.create_index("timestamp")
+    service.llm_quota_collection.create_index("expires_at", expireAfterSeconds=0)
+    service.refine_jobs_collection.create_index([("status", 1), ("created_at", 1)])
+    service.refine_jobs_collection.create_index("user_id")
+    service.llm_cache_collection.create_index(
+        "created_at",
+        expireAfterSeconds=getattr(settings, 'LLM_CACHE_TTL_SECONDS', 7 * 24 * 60 * 60)
+    )
+    service.idea_summaries_collection.create_index([("user_id", 1), ("created_at", -1), ("_id", -1)])
+    service.credit_transactions_collection.create_index([("user_id", 1), ("created_at", -1), ("_id", -1)])
+    service.chat_sessions_collection.create_index([("user_id", 1), ("updated_at", -1), ("_id", -1)])
+    service.chat_messages_collection.create_index([("session_id", 1), ("timestamp", 1), ("_id", 1)])
+
+
+def _compound_access_paths(service):
+    """Give every filter-then-sort query its own compound index and drop the single-field ones it replaces"""
+    # Debates and requirements are always read per idea in round/time order
+    service.debates_collection.create_index([("idea_id", 1), ("round_number", 1), ("timestamp", 1)])
+    service.requirements_collection.create_index([("idea_id", 1), ("created_at", 1)])
+    service.ideas_collection.create_index([("user_id", 1), ("created_at", -1)])
+
+    # Each of these is a prefix of a compound index or serves no query
+    redundant = {
+        service.users_collection: ["created_at_1"],
+        service.ideas_collection: ["created_at_1", "user_id_1"],
+        service.debates_collection: ["idea_id_1", "round_number_1"],
+        service.requirements_collection: ["idea_id_1", "created_at_1"],
+        service.credit_transactions_collection: ["user_id_1", "created_at_1"],
+        service.chat_sessions_collection: ["user_id_1", "created_at_1", "status_1"],
+        service.chat_messages_collection: ["session_id_1", "round_number_1", "timestamp_1"],
+        service.refine_jobs_collection: ["user_id_1"],
+    }
+    for collection, names in redundant.items():
+        for name in names:
+            _drop_index_if_exists(collection, name)
+
+
+def _debate_buckets(service):
+    """Index the per-iteration debate documents the way they are read: per idea in iteration order"""
+    service.debate_iterations_collection.create_index([("idea_id", 1), ("iteration_number", 1)])
+
+
+# Applied in order; append new migrations, never edit or reorder applied ones
+MIGRATIONS = [
+    (1, 'Initial single-field indexes', _initial_indexes),
+    (2, 'Compound indexes per access path', _compound_access_paths),
+    (3, 'Bucketed debate iterations', _debate_buckets),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_applied_version(service):
+    """Return the index migration version recorded in the database, 0 if none"""
+    state = service.schema_migrations_collection.find_one({'_id': MIGRATION_STATE_ID})
+    return state['version'] if state else 0
+
+
+def apply_index_migrations(service, target_version=None, log=print):
+    """Apply pending index migrations in order, recording each one; returns the resulting version"""
+    target_version = LATEST_VERSION if target_version is None else target_version
+    version = get_applied_version(service)
+
+    for migration_version, description, migrate in MIGRATIONS:
+        if migration_version <= version or migration_version > target_version:
+            continue
+        log(f"🔧 Applying index migration {migration_version}: {description}")
+        migrate(service)
+        service.schema_migrations_collection.update_one(
+            {'_id': MIGRATION_STATE_ID},
+            {
+                '$set': {'version': migration_version, 'updated_at': datetime.utcnow()},
+                '$push': {'applied': {
+                    'version': migration_version,
+                    'description': description,
+                    'applied_at': datetime.utcnow()
+                }}
+            },
+            upsert=True
+        )
+        version = migration_version
+    return version
+
+
+def service_query_shapes(service):
+    """The filter/sort shapes the service issues on hot paths, as (name, collection, filter, sort)"""
+    some_id = '000000000000000000000000'
+    some_time = datetime(2000, 1, 1)
+    return [
+        ('user by email', service.users_collection, {'email': 'user@example.com'}, None),
+        ('debates for idea', service.debates_collection,
+         {'idea_id': some_id}, [('round_number', ASCENDING), ('timestamp', ASCENDING)]),
+        ('debate iterations for idea', service.debate_iterations_collection,
+         {'idea_id': some_id}, [('iteration_number', ASCENDING)]),
+        ('requirement iterations', service.requirements_collection,
+         {'idea_id': some_id}, [('created_at', ASCENDING)]),
+        ('latest requirement', service.requirements_collection,
+         {'idea_id': some_id}, [('created_at', DESCENDING)]),
+        ('history page', service.idea_summaries_collection,
+         {'user_id': some_id}, [('created_at', DESCENDING), ('_id', DESCENDING)]),
+        ('history next page', service.idea_summaries_collection,
+         {'$and': [{'user_id': some_id}, {'$or': [
+             {'created_at': {'$lt': some_time}},
+             {'created_at': some_time, '_id': {'$lt': some_id}}
+         ]}]}, [('created_at', DESCENDING), ('_id', DESCENDING)]),
+        ('chat sessions page', service.chat_sessions_collection,
+         {'user_id': some_id}, [('updated_at', DESCENDING), ('_id', DESCENDING)]),
+        ('chat messages page', service.chat_messages_collection,
+         {'session_id': some_id}, [('timestamp', ASCENDING), ('_id', ASCENDING)]),
+        ('transactions page', service.credit_transactions_collection,
+         {'user_id': some_id}, [('created_at', DESCENDING), ('_id', DESCENDING)]),
+        ('claim next job', service.refine_jobs_collection,
+         {'$or': [{'status': 'queued'}, {'status': 'running', 'lease_expires_at': {'$lt': some_time}}],
+          'attempts': {'$lt': 2}}, [('created_at', ASCENDING)]),
+    ]
+
+
+def find_plan_problems(explain_output):
+    """Return the COLLSCAN and in-memory SORT stages in a winning plan"""
+    planner = explain_output.get('queryPlanner', {})
+    winning_plan = planner.get('winningPlan', {})
+    # Slot-based engine plans nest the classic plan under queryPlan
+    winning_plan = winning_plan.get('queryPlan', winning_plan)
+
+    problems = []
+    stack = [winning_plan]
+    while stack:
+        stage = stack.pop()
+        if stage.get('stage') in ('COLLSCAN', 'SORT'):
+            problems.append(stage['stage'])
+        if 'inputStage' in stage:
+            stack.append(stage['inputStage'])
+        stack.extend(stage.get('inputStages', []))
+    return problems
+
+
+def check_query_plans(service):
+    """Explain every service query shape; returns {query name: problems} for plans that scan or sort in memory"""
+    failures = {}
+    for name, collection, query, sort in service_query_shapes(service):
+        cursor = collection.find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        problems = find_plan_problems(cursor.explain())
+        if problems:
+            failures[name] = problems
+    return failures
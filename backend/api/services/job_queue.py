@@ -0,0 +1,242 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+from bson import ObjectId
+from django.conf import settings
+from pymongo import ReturnDocument
+
+from .refine_pipeline import run_refinement, run_feedback_refinement, saved_refinement_result
+
+
+logger = logging.getLogger(__name__)
+
+JOB_TYPE_REFINE = 'refine'
+JOB_TYPE_FEEDBACK = 'feedback'
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+
+TERMINAL_STATUSES = (JOB_SUCCEEDED, JOB_FAILED)
+
+
+def job_filter(job_id, user_id=None):
+    """Query for a job by ID, optionally scoped to its owner; None when job_id is not an ObjectId"""
+    try:
+        query = {'_id': ObjectId(job_id)}
+    except Exception:
+        return None
+    if user_id is not None:
+        query['user_id'] = user_id
+    return query
+
+
+class JobQueue:
+    """Mongo-backed queue of refine jobs executed by the run_job_worker command"""
+
+    def __init__(self, mongodb_service):
+        self.mongodb_service = mongodb_service
+        self.collection = mongodb_service.refine_jobs_collection
+        self.lease_seconds = getattr(settings, 'JOB_LEASE_SECONDS', 600)
+        self.max_attempts = getattr(settings, 'JOB_MAX_ATTEMPTS', 2)
+
+    def enqueue(self, job_type, user_id, payload, credits_charged, credit_description):
+        """Persist a new job; the credits it was charged are refunded if it fails"""
+        now = datetime.utcnow()
+        job_doc = {
+            'job_type': job_type,
+            'user_id': user_id,
+            'payload': payload,
+            'status': JOB_QUEUED,
+            'attempts': 0,
+            'credits_charged': credits_charged,
+            'credit_description': credit_description,
+            'credits_refunded': False,
+            'result': None,
+            'error': None,
+            'created_at': now,
+            'updated_at': now
+        }
+        result = self.collection.insert_one(job_doc)
+        return str(result.inserted_id)
+
+    def get_job(self, job_id, user_id=None):
+        """Get a job by ID, optionally scoped to its owner"""
+        query = job_filter(job_id, user_id)
+        return self.collection.find_one(query) if query else None
+
+    def claim_next(self, worker_id):
+        """Atomically claim the oldest queued job, or one whose worker's lease expired"""
+        now = datetime.utcnow()
+        return self.collection.find_one_and_update(
+            {
+                '$or': [
+                    {'status': JOB_QUEUED},
+                    {'status': JOB_RUNNING, 'lease_expires_at': {'$lt': now}}
+                ],
+                'attempts': {'$lt': self.max_attempts}
+            },
+            {
+                '$set': {
+                    'status': JOB_RUNNING,
+                    'worker_id': worker_id,
+                    'started_at': now,
+                    'lease_expires_at': now + timedelta(seconds=self.lease_seconds),
+                    'updated_at': now
+                },
+                '$inc': {'attempts': 1}
+            },
+            sort=[('created_at', 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _owned(self, job_id, worker_id):
+        """Filter matching a job only while it is running under worker_id's claim"""
+        return {'_id': ObjectId(job_id), 'status': JOB_RUNNING, 'worker_id': worker_id}
+
+    def renew_lease(self, job_id, worker_id):
+        """Push back the lease of a job this worker still holds; returns False once it has lost it"""
+        now = datetime.utcnow()
+        result = self.collection.update_one(
+            self._owned(job_id, worker_id),
+            {'$set': {'lease_expires_at': now + timedelta(seconds=self.lease_seconds), 'updated_at': now}}
+        )
+        return result.matched_count > 0
+
+    def complete(self, job_id, result, worker_id):
+        """Mark a job this worker holds as succeeded; returns False if its claim was lost to another worker"""
+        update = self.collection.update_one(
+            self._owned(job_id, worker_id),
+            {'$set': {
+                'status': JOB_SUCCEEDED,
+                'result': result,
+                'finished_at': datetime.utcnow(),
+                'updated_at': datetime.utcnow()
+            }}
+        )
+        return update.matched_count > 0
+
+    def fail(self, job_id, error, worker_id):
+        """Mark a job this worker holds as failed and refund it; returns False if its claim was lost"""
+        return self._fail(self._owned(job_id, worker_id), error)
+
+    def _fail(self, query, error):
+        """Fail the job matching query and refund it, only if the update matched"""
+        update = self.collection.update_one(
+            query,
+            {'$set': {
+                'status': JOB_FAILED,
+                'error': error,
+                'finished_at': datetime.utcnow(),
+                'updated_at': datetime.utcnow()
+            }}
+        )
+        if update.matched_count == 0:
+            return False
+        self.refund(str(query['_id']))
+        return True
+
+    def refund(self, job_id):
+        """Refund a job's credits exactly once, however many workers race to do it"""
+        job = self.collection.find_one_and_update(
+            {'_id': ObjectId(job_id), 'credits_refunded': False, 'credits_charged': {'$gt': 0}},
+            {'$set': {'credits_refunded': True, 'updated_at': datetime.utcnow()}}
+        )
+        if job:
+            self.mongodb_service.refund_credits(
+                job['user_id'],
+                job['credits_charged'],
+                f"Credit refund - {job['credit_description'].lower()} failed"
+            )
+        return job is not None
+
+    def fail_abandoned(self):
+        """Fail jobs whose lease expired after their last allowed attempt"""
+        query = {
+            'status': JOB_RUNNING,
+            'lease_expires_at': {'$lt': datetime.utcnow()},
+            'attempts': {'$gte': self.max_attempts}
+        }
+        count = 0
+        for job in self.collection.find(query, {'_id': 1}):
+            # Re-check the lease in the update, so a worker that renewed it meanwhile keeps the job
+            if self._fail(dict(query, _id=job['_id']), 'Job was abandoned by its worker'):
+                count += 1
+        return count
+
+    def _keep_lease(self, job_id, worker_id, stop):
+        """Renew the lease every third of its length until stop is set or the claim is lost"""
+        while not stop.wait(self.lease_seconds / 3):
+            try:
+                if not self.renew_lease(job_id, worker_id):
+                    logger.warning("Job lease lost to another worker", extra={'job_id': job_id, 'worker_id': worker_id})
+                    return
+            except Exception as e:
+                logger.warning("Failed to renew job lease: %s", e, extra={'job_id': job_id})
+
+    def process(self, job, worker_id):
+        """Execute a job claimed by worker_id and record its outcome while the claim is still held"""
+        job_id = str(job['_id'])
+        payload = job['payload']
+
+        # The debate can outlast the lease, so keep renewing it while it runs
+        stop_renewing = threading.Event()
+        renewer = threading.Thread(target=self._keep_lease, args=(job_id, worker_id, stop_renewing), daemon=True)
+        renewer.start()
+        try:
+            if job.get('saved_at'):
+                # An earlier attempt saved its output but lost the claim before completing
+                result = saved_refinement_result(self.mongodb_service, job['user_id'], job['idea_id'])
+            elif job['job_type'] == JOB_TYPE_REFINE:
+                result = run_refinement(
+                    self.mongodb_service,
+                    job['user_id'],
+                    payload['idea'],
+                    use_cache=not payload.get('fresh', False),
+                    job_id=job_id
+                )
+            elif job['job_type'] == JOB_TYPE_FEEDBACK:
+                result = run_feedback_refinement(
+                    self.mongodb_service,
+                    job['user_id'],
+                    payload['idea_id'],
+                    payload['feedback'],
+                    use_cache=not payload.get('fresh', False),
+                    job_id=job_id
+                )
+            else:
+                result = {'success': False, 'error': f"Unknown job type: {job['job_type']}"}
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+        finally:
+            stop_renewing.set()
+            renewer.join()
+
+        if result['success']:
+            recorded = self.complete(job_id, result, worker_id)
+        else:
+            recorded = self.fail(job_id, result.get('error', 'Unknown error occurred'), worker_id)
+        if not recorded:
+            logger.warning("Job outcome discarded: the claim was taken over", extra={'job_id': job_id, 'worker_id': worker_id})
+        return result
+
+
+def serialize_job(job):
+    """Convert a job document into a JSON-friendly dict for API responses"""
+    data = {
+        'job_id': str(job['_id']),
+        'job_type': job['job_type'],
+        'status': job['status'],
+        'attempts': job.get('attempts', 0),
+        'created_at': job['created_at'].isoformat(),
+        'updated_at': job['updated_at'].isoformat()
+    }
+    if job.get('finished_at'):
+        data['finished_at'] = job['finished_at'].isoformat()
+    if job['status'] == JOB_SUCCEEDED:
+        data['result'] = job['result']
+    elif job['status'] == JOB_FAILED:
+        data['error'] = job['error']
+        data['credits_refunded'] = job.get('credits_refunded', False)
+    return data
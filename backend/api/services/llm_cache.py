@@ -0,0 +1,173 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(model, temperature, messages):
+    """Hash the model name, temperature and fully formatted messages into a cache key"""
+    payload = json.dumps({
+        'model': model,
+        'temperature': temperature,
+        'messages': [[message.type, message.content] for message in messages]
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _cache_entry_update(content):
+    """Upsert for one cached response; created_at drives the TTL index"""
+    return {'$set': {'content': content, 'created_at': datetime.utcnow()}}
+
+
+class LLMResponseCache:
+    """Two-tier LLM response cache: an in-process LRU in front of a Mongo collection with a TTL index.
+
+    get/set use the blocking collection; aget/aset use async_collection, a
+    callable returning the AsyncCollection for the running event loop.
+    """
+
+    def __init__(self, max_entries=512, collection=None, async_collection=None):
+        self.max_entries = max_entries
+        self.collection = collection
+        self.async_collection = async_collection
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.mongo_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached response for key, or None"""
+        content = self._memory_get(key)
+        if content is not None:
+            return content
+
+        if self.collection is not None:
+            try:
+                doc = self.collection.find_one({'_id': key}, {'content': 1})
+                content = doc['content'] if doc else None
+            except Exception as e:
+                logger.warning("LLM cache lookup failed: %s", e)
+        return self._record_lookup(key, content)
+
+    async def aget(self, key):
+        """get for async callers"""
+        content = self._memory_get(key)
+        if content is not None:
+            return content
+
+        if self.async_collection is not None:
+            try:
+                doc = await self.async_collection().find_one({'_id': key}, {'content': 1})
+                content = doc['content'] if doc else None
+            except Exception as e:
+                logger.warning("LLM cache lookup failed: %s", e)
+        return self._record_lookup(key, content)
+
+    def _memory_get(self, key):
+        """Return the in-process entry for key, or None"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return self._entries[key]
+        return None
+
+    def _record_lookup(self, key, content):
+        """Count a lookup that missed the in-process tier, keeping a Mongo hit locally"""
+        with self._lock:
+            if content is None:
+                self.misses += 1
+                return None
+            self.mongo_hits += 1
+            self._remember(key, content)
+        return content
+
+    def set(self, key, content):
+        """Store a response in both tiers"""
+        with self._lock:
+            self._remember(key, content)
+
+        if self.collection is not None:
+            try:
+                self.collection.update_one({'_id': key}, _cache_entry_update(content), upsert=True)
+            except Exception as e:
+                logger.warning("LLM cache write failed: %s", e)
+
+    async def aset(self, key, content):
+        """set for async callers"""
+        with self._lock:
+            self._remember(key, content)
+
+        if self.async_collection is not None:
+            try:
+                await self.async_collection().update_one({'_id': key}, _cache_entry_update(content), upsert=True)
+            except Exception as e:
+                logger.warning("LLM cache write failed: %s", e)
+
+    def _remember(self, key, content):
+        """Insert into the LRU, evicting the least recently used entry; caller holds the lock"""
+        self._entries[key] = content
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop the in-process tier and reset counters"""
+        with self._lock:
+            self._entries.clear()
+            self.memory_hits = 0
+            self.mongo_hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Return hit/miss counters for this process"""
+        with self._lock:
+            hits = self.memory_hits + self.mongo_hits
+            lookups = hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'memory_hits': self.memory_hits,
+                'mongo_hits': self.mongo_hits,
+                'misses': self.misses,
+                'hit_ratio': hits / lookups if lookups else 0.0
+            }
+
+
+_cache = None
+_cache_pid = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """Return the process-wide LLM response cache, or None when caching is disabled"""
+    global _cache, _cache_pid
+    if not getattr(settings, 'LLM_CACHE_ENABLED', True):
+        return None
+    pid = os.getpid()
+    if _cache is None or _cache_pid != pid:
+        with _cache_lock:
+            if _cache is None or _cache_pid != pid:
+                collection = None
+                async_collection = None
+                try:
+                    from .mongodb_service import get_mongodb_service
+                    from .async_mongodb_service import get_async_mongodb_service
+                    collection = get_mongodb_service().llm_cache_collection
+                    async_collection = lambda: get_async_mongodb_service().llm_cache_collection
+                except Exception as e:
+                    logger.warning("LLM cache running without MongoDB tier: %s", e)
+                _cache = LLMResponseCache(
+                    max_entries=getattr(settings, 'LLM_CACHE_MAX_ENTRIES', 512),
+                    collection=collection,
+                    async_collection=async_collection
+                )
+                _cache_pid = pid
+    return _cache
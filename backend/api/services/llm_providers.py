@@ -0,0 +1,263 @@
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from django.conf import settings
+from .debate_context import estimate_tokens
+
+
+# A provider returns (model_name, chat_model). The chat model follows the LangChain
+# chat interface the debate engine uses: invoke(messages) and ainvoke(messages) return
+# an object with .content, stream(messages) yields chunks with .content, and it
+# exposes .model and .temperature for cache keys. model_name keys the quota ledger.
+LLM_PROVIDER_GEMINI = 'gemini'
+LLM_PROVIDER_STUB = 'stub'
+
+GEMINI_MODEL_NAME = "gemini-1.5-flash"
+STUB_MODEL_NAME = "stub"
+
+# Matches the message Gemini returns when the daily quota is used up
+RATE_LIMIT_MESSAGE = "429 Resource has been exhausted (e.g. check quota)."
+
+LATENCY_DISTRIBUTIONS = ('fixed', 'uniform', 'exponential', 'lognormal')
+
+_WORDS = (
+    "users onboarding retention workflow pricing launch roadmap scope metrics feedback "
+    "dashboard integration mobile accessibility latency reliability analytics subscription "
+    "marketplace notifications privacy compliance support cost architecture api prototype "
+    "validation interviews adoption growth churn conversion experiment release iteration"
+).split()
+
+
+def is_rate_limit_error(error_msg):
+    """True when a provider error means the quota or rate limit was hit"""
+    return "quota" in error_msg.lower() or "rate limit" in error_msg.lower() or "429" in error_msg
+
+
+def _create_gemini_llm(temperature):
+    """Gemini through LangChain, with retries disabled so failures do not burn quota"""
+    import google.generativeai as genai
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    genai.configure(api_key=settings.GEMINI_API_KEY)
+    return GEMINI_MODEL_NAME, ChatGoogleGenerativeAI(
+        model=GEMINI_MODEL_NAME,
+        google_api_key=settings.GEMINI_API_KEY,
+        temperature=temperature,
+        max_retries=0  # Disable retries to prevent quota waste
+    )
+
+
+def _create_stub_llm(temperature):
+    """Local StubChatModel configured from the LLM_STUB_* settings"""
+    return STUB_MODEL_NAME, StubChatModel(
+        latency_ms=getattr(settings, 'LLM_STUB_LATENCY_MS', 600),
+        latency_jitter_ms=getattr(settings, 'LLM_STUB_LATENCY_JITTER_MS', 0),
+        latency_distribution=getattr(settings, 'LLM_STUB_LATENCY_DISTRIBUTION', 'fixed'),
+        tokens_per_second=getattr(settings, 'LLM_STUB_TOKENS_PER_SECOND', 150),
+        response_tokens=getattr(settings, 'LLM_STUB_RESPONSE_TOKENS', 250),
+        error_rate=getattr(settings, 'LLM_STUB_ERROR_RATE', 0.0),
+        rate_limit_rate=getattr(settings, 'LLM_STUB_RATE_LIMIT_RATE', 0.0),
+        seed=getattr(settings, 'LLM_STUB_SEED', 0),
+        temperature=temperature
+    )
+
+
+PROVIDERS = {
+    LLM_PROVIDER_GEMINI: _create_gemini_llm,
+    LLM_PROVIDER_STUB: _create_stub_llm,
+}
+
+
+def create_llm(provider=None, temperature=0.7):
+    """Return (model_name, chat_model) for the provider selected by LLM_PROVIDER"""
+    provider = provider or getattr(settings, 'LLM_PROVIDER', LLM_PROVIDER_GEMINI)
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unknown LLM provider '{provider}', expected one of: {', '.join(PROVIDERS)}")
+    return PROVIDERS[provider](temperature)
+
+
+def bind_json_schema(chat_model, schema):
+    """Chat model whose responses are constrained to JSON matching schema (a JSON Schema dict)"""
+    return chat_model.bind(response_mime_type='application/json', response_json_schema=schema)
+
+
+class StubProviderError(Exception):
+    """Failure injected by StubChatModel"""
+
+
+class StubMessage:
+    """Response or stream chunk returned by StubChatModel"""
+
+    def __init__(self, content):
+        self.content = content
+
+
+class StubChatModel:
+    """Offline chat model with simulated latency, token throughput and failures.
+
+    Each call waits a time-to-first-token drawn from the latency distribution,
+    then output_tokens / tokens_per_second while "generating". Content is
+    derived from a hash of the prompt, so the same prompt always gets the same
+    answer; panel prompts get a JSON object covering every persona key and PRD
+    prompts get every numbered section they ask for. Latency and injected
+    failures are drawn from one generator seeded with ``seed``.
+    """
+
+    def __init__(self, latency_ms=600, latency_jitter_ms=0, latency_distribution='fixed', tokens_per_second=150,
+                 response_tokens=250, error_rate=0.0, rate_limit_rate=0.0, seed=0, temperature=0.7,
+                 sleep=time.sleep, async_sleep=asyncio.sleep):
+        if latency_distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution '{latency_distribution}', expected one of: {', '.join(LATENCY_DISTRIBUTIONS)}")
+        self.model = STUB_MODEL_NAME
+        self.temperature = temperature
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.latency_distribution = latency_distribution
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.seed = seed
+        self._sleep = sleep
+        self._async_sleep = async_sleep
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+        # Counters for benchmarks
+        self.calls = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    # Chat model interface; response_json_schema constrains the content like Gemini's structured output
+    def invoke(self, messages, response_json_schema=None, **kwargs):
+        content, first_token_delay = self._begin(messages, response_json_schema)
+        self._sleep(first_token_delay + self._generation_seconds(content))
+        return StubMessage(content)
+
+    async def ainvoke(self, messages, response_json_schema=None, **kwargs):
+        content, first_token_delay = self._begin(messages, response_json_schema)
+        await self._async_sleep(first_token_delay + self._generation_seconds(content))
+        return StubMessage(content)
+
+    def stream(self, messages, response_json_schema=None, **kwargs):
+        content, first_token_delay = self._begin(messages, response_json_schema)
+        self._sleep(first_token_delay)
+        for chunk in re.findall(r'\S+\s*|\s+', content):
+            self._sleep(self._generation_seconds(chunk))
+            yield StubMessage(chunk)
+
+    async def astream(self, messages, response_json_schema=None, **kwargs):
+        content, first_token_delay = self._begin(messages, response_json_schema)
+        await self._async_sleep(first_token_delay)
+        for chunk in re.findall(r'\S+\s*|\s+', content):
+            await self._async_sleep(self._generation_seconds(chunk))
+            yield StubMessage(chunk)
+
+    def bind(self, **kwargs):
+        """Model that passes kwargs to every call, like LangChain's Runnable.bind"""
+        return StubBinding(self, kwargs)
+
+    # Simulation
+    def _begin(self, messages, response_json_schema=None):
+        """Count the call, inject a failure if one is drawn, and return (content, first_token_delay)"""
+        prompt = "\n".join(message.content for message in messages)
+        with self._lock:
+            self.calls += 1
+            self.input_tokens += estimate_tokens(prompt)
+            roll = self._rng.random()
+            first_token_delay = self._draw_latency()
+            if roll < self.rate_limit_rate:
+                self.rate_limited += 1
+                failure = RATE_LIMIT_MESSAGE
+            elif roll < self.rate_limit_rate + self.error_rate:
+                self.errors += 1
+                failure = "500 Internal error encountered (stub provider)."
+            else:
+                failure = None
+
+        if failure:
+            raise StubProviderError(failure)
+
+        content = self.generate_content(prompt, response_json_schema)
+        with self._lock:
+            self.output_tokens += estimate_tokens(content)
+        return content, first_token_delay
+
+    def _draw_latency(self):
+        """Draw a time-to-first-token in seconds; callers hold _lock"""
+        mean = self.latency_ms / 1000
+        jitter = self.latency_jitter_ms / 1000
+        if self.latency_distribution == 'uniform':
+            return max(0.0, self._rng.uniform(mean - jitter, mean + jitter))
+        if self.latency_distribution == 'exponential':
+            return self._rng.expovariate(1 / mean) if mean > 0 else 0.0
+        if self.latency_distribution == 'lognormal':
+            # latency_ms is the median; jitter sets the spread of the long tail
+            sigma = jitter / mean if mean > 0 else 0.0
+            return mean * self._rng.lognormvariate(0, sigma)
+        return mean
+
+    def _generation_seconds(self, text):
+        """Time spent emitting text at tokens_per_second"""
+        if not self.tokens_per_second:
+            return 0.0
+        return estimate_tokens(text) / self.tokens_per_second
+
+    def generate_content(self, prompt, response_json_schema=None):
+        """Deterministic response shaped like what the prompt (or the JSON schema) asks for"""
+        rng = random.Random(hashlib.sha256(f"{self.seed}:{prompt}".encode('utf-8')).digest())
+
+        properties = (response_json_schema or {}).get('properties')
+        if properties:
+            per_property = max(20, self.response_tokens // 2)
+            return json.dumps({name: self._paragraphs(rng, per_property) for name in properties})
+
+        panel_keys = re.findall(r'^- key "([^"]+)"', prompt, re.MULTILINE)
+        if panel_keys:
+            return json.dumps({key: self._paragraphs(rng, self.response_tokens) for key in panel_keys})
+
+        sections = re.findall(r'^\s*(\d+\.\s+[A-Z][A-Z &\-()]+):', prompt, re.MULTILINE)
+        if sections:
+            per_section = max(20, self.response_tokens // 2)
+            return "\n\n".join(f"{section}:\n{self._paragraphs(rng, per_section)}" for section in sections)
+
+        return self._paragraphs(rng, self.response_tokens)
+
+    def _paragraphs(self, rng, tokens):
+        """Filler text of roughly the given token count"""
+        sentences = []
+        length = 0
+        while length < tokens:
+            sentence = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(6, 14))).capitalize() + "."
+            sentences.append(sentence)
+            length += estimate_tokens(sentence) + 1
+        return " ".join(sentences)
+
+
+class StubBinding:
+    """StubChatModel with call arguments bound by StubChatModel.bind"""
+
+    def __init__(self, chat_model, kwargs):
+        self.chat_model = chat_model
+        self.kwargs = kwargs
+
+    def __getattr__(self, name):
+        return getattr(self.chat_model, name)
+
+    def invoke(self, messages):
+        return self.chat_model.invoke(messages, **self.kwargs)
+
+    async def ainvoke(self, messages):
+        return await self.chat_model.ainvoke(messages, **self.kwargs)
+
+    def stream(self, messages):
+        return self.chat_model.stream(messages, **self.kwargs)
+
+    def astream(self, messages):
+        return self.chat_model.astream(messages, **self.kwargs)
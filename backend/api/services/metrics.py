@@ -0,0 +1,190 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    REGISTRY,
+    generate_latest,
+    multiprocess,
+)
+from pymongo import monitoring
+from .debate_context import estimate_tokens
+from .llm_providers import is_rate_limit_error
+
+
+# Refines take tens of seconds, so latency buckets reach well past the usual web defaults
+REQUEST_LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+LLM_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+MONGO_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+ROUND_TRIP_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10, 15)
+
+REQUEST_LATENCY = Histogram(
+    'focalai_http_request_duration_seconds',
+    'Time until the response is returned, by URL name',
+    ['url_name', 'method', 'status'],
+    buckets=REQUEST_LATENCY_BUCKETS
+)
+LLM_CALL_LATENCY = Histogram(
+    'focalai_llm_call_duration_seconds',
+    'LLM call latency by agent key and outcome (ok, error, rate_limited)',
+    ['model', 'agent', 'outcome'],
+    buckets=LLM_LATENCY_BUCKETS
+)
+LLM_TOKENS = Counter(
+    'focalai_llm_tokens',
+    'LLM tokens sent and received by agent key',
+    ['model', 'agent', 'direction']
+)
+LLM_RATE_LIMITED = Counter(
+    'focalai_llm_rate_limited',
+    'LLM calls rejected with a 429 or quota error',
+    ['model', 'agent']
+)
+DEBATE_TURNS = Counter(
+    'focalai_debate_turns',
+    'Debate turns by agent key and whether the canned fallback answered',
+    ['agent', 'fallback']
+)
+LLM_QUOTA_REMAINING = Gauge(
+    'focalai_llm_quota_remaining',
+    'Daily LLM calls left in the shared quota ledger at the start of the latest refinement',
+    ['model'],
+    multiprocess_mode='livemin'
+)
+MONGO_COMMAND_LATENCY = Histogram(
+    'focalai_mongo_command_duration_seconds',
+    'MongoDB command latency by collection and command',
+    ['collection', 'command', 'outcome'],
+    buckets=MONGO_LATENCY_BUCKETS
+)
+MONGO_UNIT_OF_WORK_ROUND_TRIPS = Histogram(
+    'focalai_mongo_unit_of_work_round_trips',
+    'MongoDB round trips taken to commit a unit of work, by unit and mode (transaction, bulk)',
+    ['unit', 'mode'],
+    buckets=ROUND_TRIP_BUCKETS
+)
+READ_CACHE_LOOKUPS = Counter(
+    'focalai_read_cache_lookups',
+    'Read cache lookups by entity and result (local, shared, miss)',
+    ['entity', 'result']
+)
+READ_CACHE_HIT_RATIO = Gauge(
+    'focalai_read_cache_hit_ratio',
+    'Fraction of read cache lookups served from either tier since this process started, by entity',
+    ['entity'],
+    multiprocess_mode='liveall'
+)
+CREDIT_RESERVATION_FAILURES = Counter(
+    'focalai_credit_reservation_failures',
+    'Credit reservations refused because the balance was too low or the user was missing'
+)
+
+
+def render_metrics():
+    """Return the exposition text for every metric, merged across workers in multiprocess mode"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def observe_request(request, response, seconds):
+    """Record one request against the URL name it resolved to"""
+    resolver_match = getattr(request, 'resolver_match', None)
+    url_name = resolver_match.url_name if resolver_match and resolver_match.url_name else 'unmatched'
+    REQUEST_LATENCY.labels(url_name, request.method, str(response.status_code)).observe(seconds)
+
+
+def _response_tokens(response):
+    """(input, output) token counts reported by the provider, if any"""
+    usage = getattr(response, 'usage_metadata', None) or {}
+    return usage.get('input_tokens'), usage.get('output_tokens')
+
+
+class LLMCall:
+    """Result recorder handed out by llm_call"""
+
+    def __init__(self, messages):
+        self.input_tokens = None
+        self.output_tokens = None
+        self.prompt = "\n".join(str(message.content) for message in messages)
+
+    def record(self, response):
+        """Take token counts from a response, estimating them when the provider reports none"""
+        input_tokens, output_tokens = _response_tokens(response)
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens if output_tokens is not None else estimate_tokens(response.content or "")
+
+    def record_text(self, text):
+        """Estimate output tokens for streamed text"""
+        self.output_tokens = estimate_tokens(text)
+
+
+@contextmanager
+def llm_call(model, agent, messages):
+    """Time one LLM call and count its tokens; exceptions are classified and re-raised"""
+    call = LLMCall(messages)
+    outcome = 'ok'
+    started = time.perf_counter()
+    try:
+        yield call
+    except Exception as e:
+        outcome = 'rate_limited' if is_rate_limit_error(str(e)) else 'error'
+        if outcome == 'rate_limited':
+            LLM_RATE_LIMITED.labels(model, agent).inc()
+        raise
+    finally:
+        LLM_CALL_LATENCY.labels(model, agent, outcome).observe(time.perf_counter() - started)
+        input_tokens = call.input_tokens if call.input_tokens is not None else estimate_tokens(call.prompt)
+        LLM_TOKENS.labels(model, agent, 'input').inc(input_tokens)
+        if call.output_tokens:
+            LLM_TOKENS.labels(model, agent, 'output').inc(call.output_tokens)
+
+
+def record_debate_turns(turns):
+    """Count debate turns given as (agent_key, fallback) pairs"""
+    for agent_key, fallback in turns:
+        DEBATE_TURNS.labels(agent_key, 'true' if fallback else 'false').inc()
+
+
+def _command_collection(event):
+    """Collection a command targets, or '-' for database-level commands"""
+    target = event.command.get(event.command_name) if event.command else None
+    if isinstance(target, str):
+        return target
+    if event.command_name == 'getMore' and event.command:
+        return event.command.get('collection', '-')
+    return '-'
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """PyMongo command listener feeding MONGO_COMMAND_LATENCY"""
+
+    def __init__(self):
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        with self._lock:
+            self._collections[(event.connection_id, event.request_id)] = _command_collection(event)
+
+    def succeeded(self, event):
+        self._observe(event, 'ok')
+
+    def failed(self, event):
+        self._observe(event, 'error')
+
+    def _observe(self, event, outcome):
+        with self._lock:
+            collection = self._collections.pop((event.connection_id, event.request_id), '-')
+        MONGO_COMMAND_LATENCY.labels(collection, event.command_name, outcome).observe(event.duration_micros / 1_000_000)
+
+
+# Passed to every MongoClient and AsyncMongoClient the services create
+mongo_command_metrics = MongoCommandMetrics()
@@ -1,15 +1,363 @@
 import os
-from pymongo import MongoClient
+import logging
+import threading
+from bisect import bisect_left
+from pymongo import MongoClient, ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
 from django.conf import settings
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
 from bson import ObjectId
+from .debate_context import summarize_stance
+from .pagination import keyset_page, InvalidCursor
+from .index_migrations import apply_index_migrations
+from .user_cache import verified_user_cache
+from .metrics import mongo_command_metrics, CREDIT_RESERVATION_FAILURES
+from .unit_of_work import UnitOfWork, transactions_unsupported
+from .read_cache import get_read_cache, idea_details_key, idea_iterations_key, idea_keys, chat_sessions_key
+
+
+logger = logging.getLogger(__name__)
+
+
+# Length of the per-section headline stored in the idea_summaries read model
+SECTION_HEADLINE_MAX_CHARS = 160
+
+# Debate storage modes: one debate_iterations document per iteration, or one debates document per agent turn
+DEBATE_STORAGE_BUCKETED = 'bucketed'
+DEBATE_STORAGE_PER_MESSAGE = 'per_message'
+
+
+def _debates_bucketed():
+    """True when debates are stored and read as one document per iteration"""
+    return getattr(settings, 'DEBATE_STORAGE', DEBATE_STORAGE_BUCKETED) == DEBATE_STORAGE_BUCKETED
+
+
+def _section_headline(text, max_chars=SECTION_HEADLINE_MAX_CHARS):
+    """Return the first non-empty line of a PRD section, cut to max_chars"""
+    for line in (text or '').splitlines():
+        line = line.strip().lstrip('-*• ').strip()
+        if line:
+            return line if len(line) <= max_chars else line[:max_chars - 1].rstrip() + '…'
+    return ''
+
+
+def _section_headlines(sections):
+    """Reduce parsed PRD sections to one headline per section"""
+    return {name: _section_headline(text) for name, text in (sections or {}).items()}
+
+
+# Document builders shared by MongoDBService and AsyncMongoDBService
+def _idea_summary_document(idea, debate_count, iteration_count, latest_requirement=None):
+    """Build the idea_summaries entry for an idea"""
+    return {
+        'user_id': idea.get('user_id'),
+        'title': idea.get('title', ''),
+        'description': idea.get('description', ''),
+        'debate_count': debate_count,
+        'iteration_count': iteration_count,
+        'section_headlines': _section_headlines(latest_requirement.get('sections')) if latest_requirement else {},
+        'last_refined_at': latest_requirement.get('created_at') if latest_requirement else None,
+        'created_at': idea.get('created_at'),
+        'updated_at': idea.get('updated_at')
+    }
+
+
+def _refinement_update(requirements_data):
+    """Summary update counting a new PRD iteration and refreshing its section headlines"""
+    return {
+        '$inc': {'iteration_count': 1},
+        '$set': {
+            'section_headlines': _section_headlines(requirements_data.get('sections')),
+            'last_refined_at': requirements_data['created_at'],
+            'updated_at': requirements_data['created_at']
+        }
+    }
+
+
+def _debate_documents(idea_id, debates):
+    """Turn debate_log entries into debates collection documents"""
+    return [
+        {
+            'idea_id': idea_id,
+            'round_number': debate['round'],
+            'agent_name': debate['agent'],
+            'message': debate['response'],
+            'stance_summary': debate.get('summary') or summarize_stance(debate['response']),
+            'timestamp': datetime.utcnow()
+        }
+        for debate in debates
+    ]
+
+
+def _debate_bucket(idea_id, iteration_number, debates):
+    """Turn one iteration's debate_log into a debate_iterations document, agent turns grouped by round"""
+    timestamp = datetime.utcnow()
+    rounds = {}
+    for debate in debates:
+        rounds.setdefault(debate['round'], []).append({
+            'agent': debate['agent'],
+            'message': debate['response'],
+            'summary': debate.get('summary') or summarize_stance(debate['response']),
+            'timestamp': timestamp
+        })
+    return {
+        'idea_id': idea_id,
+        'iteration_number': iteration_number,
+        'rounds': [{'round_number': round_num, 'messages': messages} for round_num, messages in rounds.items()],
+        'message_count': len(debates),
+        'created_at': timestamp
+    }
+
+
+def _buckets_from_debates(idea_id, debates, refined_at):
+    """Regroup one idea's per-message debates, sorted by round and time, into debate_iterations documents.
+
+    The pipeline always saved an iteration's debates just before its PRD, so
+    a debate belongs to the first iteration whose PRD is not older than it;
+    refined_at holds the idea's PRD creation times in ascending order.
+    """
+    iterations = {}
+    for debate in debates:
+        iteration_number = bisect_left(refined_at, debate['timestamp']) + 1
+        rounds = iterations.setdefault(iteration_number, {})
+        rounds.setdefault(debate['round_number'], []).append({
+            'agent': debate['agent_name'],
+            'message': debate['message'],
+            'summary': debate.get('stance_summary', ''),
+            'timestamp': debate['timestamp']
+        })
+    return [
+        {
+            'idea_id': idea_id,
+            'iteration_number': iteration_number,
+            'rounds': [{'round_number': round_num, 'messages': messages} for round_num, messages in rounds.items()],
+            'message_count': sum(len(messages) for messages in rounds.values()),
+            'created_at': min(message['timestamp'] for messages in rounds.values() for message in messages)
+        }
+        for iteration_number, rounds in sorted(iterations.items())
+    ]
+
+
+def _stage_debates(unit_of_work, idea_id, iteration_number, debates):
+    """Stage an iteration's debate in the configured storage mode; returns the number of agent turns"""
+    if not debates:
+        return 0
+    if _debates_bucketed():
+        unit_of_work.insert('debate_iterations', _debate_bucket(idea_id, iteration_number, debates))
+    else:
+        unit_of_work.insert_many('debates', _debate_documents(idea_id, debates))
+    return len(debates)
+
+
+def _stage_refinement(unit_of_work, idea_data, debates, requirements_data):
+    """Stage a new idea with its first debate and PRD; returns the idea id.
+
+    The id is generated here so every document can reference it before
+    anything is written. Debates and the PRD are staged first and the idea
+    and its summary last, so the idea only appears once its PRD exists.
+    """
+    if 'user_id' not in idea_data:
+        raise ValueError("user_id is required for idea creation")
+    now = datetime.utcnow()
+    idea = dict(idea_data, _id=ObjectId(), created_at=now, updated_at=now)
+    idea_id = str(idea['_id'])
+    requirements = dict(requirements_data, idea_id=idea_id, created_at=now)
+    
+    debate_count = _stage_debates(unit_of_work, idea_id, 1, debates)
+    unit_of_work.insert('requirements', requirements)
+    unit_of_work.insert('ideas', idea)
+    summary = _idea_summary_document(idea, debate_count, 1, requirements)
+    unit_of_work.update('idea_summaries', {'_id': idea['_id']}, {'$set': summary}, upsert=True)
+    return idea_id
+
+
+def _stage_feedback_refinement(unit_of_work, idea_id, debates, iteration_data):
+    """Stage a feedback iteration's debate and PRD with one summary update counting both"""
+    iteration = dict(iteration_data, idea_id=idea_id, created_at=datetime.utcnow())
+    
+    debate_count = _stage_debates(unit_of_work, idea_id, iteration['iteration_number'], debates)
+    unit_of_work.insert('requirements', iteration)
+    update = _refinement_update(iteration)
+    update['$inc']['debate_count'] = debate_count
+    unit_of_work.update('idea_summaries', {'_id': ObjectId(idea_id)}, update)
+
+
+def _stage_job_output(unit_of_work, job_id, idea_id):
+    """Stage the mark telling a re-claimed job that its output was already saved.
+
+    Staged last, after the writes it vouches for, so without a transaction
+    a commit cut short can only leave a job that runs again, never one
+    pointing at an idea that was not written.
+    """
+    now = datetime.utcnow()
+    unit_of_work.update('refine_jobs', {'_id': ObjectId(job_id)}, {'$set': {'idea_id': idea_id, 'saved_at': now, 'updated_at': now}})
+
+
+def _group_debate_rounds(debates):
+    """Organize stored debates by round"""
+    debate_rounds = {}
+    for debate in debates:
+        round_num = debate['round_number']
+        if round_num not in debate_rounds:
+            debate_rounds[round_num] = []
+        debate_rounds[round_num].append({
+            'agent': debate['agent_name'],
+            'message': debate['message'],
+            'summary': debate.get('stance_summary', ''),
+            'timestamp': debate['timestamp'].isoformat()
+        })
+    return debate_rounds
+
+
+def _group_debate_buckets(buckets):
+    """Merge debate_iterations documents, in iteration order, into the shape _group_debate_rounds returns"""
+    debate_rounds = {}
+    for bucket in buckets:
+        for debate_round in bucket['rounds']:
+            debate_rounds.setdefault(debate_round['round_number'], []).extend(
+                {
+                    'agent': message['agent'],
+                    'message': message['message'],
+                    'summary': message.get('summary', ''),
+                    'timestamp': message['timestamp'].isoformat()
+                }
+                for message in debate_round['messages']
+            )
+    return debate_rounds
+
+
+# Only the debate itself is needed to rebuild debate_rounds
+DEBATE_BUCKET_PROJECTION = {'_id': 0, 'rounds': 1}
+
+
+def _attach_latest_requirement(summaries):
+    """Add the latest_requirement shape older history clients read from the section headlines"""
+    for summary in summaries:
+        headlines = summary.get('section_headlines') or {}
+        summary['latest_requirement'] = {
+            'refined_requirements': headlines.get('requirements', ''),
+            'trade_offs': headlines.get('trade_offs_decisions', ''),
+            'next_steps': headlines.get('next_steps', '')
+        } if summary.get('iteration_count') else None
+    return summaries
+
+
+def _new_user_document(user_data):
+    """Build a new user with initial 10 credits"""
+    return {
+        'email': user_data['email'],
+        'name': user_data.get('name', ''),
+        'avatar': user_data.get('picture', ''),  # Google OAuth provides 'picture' field
+        'credits': 10,  # Initial credits
+        'created_at': datetime.utcnow(),
+        'last_login': datetime.utcnow(),
+        'is_active': True
+    }
+
+
+def _last_login_filter(user_id):
+    """Match a user whose last_login is older than LAST_LOGIN_WRITE_INTERVAL_SECONDS"""
+    interval = timedelta(seconds=getattr(settings, 'LAST_LOGIN_WRITE_INTERVAL_SECONDS', 300))
+    return {'_id': ObjectId(user_id), 'last_login': {'$not': {'$gte': datetime.utcnow() - interval}}}
+
+
+def _credit_change(user_id, amount, transaction_type, description, require_balance=False):
+    """Build the (filter, update) applying a credit delta and queueing its ledger entry"""
+    entry = {
+        '_id': ObjectId(),
+        'user_id': user_id,
+        'transaction_type': transaction_type,
+        'amount': amount,
+        'description': description,
+        'created_at': datetime.utcnow()
+    }
+    query = {'_id': ObjectId(user_id)}
+    if require_balance:
+        query['credits'] = {'$gte': -amount}
+    return query, {'$inc': {'credits': amount}, '$push': {'credit_outbox': entry}}
+
+
+def _serialize_session(session):
+    """Make a chat session JSON serializable"""
+    session['_id'] = str(session['_id'])
+    session['created_at'] = session['created_at'].isoformat()
+    session['updated_at'] = session['updated_at'].isoformat()
+    return session
+
+
+def _serialize_message(message):
+    """Make a chat message JSON serializable"""
+    message['_id'] = str(message['_id'])
+    message['timestamp'] = message['timestamp'].isoformat()
+    return message
+
+
+# Only first pages of this size (the session list endpoint's default) go through the read cache
+CACHED_SESSION_PAGE_LIMIT = 50
+
+SESSION_LIST_PROJECTION = {'_id': 1, 'title': 1, 'idea_summary': 1, 'status': 1, 'created_at': 1, 'updated_at': 1}
+MESSAGE_PROJECTION = {'_id': 1, 'role': 1, 'content': 1, 'round_number': 1, 'timestamp': 1}
+
+
+# Process-wide client and service shared by every request in a worker
+_client = None
+_client_pid = None
+_service = None
+_client_lock = threading.Lock()
+
+
+def get_mongo_client():
+    """Return the pooled MongoClient for this process, creating it on first use.
+
+    PyMongo clients are not fork-safe, so a client inherited from a parent
+    process (e.g. a preloading gunicorn master) is discarded and rebuilt.
+    """
+    global _client, _client_pid, _service
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+    
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            if not settings.MONGODB_URI:
+                raise ValueError("MONGODB_URI is not configured in settings")
+            
+            _client = MongoClient(
+                settings.MONGODB_URI,
+                serverSelectionTimeoutMS=10000,
+                connectTimeoutMS=10000,
+                socketTimeoutMS=20000,
+                maxPoolSize=getattr(settings, 'MONGODB_MAX_POOL_SIZE', 10),
+                minPoolSize=getattr(settings, 'MONGODB_MIN_POOL_SIZE', 0),
+                maxIdleTimeMS=getattr(settings, 'MONGODB_MAX_IDLE_TIME_MS', None),
+                retryWrites=True,
+                w='majority',
+                connect=False,  # Defer connecting until the first operation
+                event_listeners=[mongo_command_metrics]
+            )
+            _client_pid = pid
+            _service = None
+    return _client
+
+
+def get_mongodb_service():
+    """Return the MongoDBService shared by all requests in this process"""
+    global _service
+    client = get_mongo_client()
+    service = _service
+    if service is None or service.client is not client:
+        with _client_lock:
+            if _service is None or _service.client is not client:
+                _service = MongoDBService(client=client)
+            service = _service
+    return service
 
 
 class MongoDBService:
     """Service for MongoDB operations"""
     
-    def __init__(self):
+    def __init__(self, client=None):
         # MongoDB connection configuration
         self.mongodb_uri = settings.MONGODB_URI
         self.db_name = settings.MONGODB_DB_NAME
@@ -18,71 +366,112 @@ class MongoDBService:
             raise ValueError("MONGODB_URI is not configured in settings")
         
         try:
-            # Connect to MongoDB with proper options
-            self.client = MongoClient(
-                self.mongodb_uri,
-                serverSelectionTimeoutMS=10000,
-                connectTimeoutMS=10000,
-                socketTimeoutMS=20000,
-                maxPoolSize=10,
-                retryWrites=True,
-                w='majority'
-            )
-            
-            # Test the connection
-            self.client.admin.command('ping')
+            # Reuse the process-wide pooled client unless one is injected
+            self.client = client if client is not None else get_mongo_client()
             self.db = self.client[self.db_name]
             
             # Initialize collections
             self.ideas_collection = self.db.ideas
             self.debates_collection = self.db.debates
+            # One document per iteration's debate when DEBATE_STORAGE is 'bucketed'
+            self.debate_iterations_collection = self.db.debate_iterations
             self.requirements_collection = self.db.requirements
             self.users_collection = self.db.users
             self.credit_transactions_collection = self.db.credit_transactions
             self.chat_sessions_collection = self.db.chat_sessions
             self.chat_messages_collection = self.db.chat_messages
+            self.refine_jobs_collection = self.db.refine_jobs
+            self.llm_cache_collection = self.db.llm_cache
+            self.llm_quota_collection = self.db.llm_quota
+            # Read model for history listings, maintained by the save_* methods
+            self.idea_summaries_collection = self.db.idea_summaries
+            # Applied index migration version (see index_migrations.py)
+            self.schema_migrations_collection = self.db.schema_migrations
             
-            # Create indexes for better performance
-            self._create_indexes()
+            # Cleared for the life of the process once the deployment turns a transaction down
+            self.use_transactions = getattr(settings, 'MONGODB_USE_TRANSACTIONS', True)
             
         except Exception as e:
             raise Exception(f"Failed to connect to MongoDB: {str(e)}")
     
-    def _create_indexes(self):
-        """Create database indexes for better performance"""
-        try:
-            # User indexes
-            self.users_collection.create_index("email", unique=True)
-            self.users_collection.create_index("created_at")
-            
-            # Idea indexes
-            self.ideas_collection.create_index("created_at")
-            self.ideas_collection.create_index("user_id")
-            
-            # Debate indexes
-            self.debates_collection.create_index("idea_id")
-            self.debates_collection.create_index("round_number")
-            
-            # Requirements indexes
-            self.requirements_collection.create_index("idea_id")
-            self.requirements_collection.create_index("created_at")
-            
-            # Transaction indexes
-            self.credit_transactions_collection.create_index("user_id")
-            self.credit_transactions_collection.create_index("created_at")
-            
-            # Chat session indexes
-            self.chat_sessions_collection.create_index("user_id")
-            self.chat_sessions_collection.create_index("created_at")
-            self.chat_sessions_collection.create_index("status")
-            
-            # Chat message indexes
-            self.chat_messages_collection.create_index("session_id")
-            self.chat_messages_collection.create_index("round_number")
-            self.chat_messages_collection.create_index("timestamp")
-            
-        except Exception as e:
-            print(f"⚠️ Warning: Failed to create some indexes: {str(e)}")
+    def ping(self):
+        """Check that the MongoDB deployment is reachable"""
+        self.client.admin.command('ping')
+        return True
+    
+    def ensure_indexes(self, log=print):
+        """Apply pending index migrations; run from init_db at deploy time, not per request"""
+        return apply_index_migrations(self, log=log)
+    
+    def _invalidate(self, *keys):
+        """Drop read cache entries a write has made stale"""
+        cache = get_read_cache()
+        if cache is not None:
+            cache.invalidate(*keys)
+    
+    def commit(self, unit_of_work):
+        """Write a UnitOfWork's staged operations; returns the number of round trips taken.
+
+        Runs one ordered bulk_write per collection inside a transaction. On a
+        deployment without transactions (a standalone mongod) the same bulk
+        writes run without one, in staging order.
+        """
+        if not len(unit_of_work):
+            return 0
+        
+        if self.use_transactions:
+            try:
+                round_trips = self._commit_in_transaction(unit_of_work)
+            except OperationFailure as e:
+                if not transactions_unsupported(e):
+                    raise
+                logger.warning("MongoDB deployment does not support transactions; committing units of work as bulk writes")
+                self.use_transactions = False
+            else:
+                unit_of_work.observe('transaction', round_trips)
+                return round_trips
+        
+        round_trips = 0
+        for collection, operations in unit_of_work.batches.items():
+            self.db[collection].bulk_write(operations, ordered=True)
+            round_trips += 1
+        unit_of_work.observe('bulk', round_trips)
+        return round_trips
+    
+    def _commit_in_transaction(self, unit_of_work):
+        """Run the bulk writes in one transaction; counts retried attempts and the commit itself"""
+        round_trips = 0
+        
+        def write_batches(session):
+            nonlocal round_trips
+            for collection, operations in unit_of_work.batches.items():
+                self.db[collection].bulk_write(operations, ordered=True, session=session)
+                round_trips += 1
+        
+        with self.client.start_session() as session:
+            session.with_transaction(write_batches)
+        return round_trips + 1
+    
+    def save_refinement(self, idea_data, debates, requirements_data, job_id=None):
+        """Save a new idea with its debate and PRD in one unit of work; returns the idea id.
+
+        With job_id, the refine job producing them is marked as saved in the same unit of work.
+        """
+        unit_of_work = UnitOfWork('refine')
+        idea_id = _stage_refinement(unit_of_work, idea_data, debates, requirements_data)
+        if job_id is not None:
+            _stage_job_output(unit_of_work, job_id, idea_id)
+        self.commit(unit_of_work)
+        return idea_id
+    
+    def save_feedback_refinement(self, idea_id, debates, iteration_data, job_id=None):
+        """Save a feedback iteration's debate and PRD in one unit of work, marking job_id as saved if given"""
+        unit_of_work = UnitOfWork('feedback')
+        _stage_feedback_refinement(unit_of_work, idea_id, debates, iteration_data)
+        if job_id is not None:
+            _stage_job_output(unit_of_work, job_id, idea_id)
+        self.commit(unit_of_work)
+        self._invalidate(*idea_keys(idea_id))
     
     def save_idea(self, idea_data):
         """Save idea to MongoDB"""
@@ -92,31 +481,113 @@ class MongoDBService:
         if 'user_id' not in idea_data:
             raise ValueError("user_id is required for idea creation")
         result = self.ideas_collection.insert_one(idea_data)
+        
+        self._upsert_idea_summary(idea_data, debate_count=0, iteration_count=0)
         return str(result.inserted_id)
     
-    def save_debates(self, idea_id, debates):
-        """Save debate entries to MongoDB"""
-        debate_docs = []
-        for debate in debates:
-            debate_doc = {
-                'idea_id': idea_id,
-                'round_number': debate['round'],
-                'agent_name': debate['agent'],
-                'message': debate['response'],
-                'timestamp': datetime.utcnow()
-            }
-            debate_docs.append(debate_doc)
+    def _upsert_idea_summary(self, idea, debate_count, iteration_count, latest_requirement=None):
+        """Create or replace the idea_summaries entry for an idea"""
+        summary = _idea_summary_document(idea, debate_count, iteration_count, latest_requirement)
+        self.idea_summaries_collection.update_one({'_id': idea['_id']}, {'$set': summary}, upsert=True)
+    
+    def _record_refinement(self, idea_id, requirements_data):
+        """Count a new PRD iteration and refresh the section headlines in the idea's summary"""
+        self.idea_summaries_collection.update_one({'_id': ObjectId(idea_id)}, _refinement_update(requirements_data))
+    
+    def rebuild_idea_summaries(self):
+        """Backfill idea_summaries from ideas, debates and requirements; returns the number rebuilt"""
+        count = 0
+        for idea in self.ideas_collection.find({}):
+            idea_id = str(idea['_id'])
+            self._upsert_idea_summary(
+                idea,
+                debate_count=self._count_debate_turns(idea_id),
+                iteration_count=self.requirements_collection.count_documents({'idea_id': idea_id}),
+                latest_requirement=self.requirements_collection.find_one(
+                    {'idea_id': idea_id},
+                    {'sections': 1, 'created_at': 1},
+                    sort=[('created_at', -1)]
+                )
+            )
+            count += 1
+        return count
+    
+    def _count_debate_turns(self, idea_id):
+        """Number of agent turns stored for an idea"""
+        if _debates_bucketed():
+            buckets = self.debate_iterations_collection.find({'idea_id': idea_id}, {'message_count': 1})
+            return sum(bucket.get('message_count', 0) for bucket in buckets)
+        return self.debates_collection.count_documents({'idea_id': idea_id})
+    
+    def _load_debate_rounds(self, idea_id):
+        """Read an idea's debates, one document per iteration when bucketed, organized by round"""
+        if _debates_bucketed():
+            buckets = self.debate_iterations_collection.find({'idea_id': idea_id}, DEBATE_BUCKET_PROJECTION).sort('iteration_number', 1)
+            return _group_debate_buckets(buckets)
+        debates = self.debates_collection.find({'idea_id': idea_id}).sort([('round_number', 1), ('timestamp', 1)])
+        return _group_debate_rounds(debates)
+    
+    def save_debates(self, idea_id, debates, iteration_number=None):
+        """Save an iteration's debate entries to MongoDB; iteration_number defaults to the next one"""
+        if not debates:
+            return []
         
-        if debate_docs:
-            result = self.debates_collection.insert_many(debate_docs)
-            return [str(id) for id in result.inserted_ids]
-        return []
+        if _debates_bucketed():
+            if iteration_number is None:
+                iteration_number = self.debate_iterations_collection.count_documents({'idea_id': idea_id}) + 1
+            result = self.debate_iterations_collection.insert_one(_debate_bucket(idea_id, iteration_number, debates))
+            inserted_ids = [str(result.inserted_id)]
+        else:
+            result = self.debates_collection.insert_many(_debate_documents(idea_id, debates))
+            inserted_ids = [str(id) for id in result.inserted_ids]
+        
+        self.idea_summaries_collection.update_one(
+            {'_id': ObjectId(idea_id)},
+            {'$inc': {'debate_count': len(debates)}, '$set': {'updated_at': datetime.utcnow()}}
+        )
+        self._invalidate(*idea_keys(idea_id))
+        return inserted_ids
+    
+    def migrate_debates_to_buckets(self, drop_legacy=False, log=print):
+        """Regroup per-message debates into debate_iterations documents; returns (ideas, buckets, turns).
+
+        Buckets are upserted by idea and iteration number, so the migration
+        can be rerun until the per-message documents are dropped, which
+        drop_legacy does for each idea once its buckets are written.
+        """
+        ideas = buckets = turns = 0
+        for idea_id in self.debates_collection.distinct('idea_id'):
+            debates = list(self.debates_collection.find({'idea_id': idea_id}).sort([('round_number', 1), ('timestamp', 1)]))
+            refined_at = [
+                requirement['created_at']
+                for requirement in self.requirements_collection.find({'idea_id': idea_id}, {'created_at': 1}).sort('created_at', 1)
+            ]
+            documents = _buckets_from_debates(idea_id, debates, refined_at)
+            self.debate_iterations_collection.bulk_write([
+                UpdateOne(
+                    {'idea_id': idea_id, 'iteration_number': document['iteration_number']},
+                    {'$set': document},
+                    upsert=True
+                )
+                for document in documents
+            ])
+            if drop_legacy:
+                self.debates_collection.delete_many({'_id': {'$in': [debate['_id'] for debate in debates]}})
+            
+            ideas += 1
+            buckets += len(documents)
+            turns += len(debates)
+            if ideas % 100 == 0:
+                log(f"  {ideas} ideas migrated")
+        return ideas, buckets, turns
     
     def save_requirements(self, idea_id, requirements_data):
         """Save refined requirements to MongoDB"""
         requirements_data['idea_id'] = idea_id
         requirements_data['created_at'] = datetime.utcnow()
         result = self.requirements_collection.insert_one(requirements_data)
+        self._record_refinement(idea_id, requirements_data)
+        self._invalidate(*idea_keys(idea_id))
         return str(result.inserted_id)
     
     def save_feedback_iteration(self, idea_id, iteration_data):
@@ -124,80 +595,45 @@ class MongoDBService:
         iteration_data['idea_id'] = idea_id
         iteration_data['created_at'] = datetime.utcnow()
         result = self.requirements_collection.insert_one(iteration_data)
+        self._record_refinement(idea_id, iteration_data)
+        self._invalidate(*idea_keys(idea_id))
         return str(result.inserted_id)
     
-    def get_idea_history(self, limit=10):
-        """Get recent ideas with their requirements"""
-        pipeline = [
-            {
-                '$lookup': {
-                    'from': 'requirements',
-                    'localField': '_id',
-                    'foreignField': 'idea_id',
-                    'as': 'requirements'
-                }
-            },
-            {
-                '$lookup': {
-                    'from': 'debates',
-                    'localField': '_id',
-                    'foreignField': 'idea_id',
-                    'as': 'debates'
-                }
-            },
-            {
-                '$addFields': {
-                    'debate_count': {'$size': '$debates'},
-                    'latest_requirement': {
-                        '$cond': {
-                            'if': {'$gt': [{'$size': '$requirements'}, 0]},
-                            'then': {
-                                'refined_requirements': {'$arrayElemAt': ['$requirements.refined_requirements', -1]},
-                                'trade_offs': {'$arrayElemAt': ['$requirements.trade_offs', -1]},
-                                'next_steps': {'$arrayElemAt': ['$requirements.next_steps', -1]}
-                            },
-                            'else': None
-                        }
-                    }
-                }
-            },
-            {
-                '$sort': {'created_at': -1}
-            },
-            {
-                '$limit': limit
-            }
-        ]
-        
-        return list(self.ideas_collection.aggregate(pipeline))
+    def get_idea_history(self, user_id, limit=10, cursor=None):
+        """Get a page of a user's ideas, newest first, from the idea_summaries read model.
+
+        Returns (summaries, next_cursor); pass next_cursor back to get the following page.
+        """
+        summaries, next_cursor = keyset_page(
+            self.idea_summaries_collection,
+            {'user_id': user_id},
+            'created_at',
+            DESCENDING,
+            limit=limit,
+            cursor=cursor
+        )
+        return _attach_latest_requirement(summaries), next_cursor
     
     def get_idea_details(self, idea_id):
-        """Get detailed information about a specific idea"""
-        from bson import ObjectId
-        
+        """Get detailed information about a specific idea, through the read cache"""
+        cache = get_read_cache()
+        if cache is None:
+            return self._load_idea_details(idea_id)
+        return cache.get_or_load(idea_details_key(idea_id), lambda: self._load_idea_details(idea_id))
+    
+    def _load_idea_details(self, idea_id):
+        """Read an idea, its debates and latest PRD from MongoDB"""
         # Get idea
         idea = self.ideas_collection.find_one({'_id': ObjectId(idea_id)})
         if not idea:
             return None
         
         # Get debates organized by round
-        debates = list(self.debates_collection.find({'idea_id': idea_id}).sort([('round_number', 1), ('timestamp', 1)]))
+        debate_rounds = self._load_debate_rounds(idea_id)
         
         # Get latest requirement
         requirement = self.requirements_collection.find_one({'idea_id': idea_id}, sort=[('created_at', -1)])
         
-        # Organize debates by round
-        debate_rounds = {}
-        for debate in debates:
-            round_num = debate['round_number']
-            if round_num not in debate_rounds:
-                debate_rounds[round_num] = []
-            debate_rounds[round_num].append({
-                'agent': debate['agent_name'],
-                'message': debate['message'],
-                'timestamp': debate['timestamp'].isoformat()
-            })
-        
         return {
             'idea': idea,
             'debate_rounds': debate_rounds,
@@ -205,9 +641,14 @@ class MongoDBService:
         }
     
     def get_idea_with_iterations(self, idea_id):
-        """Get idea with all its requirement iterations"""
-        from bson import ObjectId
-        
+        """Get idea with all its requirement iterations, through the read cache"""
+        cache = get_read_cache()
+        if cache is None:
+            return self._load_idea_with_iterations(idea_id)
+        return cache.get_or_load(idea_iterations_key(idea_id), lambda: self._load_idea_with_iterations(idea_id))
+    
+    def _load_idea_with_iterations(self, idea_id):
+        """Read an idea, every PRD iteration and its debates from MongoDB"""
         # Get idea
         idea = self.ideas_collection.find_one({'_id': ObjectId(idea_id)})
         if not idea:
@@ -216,20 +657,8 @@ class MongoDBService:
         # Get all requirement iterations
         requirements = list(self.requirements_collection.find({'idea_id': idea_id}).sort('created_at', 1))
         
-        # Get debates
-        debates = list(self.debates_collection.find({'idea_id': idea_id}).sort([('round_number', 1), ('timestamp', 1)]))
-        
-        # Organize debates by round
-        debate_rounds = {}
-        for debate in debates:
-            round_num = debate['round_number']
-            if round_num not in debate_rounds:
-                debate_rounds[round_num] = []
-            debate_rounds[round_num].append({
-                'agent': debate['agent_name'],
-                'message': debate['message'],
-                'timestamp': debate['timestamp'].isoformat()
-            })
+        # Get debates organized by round
+        debate_rounds = self._load_debate_rounds(idea_id)
         
         return {
             'idea': idea,
@@ -241,15 +670,7 @@ class MongoDBService:
     def create_user(self, user_data):
         """Create a new user with initial 10 credits"""
         try:
-            user_doc = {
-                'email': user_data['email'],
-                'name': user_data.get('name', ''),
-                'avatar': user_data.get('picture', ''),  # Google OAuth provides 'picture' field
-                'credits': 10,  # Initial credits
-                'created_at': datetime.utcnow(),
-                'last_login': datetime.utcnow(),
-                'is_active': True
-            }
+            user_doc = _new_user_document(user_data)
             
             # print(f"🔧 Creating user: {user_data['email']}")
             result = self.users_collection.insert_one(user_doc)
@@ -271,20 +692,20 @@ class MongoDBService:
     def get_user_by_email(self, email):
         """Get user by email"""
         try:
-            user = self.users_collection.find_one({'email': email})
+            user = self.users_collection.find_one({'email': email}, {'credit_outbox': 0})
             if user:
                 user['_id'] = str(user['_id'])
             else:
-                print(f"ℹ️ User not found: {email}")
+                logger.info("User not found")
             return user
         except Exception as e:
-            print(f"❌ Error getting user by email: {str(e)}")
+            logger.error("Error getting user by email: %s", e)
             return None
     
     def get_user_by_id(self, user_id):
         """Get user by ID"""
         try:
-            user = self.users_collection.find_one({'_id': ObjectId(user_id)})
+            user = self.users_collection.find_one({'_id': ObjectId(user_id)}, {'credit_outbox': 0})
             if user:
                 user['_id'] = str(user['_id'])
             return user
@@ -292,12 +713,9 @@ class MongoDBService:
             return None
     
     def update_user_login(self, user_id):
-        """Update user's last login time"""
+        """Update user's last login time, at most once per LAST_LOGIN_WRITE_INTERVAL_SECONDS across workers"""
         try:
-            self.users_collection.update_one(
-                {'_id': ObjectId(user_id)},
-                {'$set': {'last_login': datetime.utcnow()}}
-            )
+            self.users_collection.update_one(_last_login_filter(user_id), {'$set': {'last_login': datetime.utcnow()}})
             return True
         except:
             return False
@@ -316,6 +734,7 @@ class MongoDBService:
                     {'_id': ObjectId(user_id)},
                     {'$set': update_data}
                 )
+                verified_user_cache.invalidate_user(user_id)
             return True
         except:
             return False
@@ -324,36 +743,78 @@ class MongoDBService:
     def get_user_credits(self, user_id):
         """Get user's current credit balance"""
         try:
-            user = self.users_collection.find_one({'_id': ObjectId(user_id)})
+            user = self.users_collection.find_one({'_id': ObjectId(user_id)}, {'credits': 1})
             return user.get('credits', 0) if user else 0
         except:
             return 0
     
+    def _change_credits(self, user_id, amount, transaction_type, description, require_balance=False):
+        """Apply a credit delta and queue its ledger entry in one atomic update.
+
+        The ledger entry is pushed onto the user's credit_outbox in the same
+        document update as the balance change, so the two can never disagree;
+        flush_credit_outbox later moves it into credit_transactions. Returns
+        the updated user, or None if the user is missing or cannot afford it.
+        """
+        query, update = _credit_change(user_id, amount, transaction_type, description, require_balance)
+        user = self.users_collection.find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
+        if user is None:
+            return None
+        
+        outbox = user.pop('credit_outbox', [])
+        if len(outbox) >= getattr(settings, 'CREDIT_OUTBOX_FLUSH_SIZE', 20):
+            self._flush_entries(user['_id'], outbox)
+        user['_id'] = str(user['_id'])
+        
+        # Keep this process's auth cache showing the new balance
+        verified_user_cache.update_user(user)
+        return user
+    
+    def reserve_credits(self, user_id, amount, description='Requirement generation'):
+        """Atomically deduct credits if the balance covers them; returns the updated user or None.
+
+        A reservation is final once made: success needs no further write and
+        failure is undone with refund_credits.
+        """
+        user = self._change_credits(user_id, -amount, 'deduction', description, require_balance=True)
+        if user is None:
+            CREDIT_RESERVATION_FAILURES.inc()
+        return user
+    
+    def refund_credits(self, user_id, amount, description):
+        """Return reserved credits after a failed operation; returns the updated user or None"""
+        return self._change_credits(user_id, amount, 'refund', description)
+    
+    def flush_credit_outbox(self, user_id):
+        """Move a user's pending ledger entries into credit_transactions"""
+        user = self.users_collection.find_one({'_id': ObjectId(user_id)}, {'credit_outbox': 1})
+        if user and user.get('credit_outbox'):
+            self._flush_entries(user['_id'], user['credit_outbox'])
+    
+    def _flush_entries(self, user_oid, entries):
+        """Insert outbox entries into the ledger, then drop them from the user document.
+
+        Entries keep their _id, so a flush that races another or is retried
+        after a crash skips the ones already written instead of duplicating them.
+        """
+        try:
+            self.credit_transactions_collection.insert_many(entries, ordered=False)
+        except BulkWriteError as e:
+            if any(error.get('code') != 11000 for error in e.details.get('writeErrors', [])):
+                logger.error("Error flushing credit ledger: %s", e)
+                return
+        self.users_collection.update_one(
+            {'_id': user_oid},
+            {'$pull': {'credit_outbox': {'_id': {'$in': [entry['_id'] for entry in entries]}}}}
+        )
+    
     def deduct_credits(self, user_id, amount=2, description='Requirement generation'):
         """Deduct credits from user account"""
         try:
-            # Check if user has sufficient credits
-            current_credits = self.get_user_credits(user_id)
-            if current_credits < amount:
+            if self.reserve_credits(user_id, amount, description) is None:
+                current_credits = self.get_user_credits(user_id)
                 return False, f"Insufficient credits. Required: {amount}, Available: {current_credits}"
-            
-            # Deduct credits
-            result = self.users_collection.update_one(
-                {'_id': ObjectId(user_id)},
-                {'$inc': {'credits': -amount}}
-            )
-            
-            if result.modified_count > 0:
-                # Log the transaction
-                self.log_credit_transaction(
-                    user_id=user_id,
-                    transaction_type='deduction',
-                    amount=-amount,
-                    description=description
-                )
-                return True, f"Successfully deducted {amount} credits"
-            else:
-                return False, "Failed to deduct credits"
+            return True, f"Successfully deducted {amount} credits"
                 
         except Exception as e:
             return False, f"Error deducting credits: {str(e)}"
@@ -361,22 +822,9 @@ class MongoDBService:
     def add_credits(self, user_id, amount, description='Credit purchase'):
         """Add credits to user account"""
         try:
-            result = self.users_collection.update_one(
-                {'_id': ObjectId(user_id)},
-                {'$inc': {'credits': amount}}
-            )
-            
-            if result.modified_count > 0:
-                # Log the transaction
-                self.log_credit_transaction(
-                    user_id=user_id,
-                    transaction_type='addition',
-                    amount=amount,
-                    description=description
-                )
-                return True, f"Successfully added {amount} credits"
-            else:
+            if self._change_credits(user_id, amount, 'addition', description) is None:
                 return False, "Failed to add credits"
+            return True, f"Successfully added {amount} credits"
                 
         except Exception as e:
             return False, f"Error adding credits: {str(e)}"
@@ -386,7 +834,7 @@ class MongoDBService:
         try:
             transaction_doc = {
                 'user_id': user_id,
-                'transaction_type': transaction_type,  # 'initial', 'deduction', 'addition'
+                'transaction_type': transaction_type,  # 'initial', 'deduction', 'addition', 'refund'
                 'amount': amount,
                 'description': description,
                 'created_at': datetime.utcnow()
@@ -396,22 +844,31 @@ class MongoDBService:
             # print(f"✅ Credit transaction logged: {transaction_type} {amount} credits for user {user_id}")
             
         except Exception as e:
-            print(f"❌ Error logging credit transaction: {str(e)}")
+            logger.error("Error logging credit transaction: %s", e)
     
-    def get_user_transactions(self, user_id, limit=20):
-        """Get user's credit transaction history"""
+    def get_user_transactions(self, user_id, limit=20, cursor=None):
+        """Get a page of user's credit transaction history as (transactions, next_cursor)"""
         try:
-            transactions = list(self.credit_transactions_collection.find(
-                {'user_id': user_id}
-            ).sort('created_at', -1).limit(limit))
+            # Pending ledger entries are written out first so the history is complete
+            self.flush_credit_outbox(user_id)
+            transactions, next_cursor = keyset_page(
+                self.credit_transactions_collection,
+                {'user_id': user_id},
+                'created_at',
+                DESCENDING,
+                limit=limit,
+                cursor=cursor
+            )
             
             # Convert ObjectId to string
             for transaction in transactions:
                 transaction['_id'] = str(transaction['_id'])
             
-            return transactions
+            return transactions, next_cursor
+        except InvalidCursor:
+            raise
         except:
-            return []
+            return [], None
     
     # Chat Session Management Methods
     def create_chat_session(self, user_id, title="New Chat", idea_summary=""):
@@ -426,42 +883,48 @@ class MongoDBService:
                 'updated_at': datetime.utcnow()
             }
             result = self.chat_sessions_collection.insert_one(session_data)
+            self._invalidate(chat_sessions_key(user_id))
             return str(result.inserted_id)
         except Exception as e:
-            print(f"Error creating chat session: {str(e)}")
+            logger.error("Error creating chat session: %s", e)
             return None
 
-    def get_user_chat_sessions(self, user_id, limit=50):
-        """Get all chat sessions for a user"""
+    def get_user_chat_sessions(self, user_id, limit=50, cursor=None):
+        """Get a page of a user's chat sessions, most recently updated first, as (sessions, next_cursor)"""
         try:
-            sessions = list(self.chat_sessions_collection.find(
-                {'user_id': user_id},
-                {'_id': 1, 'title': 1, 'idea_summary': 1, 'status': 1, 'created_at': 1, 'updated_at': 1}
-            ).sort('updated_at', -1).limit(limit))
-            
-            # Convert ObjectId to string for JSON serialization
-            for session in sessions:
-                session['_id'] = str(session['_id'])
-                session['created_at'] = session['created_at'].isoformat()
-                session['updated_at'] = session['updated_at'].isoformat()
-            
-            return sessions
+            cache = get_read_cache()
+            if cache is None or cursor is not None or limit != CACHED_SESSION_PAGE_LIMIT:
+                return self._load_user_chat_sessions(user_id, limit, cursor)
+            return cache.get_or_load(chat_sessions_key(user_id), lambda: self._load_user_chat_sessions(user_id, limit, cursor))
+        except InvalidCursor:
+            raise
         except Exception as e:
-            print(f"Error getting user chat sessions: {str(e)}")
-            return []
+            logger.error("Error getting user chat sessions: %s", e)
+            return [], None
+
+    def _load_user_chat_sessions(self, user_id, limit, cursor):
+        """Read a page of chat sessions from MongoDB; errors propagate so they are never cached"""
+        sessions, next_cursor = keyset_page(
+            self.chat_sessions_collection,
+            {'user_id': user_id},
+            'updated_at',
+            DESCENDING,
+            limit=limit,
+            cursor=cursor,
+            projection=SESSION_LIST_PROJECTION
+        )
+        
+        # Convert ObjectId to string for JSON serialization
+        return [_serialize_session(session) for session in sessions], next_cursor
 
     def get_chat_session(self, session_id):
         """Get a specific chat session by ID"""
         try:
             from bson import ObjectId
             session = self.chat_sessions_collection.find_one({'_id': ObjectId(session_id)})
-            if session:
-                session['_id'] = str(session['_id'])
-                session['created_at'] = session['created_at'].isoformat()
-                session['updated_at'] = session['updated_at'].isoformat()
-            return session
+            return _serialize_session(session) if session else None
         except Exception as e:
-            print(f"Error getting chat session: {str(e)}")
+            logger.error("Error getting chat session: %s", e)
             return None
 
     def update_chat_session(self, session_id, updates):
@@ -469,13 +932,18 @@ class MongoDBService:
         try:
             from bson import ObjectId
             updates['updated_at'] = datetime.utcnow()
-            result = self.chat_sessions_collection.update_one(
+            # Return the owner so their cached session list can be dropped
+            session = self.chat_sessions_collection.find_one_and_update(
                 {'_id': ObjectId(session_id)},
-                {'$set': updates}
+                {'$set': updates},
+                projection={'user_id': 1}
             )
-            return result.modified_count > 0
+            if session is None:
+                return False
+            self._invalidate(chat_sessions_key(session['user_id']))
+            return True
         except Exception as e:
-            print(f"Error updating chat session: {str(e)}")
+            logger.error("Error updating chat session: %s", e)
             return False
 
     def delete_chat_session(self, session_id):
@@ -485,10 +953,13 @@ class MongoDBService:
             # Delete all messages first
             self.chat_messages_collection.delete_many({'session_id': session_id})
             # Delete the session
-            result = self.chat_sessions_collection.delete_one({'_id': ObjectId(session_id)})
-            return result.deleted_count > 0
+            session = self.chat_sessions_collection.find_one_and_delete({'_id': ObjectId(session_id)}, projection={'user_id': 1})
+            if session is None:
+                return False
+            self._invalidate(chat_sessions_key(session['user_id']))
+            return True
         except Exception as e:
-            print(f"Error deleting chat session: {str(e)}")
+            logger.error("Error deleting chat session: %s", e)
             return False
 
     def add_chat_message(self, session_id, role, content, round_number=1):
@@ -508,37 +979,42 @@ class MongoDBService:
             
             return str(result.inserted_id)
         except Exception as e:
-            print(f"Error adding chat message: {str(e)}")
+            logger.error("Error adding chat message: %s", e)
             return None
 
-    def get_chat_messages(self, session_id, limit=100):
-        """Get all messages for a chat session"""
+    def get_chat_messages(self, session_id, limit=100, cursor=None):
+        """Get a page of a chat session's messages, oldest first, as (messages, next_cursor)"""
         try:
-            messages = list(self.chat_messages_collection.find(
+            messages, next_cursor = keyset_page(
+                self.chat_messages_collection,
                 {'session_id': session_id},
-                {'_id': 1, 'role': 1, 'content': 1, 'round_number': 1, 'timestamp': 1}
-            ).sort('timestamp', 1).limit(limit))
+                'timestamp',
+                ASCENDING,
+                limit=limit,
+                cursor=cursor,
+                projection=MESSAGE_PROJECTION
+            )
             
             # Convert ObjectId to string for JSON serialization
-            for message in messages:
-                message['_id'] = str(message['_id'])
-                message['timestamp'] = message['timestamp'].isoformat()
-            
-            return messages
+            return [_serialize_message(message) for message in messages], next_cursor
+        except InvalidCursor:
+            raise
         except Exception as e:
-            print(f"Error getting chat messages: {str(e)}")
-            return []
+            logger.error("Error getting chat messages: %s", e)
+            return [], None
 
     def get_session_message_count(self, session_id):
         """Get the count of messages in a session"""
         try:
             return self.chat_messages_collection.count_documents({'session_id': session_id})
         except Exception as e:
-            print(f"Error getting session message count: {str(e)}")
+            logger.error("Error getting session message count: %s", e)
             return 0
     
     def close(self):
-        """Close MongoDB connection"""
+        """Close MongoDB connection; the shared process-wide pool is left open"""
+        if self.client is _client:
+            return
         try:
             self.client.close()
             # print("🔌 MongoDB connection closed")
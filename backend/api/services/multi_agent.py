@@ -1,30 +1,86 @@
 import os
-import google.generativeai as genai
-from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_core.prompts import ChatPromptTemplate
 from django.conf import settings
 import json
+import logging
+import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .llm_cache import get_llm_cache, make_cache_key
+from .debate_context import build_debate_context, summarize_stance
+from .quota import get_quota_ledger
+from .convergence import ConvergenceTracker
+from .prd_parser import SECTION_KEYS, PrdSectionParser, parse_prd_sections
+from .prd_schema import PRD_JSON_SCHEMA, parse_structured_prd
+from .llm_providers import bind_json_schema, create_llm, is_rate_limit_error, GEMINI_MODEL_NAME
+from .metrics import llm_call, record_debate_turns, LLM_QUOTA_REMAINING
+
+
+logger = logging.getLogger(__name__)
 
 
 ROUNDS = 2
+MODEL_NAME = GEMINI_MODEL_NAME
+
+# Debate modes: one LLM call per agent per round, or one structured call for the whole panel
+DEBATE_MODE_PER_AGENT = 'per_agent'
+DEBATE_MODE_PANEL = 'panel'
+
+# PRD formats: schema-constrained JSON with one field per section, or numbered text parsed afterwards
+PRD_FORMAT_STRUCTURED = 'structured'
+PRD_FORMAT_TEXT = 'text'
+
+
+class AggregationError(Exception):
+    """The debate could not be turned into a PRD"""
+
 
 class MultiAgentSystem:
-    """Multi-agent system for requirement refinement using LangChain + Gemini"""
-    
-    def __init__(self):
-        # Configure Gemini
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        self.llm = ChatGoogleGenerativeAI(
-            model="gemini-1.5-flash",
-            google_api_key=settings.GEMINI_API_KEY,
-            temperature=0.7,
-            max_retries=0  # Disable retries to prevent quota waste
-        )
+    """Multi-agent system for requirement refinement using LangChain and a pluggable LLM provider"""
+    
+    def __init__(self, max_concurrency=None, use_cache=True, context_token_budget=None, quota_ledger=None, debate_mode=None,
+                 max_rounds=None, min_rounds=None, convergence_threshold=None, llm_provider=None, prd_format=None):
+        # Chat model from the provider selected by LLM_PROVIDER (see llm_providers)
+        self.model_name, self.llm = create_llm(llm_provider, temperature=0.7)
         
-        # Track API usage to prevent quota exhaustion
+        # Track API usage to prevent quota exhaustion. api_calls_made/max_api_calls cap a
+        # single request; the shared ledger enforces the provider's daily quota across workers.
         self.api_calls_made = 0
         self.max_api_calls = 45  # Leave some buffer for other operations
+        self._quota_lock = threading.Lock()
+        self.quota_ledger = quota_ledger or get_quota_ledger()
+        self._shared_quota_exhausted = False
+        
+        # How many agents of a round may call the LLM at the same time
+        if max_concurrency is None:
+            max_concurrency = getattr(settings, 'DEBATE_MAX_CONCURRENCY', 5)
+        self.max_concurrency = max(1, int(max_concurrency))
+        
+        # Upper bound on the debate history sent with each agent prompt
+        if context_token_budget is None:
+            context_token_budget = getattr(settings, 'DEBATE_CONTEXT_TOKEN_BUDGET', 3000)
+        self.context_token_budget = context_token_budget
+        
+        # Panel mode trades per-agent prompts for one structured call per round
+        self.debate_mode = debate_mode or getattr(settings, 'DEBATE_MODE', DEBATE_MODE_PER_AGENT)
+        
+        # Structured PRDs come back as validated JSON instead of text that has to be split into sections
+        self.prd_format = prd_format or getattr(settings, 'PRD_FORMAT', PRD_FORMAT_STRUCTURED)
+        
+        # Identical prompts are answered from the response cache unless the caller wants fresh output
+        self.cache = get_llm_cache() if use_cache else None
+        self.cache_hits = 0
+        
+        # Debates stop between min_rounds and max_rounds once responses stop changing
+        if max_rounds is None:
+            max_rounds = getattr(settings, 'DEBATE_MAX_ROUNDS', 4)
+        self.max_rounds = max(1, int(max_rounds))
+        self.min_rounds = min_rounds
+        self.convergence_threshold = convergence_threshold
+        self.rounds_executed = 0
+        self.convergence_scores = []
         
         # Define agent personas
         self.agents = {
@@ -67,20 +123,126 @@ class MultiAgentSystem:
     
     def check_api_quota(self):
         """Check if we have API calls remaining"""
-        return self.api_calls_made < self.max_api_calls
+        return self.api_calls_made < self.max_api_calls and not self._shared_quota_exhausted
     
     def increment_api_calls(self):
         """Increment API call counter"""
-        self.api_calls_made += 1
+        with self._quota_lock:
+            self.api_calls_made += 1
+    
+    def _reserve_api_call(self):
+        """Atomically claim one API call from the request and shared daily quotas, returning False if none are left"""
+        if not self._claim_request_call():
+            return False
+        
+        if self._ledger_call('reserve', default=True):
+            return True
+        
+        self._release_request_call()
+        return False
+    
+    def _claim_request_call(self):
+        """Take one call from this request's budget, returning False if it or the shared quota is spent"""
+        with self._quota_lock:
+            if self.api_calls_made >= self.max_api_calls or self._shared_quota_exhausted:
+                return False
+            self.api_calls_made += 1
+            return True
+    
+    def _release_request_call(self):
+        """Hand back the per-request slot after another worker used up the daily quota"""
+        with self._quota_lock:
+            self.api_calls_made -= 1
+            self._shared_quota_exhausted = True
+    
+    def _commit_api_call(self):
+        """Record in the shared ledger that a reserved call reached the provider"""
+        self._ledger_call('commit')
+    
+    def _mark_quota_exhausted(self, error_msg=""):
+        """Stop further API calls after the provider reported a quota error"""
+        if self._stop_api_calls(error_msg):
+            self._ledger_call('mark_exhausted')
+    
+    def _stop_api_calls(self, error_msg):
+        """Spend this request's budget; returns True when the error means every worker must stop too"""
+        with self._quota_lock:
+            self.api_calls_made = max(self.api_calls_made, self.max_api_calls)
+        # Plain rate limiting only stops this request; a quota error stops every worker until reset
+        if "quota" in error_msg.lower():
+            self._shared_quota_exhausted = True
+            return True
+        return False
+    
+    def _ledger_call(self, operation, default=None):
+        """Run a shared quota ledger operation, failing open if the ledger is unreachable"""
+        try:
+            return getattr(self.quota_ledger, operation)(self.model_name)
+        except Exception as e:
+            logger.warning("Quota ledger %s failed: %s", operation, e)
+            return default
+    
+    def _start_session(self, planned_rounds):
+        """Reset per-request counters and size the debate to the shared quota that is left.
+
+        Returns the number of rounds to run: fewer than planned when the remaining
+        daily quota cannot cover every agent plus aggregation, so the debate degrades
+        by rounds instead of falling back mid-round.
+        """
+        self._reset_session()
+        return self._rounds_for_quota(planned_rounds, self._ledger_call('remaining'))
+    
+    def _reset_session(self):
+        """Reset per-request counters"""
+        self.api_calls_made = 0
+        self.cache_hits = 0
+        self.rounds_executed = 0
+        self.convergence_scores = []
+    
+    def _rounds_for_quota(self, planned_rounds, remaining):
+        """Number of rounds the remaining shared quota can pay for; planned_rounds when the ledger is unreachable"""
+        if remaining is None:
+            self._shared_quota_exhausted = False
+            return planned_rounds
+        LLM_QUOTA_REMAINING.labels(self.model_name).set(remaining)
+        
+        self._shared_quota_exhausted = remaining <= 0
+        calls_per_round = 1 if self.debate_mode == DEBATE_MODE_PANEL else len(self.agents)
+        affordable_rounds = (remaining - 1) // calls_per_round
+        return max(1, min(planned_rounds, affordable_rounds))
+    
+    def _get_cached_response(self, messages):
+        """Look up formatted messages in the response cache, returning (key, content)"""
+        if self.cache is None:
+            return None, None
+        key = self._cache_key(messages)
+        return key, self._count_cache_hit(self.cache.get(key))
+    
+    def _cache_key(self, messages):
+        """Response cache key for formatted messages sent to this system's model"""
+        return make_cache_key(getattr(self.llm, 'model', ''), getattr(self.llm, 'temperature', None), messages)
+    
+    def _count_cache_hit(self, content):
+        """Count a cache lookup that found content, passing the content through"""
+        if content is not None:
+            with self._quota_lock:
+                self.cache_hits += 1
+        return content
+    
+    def _store_cached_response(self, key, content):
+        """Remember a successful LLM response"""
+        if self.cache is not None and key is not None and content:
+            self.cache.set(key, content)
     
     def get_agent_response(self, agent_key, idea, context="", previous_debate="", user_feedback=""):
         """Get response from a specific agent with context from previous debate and user feedback"""
+        response, _ = self._get_agent_turn(agent_key, idea, context, previous_debate, user_feedback)
+        return response
+    
+    def _build_agent_messages(self, agent_key, idea, context="", previous_debate="", user_feedback=""):
+        """Build the prompt messages for one agent's turn"""
         agent = self.agents[agent_key]
         
-        # Check if we should use fallback due to quota
-        if not self.check_api_quota():
-            return self._get_fallback_response(agent_key, idea)
-        
         # Build context string
         context_parts = []
         if context:
@@ -110,19 +272,206 @@ class MultiAgentSystem:
             
             Be specific and actionable in your feedback.""")
         ])
+        return prompt.format_messages()
+    
+    def _get_agent_turn(self, agent_key, idea, context="", previous_debate="", user_feedback=""):
+        """Get an agent's response along with whether it came from the fallback path"""
+        agent = self.agents[agent_key]
+        messages = self._build_agent_messages(agent_key, idea, context, previous_debate, user_feedback)
+        
+        # Cache hits are free and do not count against the quota
+        cache_key, cached = self._get_cached_response(messages)
+        if cached is not None:
+            return cached, False
+        
+        # Reserve the call up front so concurrent agents cannot overrun the quota
+        if not self._reserve_api_call():
+            return self._get_fallback_response(agent_key, idea), True
         
         try:
-            self.increment_api_calls()
-            response = self.llm.invoke(prompt.format_messages())
-            return response.content
+            response = self._invoke_llm(messages, agent_key)
+            self._commit_api_call()
+            self._store_cached_response(cache_key, response.content)
+            return response.content, False
         except Exception as e:
             error_msg = str(e)
-            if "quota" in error_msg.lower() or "rate limit" in error_msg.lower() or "429" in error_msg:
+            if is_rate_limit_error(error_msg):
                 # Mark quota as exhausted
-                self.api_calls_made = self.max_api_calls
-                return self._get_fallback_response(agent_key, idea)
+                self._mark_quota_exhausted(error_msg)
+                return self._get_fallback_response(agent_key, idea), True
+            else:
+                self._commit_api_call()  # The request reached the provider and still counts
+                return f"Error getting response from {agent['name']}: {error_msg}", False
+    
+    def _invoke_llm(self, messages, agent_key, llm=None):
+        """Call the LLM (or the given bound variant of it) for agent_key, recording latency, tokens and the outcome"""
+        with llm_call(self.model_name, agent_key, messages) as call:
+            response = (llm or self.llm).invoke(messages)
+            call.record(response)
+        return response
+    
+    def _stream_llm(self, messages, agent_key):
+        """Stream the LLM's chunks for agent_key, recording latency, tokens and the outcome"""
+        with llm_call(self.model_name, agent_key, messages) as call:
+            chunks = []
+            try:
+                for chunk in self.llm.stream(messages):
+                    chunks.append(chunk.content or "")
+                    yield chunk
+            finally:
+                call.record_text("".join(chunks))
+    
+    def _build_panel_messages(self, idea, context="", user_feedback=""):
+        """Build one prompt asking the model to answer as every persona at once"""
+        personas = "\n\n".join(
+            f"- key \"{agent_key}\" ({agent['name']}, focus: {agent['focus']}): {' '.join(agent['system_prompt'].split())}"
+            for agent_key, agent in self.agents.items()
+        )
+        
+        context_parts = []
+        if context:
+            context_parts.append(f"Previous context: {context}")
+        if user_feedback:
+            context_parts.append(f"User feedback: {user_feedback}")
+        full_context = "\n\n".join(context_parts)
+        
+        return [
+            SystemMessage(content="You simulate a product team debate, answering separately and in character for each stakeholder on the panel."),
+            HumanMessage(content=f"""Product Idea: {idea}
+
+{full_context}
+
+Panel members:
+{personas}
+
+For every panel member, write their perspective on this product idea in 2-3 paragraphs covering:
+1. Their thoughts on the idea and any feedback provided
+2. Key considerations from their perspective
+3. How their perspective addresses or builds upon previous discussion
+4. Specific suggestions for improvement
+
+Respond with only a JSON object that maps each panel member's key to their response as a string. Include every key exactly once and no other text.""")
+        ]
+    
+    def _parse_panel_response(self, content):
+        """Parse the panel JSON into {agent_key: response}, dropping anything malformed"""
+        text = content.strip()
+        fenced = re.match(r'^```(?:json)?\s*(.*?)\s*```$', text, re.DOTALL)
+        if fenced:
+            text = fenced.group(1)
+        
+        try:
+            data = json.loads(text)
+        except ValueError:
+            start, end = text.find('{'), text.rfind('}')
+            if start == -1 or end <= start:
+                return {}
+            try:
+                data = json.loads(text[start:end + 1])
+            except ValueError:
+                return {}
+        
+        if not isinstance(data, dict):
+            return {}
+        return {
+            agent_key: response.strip()
+            for agent_key, response in data.items()
+            if agent_key in self.agents and isinstance(response, str) and response.strip()
+        }
+    
+    def _get_panel_turns(self, idea, context="", user_feedback=""):
+        """Get every agent's response from one structured LLM call; missing agents are omitted"""
+        messages = self._build_panel_messages(idea, context, user_feedback)
+        
+        cache_key, cached = self._get_cached_response(messages)
+        if cached is not None:
+            return self._parse_panel_response(cached)
+        
+        if not self._reserve_api_call():
+            return {}
+        
+        try:
+            response = self._invoke_llm(messages, 'panel')
+            self._commit_api_call()
+        except Exception as e:
+            error_msg = str(e)
+            if is_rate_limit_error(error_msg):
+                self._mark_quota_exhausted(error_msg)
             else:
-                return f"Error getting response from {agent['name']}: {error_msg}"
+                self._commit_api_call()  # The request reached the provider and still counts
+            return {}
+        
+        panel = self._parse_panel_response(response.content)
+        if len(panel) == len(self.agents):
+            self._store_cached_response(cache_key, response.content)
+        else:
+            logger.warning("Panel response covered %d/%d agents, falling back per agent", len(panel), len(self.agents))
+        return panel
+    
+    def _run_round(self, idea, round_number, context="", user_feedback="", on_event=None):
+        """Run one debate round, logged in persona order.
+
+        In panel mode one structured call answers for every agent; agents it
+        misses (or every agent, in per-agent mode) are queried concurrently.
+        ``on_event`` is called with a ``turn`` event as soon as each agent
+        finishes, in completion order, so callers can stream the debate.
+        """
+        turns = {}
+        
+        def agent_turn(agent_key):
+            return self._get_agent_turn(agent_key, idea, context=context, user_feedback=user_feedback)
+        
+        def record_turn(agent_key, turn):
+            turns[agent_key] = turn
+            self._emit_turn(agent_key, turn, round_number, on_event)
+        
+        if self.debate_mode == DEBATE_MODE_PANEL:
+            panel = self._get_panel_turns(idea, context=context, user_feedback=user_feedback)
+            for agent_key in self.agents.keys():
+                if agent_key in panel:
+                    record_turn(agent_key, (panel[agent_key], False))
+        
+        agent_keys = [agent_key for agent_key in self.agents.keys() if agent_key not in turns]
+        if len(agent_keys) > 1 and self.max_concurrency > 1:
+            workers = min(self.max_concurrency, len(agent_keys))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='debate-agent') as executor:
+                futures = {executor.submit(agent_turn, agent_key): agent_key for agent_key in agent_keys}
+                for future in as_completed(futures):
+                    record_turn(futures[future], future.result())
+        else:
+            for agent_key in agent_keys:
+                record_turn(agent_key, agent_turn(agent_key))
+        
+        return self._round_log(turns, round_number)
+    
+    def _emit_turn(self, agent_key, turn, round_number, on_event):
+        """Send a ``turn`` event for one finished agent"""
+        if on_event:
+            response, fallback = turn
+            on_event({
+                'type': 'turn',
+                'agent_key': agent_key,
+                'agent': self.agents[agent_key]['name'],
+                'response': response,
+                'round': round_number,
+                'fallback': fallback
+            })
+    
+    def _round_log(self, turns, round_number):
+        """Turn {agent_key: (response, fallback)} into debate_log entries"""
+        record_debate_turns((agent_key, turns[agent_key][1]) for agent_key in self.agents.keys())
+        # Log in persona order regardless of completion order, keeping debate_log deterministic.
+        # Stance summaries are computed once here and stored with the debate for later compaction.
+        return [
+            {
+                'agent': self.agents[agent_key]['name'],
+                'response': turns[agent_key][0],
+                'summary': summarize_stance(turns[agent_key][0]),
+                'round': round_number,
+                'fallback': turns[agent_key][1]
+            }
+            for agent_key in self.agents.keys()
+        ]
     
     def _get_fallback_response(self, agent_key, idea):
         """Provide fallback responses when rate limit is hit"""
@@ -170,127 +519,128 @@ Suggestions: Define clear success metrics, prioritize features based on user val
         
         return fallback_responses.get(agent_key, f"Analysis from {self.agents[agent_key]['name']}: {idea[:100]}...")
     
-    def run_debate(self, idea, rounds=ROUNDS):
+    def _fallback_debate_log(self, idea, round_number):
+        """Use fallback responses for all agents"""
+        record_debate_turns((agent_key, True) for agent_key in self.agents.keys())
+        return [
+            {
+                'agent': agent['name'],
+                'response': self._get_fallback_response(agent_key, idea),
+                'round': round_number,
+                'fallback': True
+            }
+            for agent_key, agent in self.agents.items()
+        ]
+    
+    def _emit_turns(self, debate_log, on_event):
+        """Emit ``turn`` events for entries produced without going through _run_round"""
+        if not on_event:
+            return
+        agent_keys = {agent['name']: agent_key for agent_key, agent in self.agents.items()}
+        for entry in debate_log:
+            on_event(dict(entry, type='turn', agent_key=agent_keys.get(entry['agent'])))
+    
+    def _convergence_tracker(self, rounds):
+        """Create a convergence tracker whose minimum never exceeds the rounds planned"""
+        min_rounds = self.min_rounds
+        if min_rounds is None:
+            min_rounds = getattr(settings, 'DEBATE_MIN_ROUNDS', 2)
+        return ConvergenceTracker(threshold=self.convergence_threshold, min_rounds=min(min_rounds, rounds))
+    
+    def run_debate(self, idea, rounds=ROUNDS, on_event=None):
         """Run multi-agent debate for the given idea with proper round implementation"""
         debate_log = []
         
         # Check if we should use fallback mode from the start
         if not self.check_api_quota():
-            # Use fallback responses for all agents
-            for agent_key in self.agents.keys():
-                response = self._get_fallback_response(agent_key, idea)
-                debate_log.append({
-                    'agent': self.agents[agent_key]['name'],
-                    'response': response,
-                    'round': 1,
-                    'fallback': True
-                })
+            debate_log = self._fallback_debate_log(idea, 1)
+            self._emit_turns(debate_log, on_event)
             return debate_log
         
-        # Run multiple rounds as intended
+        # Run multiple rounds as intended; agents see the previous round verbatim
+        # and earlier rounds as compact stances, within the context token budget
+        tracker = self._convergence_tracker(rounds)
         for round_num in range(1, rounds + 1):
-            round_responses = []
+            previous_context = build_debate_context(debate_log, self.context_token_budget)
             
-            # Each agent responds in this round
-            for agent_key in self.agents.keys():
-                # Build context from previous rounds
-                previous_context = ""
-                if round_num > 1:
-                    previous_responses = [resp for resp in debate_log if resp['round'] == round_num - 1]
-                    previous_context = "\n\n".join([
-                        f"{resp['agent']}: {resp['response']}"
-                        for resp in previous_responses
-                    ])
-                
-                response = self.get_agent_response(agent_key, idea, previous_context)
-                round_responses.append({
-                    'agent': self.agents[agent_key]['name'],
-                    'response': response,
-                    'round': round_num,
-                    'fallback': not self.check_api_quota()  # Mark if we hit quota during processing
-                })
+            round_responses = self._run_round(idea, round_num, context=previous_context, on_event=on_event)
             
             # Add round responses to debate log
             debate_log.extend(round_responses)
+            self.rounds_executed += 1
+            
+            # Stop early once the panel's positions have settled
+            if tracker.observe(round_num, round_responses):
+                logger.info("Debate converged after round %d, skipping %d round(s)", round_num, rounds - round_num)
+                break
             
             # Check if we've hit quota limit
             if not self.check_api_quota():
                 break
         
+        self.convergence_scores = tracker.scores
+        
         return debate_log
     
-    def run_feedback_debate(self, idea, previous_debate_log, user_feedback, rounds=ROUNDS):
+    def run_feedback_debate(self, idea, previous_debate_log, user_feedback, rounds=ROUNDS, on_event=None):
         """Run multi-agent debate based on user feedback and previous discussion with proper rounds"""
         debate_log = []
         
         # Check if we should use fallback mode
         if not self.check_api_quota():
-            # Use fallback responses for all agents
-            for agent_key in self.agents.keys():
-                response = self._get_fallback_response(agent_key, idea)
-                debate_log.append({
-                    'agent': self.agents[agent_key]['name'],
-                    'response': response,
-                    'round': len(previous_debate_log) // len(self.agents) + 1,
-                    'fallback': True
-                })
+            debate_log = self._fallback_debate_log(idea, len(previous_debate_log) // len(self.agents) + 1)
+            self._emit_turns(debate_log, on_event)
             return debate_log
         
-        # Create context from previous debate
-        previous_debate_context = "\n\n".join([
-            f"{resp['agent']}: {resp['response']}"
-            for resp in previous_debate_log
-        ])
-        
         # Run multiple rounds for feedback iteration
+        round_offset = len(previous_debate_log) // len(self.agents)
+        tracker = self._convergence_tracker(rounds)
         for round_num in range(1, rounds + 1):
-            round_responses = []
+            # Compact the previous debate plus this session's rounds so the prompt
+            # stays bounded no matter how many feedback iterations came before
+            current_context = build_debate_context(previous_debate_log + debate_log, self.context_token_budget)
             
-            for agent_key in self.agents.keys():
-                # Build context including previous rounds of this feedback session
-                current_context = previous_debate_context
-                if round_num > 1:
-                    current_round_responses = [resp for resp in debate_log if resp['round'] == round_num - 1]
-                    current_context += "\n\n" + "\n\n".join([
-                        f"{resp['agent']}: {resp['response']}"
-                        for resp in current_round_responses
-                    ])
-                
-                response = self.get_agent_response(
-                    agent_key, 
-                    idea, 
-                    context=current_context,
-                    previous_debate="",
-                    user_feedback=user_feedback
-                )
-                round_responses.append({
-                    'agent': self.agents[agent_key]['name'],
-                    'response': response,
-                    'round': len(previous_debate_log) // len(self.agents) + round_num,
-                    'fallback': not self.check_api_quota()
-                })
+            current_round_responses = self._run_round(
+                idea,
+                round_offset + round_num,
+                context=current_context,
+                user_feedback=user_feedback,
+                on_event=on_event
+            )
             
             # Add round responses to debate log
-            debate_log.extend(round_responses)
+            debate_log.extend(current_round_responses)
+            self.rounds_executed += 1
+            
+            # Stop early once the panel's positions have settled
+            if tracker.observe(round_offset + round_num, current_round_responses):
+                logger.info("Debate converged after round %d, skipping %d round(s)", round_offset + round_num, rounds - round_num)
+                break
             
             # Check if we've hit quota limit
             if not self.check_api_quota():
                 break
         
+        self.convergence_scores = tracker.scores
+        
         return debate_log
     
-    def aggregate_results(self, idea, debate_log):
-        """Aggregate debate results into PRD format"""
-        # Check if we should use fallback aggregation
-        if not self.check_api_quota():
-            return self._get_fallback_aggregation(idea, debate_log)
-        
+    def _build_aggregation_prompt(self, idea, debate_log, prd_format=None):
+        """Build the prompt that turns a debate log into a PRD, in prd_format (default: this system's)"""
         # Create summary of all responses
         all_responses = "\n\n".join([
             f"{resp['agent']} (Round {resp['round']}): {resp['response']}"
             for resp in debate_log
         ])
         
+        if (prd_format or self.prd_format) == PRD_FORMAT_STRUCTURED:
+            format_instruction = (
+                f"Respond with only a JSON object with one string field per section, keyed {', '.join(SECTION_KEYS)}. "
+                "Put each section's content in its field without the section number or title."
+            )
+        else:
+            format_instruction = "Format your response clearly with these 10 numbered sections."
+        
         aggregation_prompt = ChatPromptTemplate.from_messages([
             ("system", """You are an expert product strategist who can synthesize multiple stakeholder perspectives into a comprehensive Product Requirements Document (PRD)."""),
             ("human", f"""Product Idea: {idea}
@@ -341,20 +691,123 @@ Suggestions: Define clear success metrics, prioritize features based on user val
             - Define how success will be measured
             - These are KPIs (Key Performance Indicators) or benchmarks that indicate whether the product achieved its goals
 
-            Format your response clearly with these 10 numbered sections. Each section should be comprehensive and actionable.""")
+            {format_instruction} Each section should be comprehensive and actionable.""")
         ])
+        return aggregation_prompt
+    
+    def _aggregation_llm(self):
+        """Chat model for the aggregator, constrained to the PRD schema in structured mode"""
+        if self.prd_format == PRD_FORMAT_STRUCTURED:
+            return bind_json_schema(self.llm, PRD_JSON_SCHEMA)
+        return self.llm
+    
+    def _prd_sections(self, content):
+        """Turn aggregator output into PRD sections, raising AggregationError if it has none"""
+        sections = parse_structured_prd(content) if self.prd_format == PRD_FORMAT_STRUCTURED else None
+        if sections is None:
+            # Text mode, or a model that answered in numbered text despite the schema
+            sections = parse_prd_sections(content)
+        if not any(sections.values()):
+            raise AggregationError("Error aggregating results: the response contained no PRD sections")
+        return sections
+    
+    def aggregate_results(self, idea, debate_log):
+        """Aggregate debate results into PRD sections"""
+        messages = self._build_aggregation_prompt(idea, debate_log).format_messages()
+        cache_key, cached = self._get_cached_response(messages)
+        if cached is not None:
+            return self._prd_sections(cached)
+        
+        # Check if we should use fallback aggregation
+        if not self._reserve_api_call():
+            return parse_prd_sections(self._get_fallback_aggregation(idea, debate_log))
         
         try:
-            self.increment_api_calls()
-            response = self.llm.invoke(aggregation_prompt.format_messages())
-            return response.content
+            response = self._invoke_llm(messages, 'aggregator', llm=self._aggregation_llm())
+            self._commit_api_call()
         except Exception as e:
             error_msg = str(e)
-            if "quota" in error_msg.lower() or "rate limit" in error_msg.lower() or "429" in error_msg:
-                self.api_calls_made = self.max_api_calls
-                return self._get_fallback_aggregation(idea, debate_log)
-            else:
-                return f"Error aggregating results: {str(e)}"
+            if is_rate_limit_error(error_msg):
+                self._mark_quota_exhausted(error_msg)
+                return parse_prd_sections(self._get_fallback_aggregation(idea, debate_log))
+            self._commit_api_call()  # The request reached the provider and still counts
+            raise AggregationError(f"Error aggregating results: {error_msg}") from e
+        
+        sections = self._prd_sections(response.content)
+        self._store_cached_response(cache_key, response.content)
+        return sections
+    
+    def stream_aggregate_results(self, idea, debate_log):
+        """Aggregate debate results into a text PRD, yielding text chunks as the LLM produces them"""
+        messages = self._build_aggregation_prompt(idea, debate_log, prd_format=PRD_FORMAT_TEXT).format_messages()
+        cache_key, cached = self._get_cached_response(messages)
+        if cached is not None:
+            yield cached
+            return
+        
+        if not self._reserve_api_call():
+            yield self._get_fallback_aggregation(idea, debate_log)
+            return
+        
+        chunks = []
+        committed = False
+        
+        try:
+            for chunk in self._stream_llm(messages, 'aggregator'):
+                if not committed:
+                    # The provider accepted the call once the first chunk arrives
+                    self._commit_api_call()
+                    committed = True
+                if chunk.content:
+                    chunks.append(chunk.content)
+                    yield chunk.content
+            if not committed:
+                self._commit_api_call()
+            self._store_cached_response(cache_key, "".join(chunks))
+        except Exception as e:
+            error_msg = str(e)
+            if not is_rate_limit_error(error_msg):
+                if not committed:
+                    self._commit_api_call()  # The request reached the provider and still counts
+                raise AggregationError(f"Error aggregating results: {error_msg}") from e
+            self._mark_quota_exhausted(error_msg)
+            # Part of the PRD already reached the client; a fallback appended to it would read as one document
+            if chunks:
+                raise AggregationError(f"Error aggregating results: cut off after {len(chunks)} chunk(s): {error_msg}") from e
+            yield self._get_fallback_aggregation(idea, debate_log)
+    
+    def _aggregate(self, idea, debate_log, on_event=None):
+        """Aggregate the debate into PRD sections, emitting ``prd_token`` and ``prd_section`` events when a listener is attached.
+
+        A listener gets the PRD as it is written, so it is streamed as
+        numbered text and parsed section by section even when prd_format is
+        structured; only aggregation without a listener is schema-constrained.
+        """
+        if on_event is None:
+            return self.aggregate_results(idea, debate_log)
+        
+        section_parser = PrdSectionParser()
+        for chunk in self.stream_aggregate_results(idea, debate_log):
+            self._emit_prd_chunk(section_parser, chunk, on_event)
+        return self._streamed_sections(section_parser, on_event)
+    
+    def _emit_prd_chunk(self, section_parser, chunk, on_event):
+        """Send a streamed PRD chunk as a ``prd_token`` event, plus any section it completes"""
+        on_event({'type': 'prd_token', 'token': chunk})
+        self._emit_sections(section_parser.feed(chunk), on_event)
+    
+    def _streamed_sections(self, section_parser, on_event):
+        """Emit the last streamed section and return them all, raising AggregationError if there are none"""
+        self._emit_sections(section_parser.close(), on_event)
+        sections = section_parser.sections
+        if not any(sections.values()):
+            raise AggregationError("Error aggregating results: the response contained no PRD sections")
+        return sections
+    
+    def _emit_sections(self, sections, on_event):
+        """Send a ``prd_section`` event for each completed (key, content) pair"""
+        for key, content in sections:
+            on_event({'type': 'prd_section', 'section': key, 'content': content})
     
     def _get_fallback_aggregation(self, idea, debate_log):
         """Provide fallback aggregation when API quota is exhausted"""
@@ -433,68 +886,62 @@ Note: This analysis was generated using fallback responses due to API quota limi
         
         return fallback_aggregation
     
-    def refine_requirements(self, idea):
+    def _session_result(self, debate_log, sections):
+        """Build the result of a successful refinement"""
+        # Check if we used fallback responses
+        used_fallback = any(resp.get('fallback', False) for resp in debate_log)
+        return {
+            'success': True,
+            'debate_log': debate_log,
+            'sections': sections,
+            'used_fallback': used_fallback or not self.check_api_quota(),
+            'api_calls_made': self.api_calls_made,
+            'cache_hits': self.cache_hits,
+            'rounds_executed': self.rounds_executed,
+            'convergence_scores': self.convergence_scores
+        }
+    
+    def _session_error(self, error):
+        """Build the result of a refinement that raised"""
+        return {
+            'success': False,
+            'error': str(error),
+            'debate_log': [],
+            'sections': {},
+            'used_fallback': True,
+            'api_calls_made': self.api_calls_made
+        }
+    
+    def refine_requirements(self, idea, on_event=None):
         """Main function to create PRD using multi-agent debate"""
         try:
-            # Reset API call counter for this session
-            self.api_calls_made = 0
+            # Reset API call counters and fit the debate to the remaining daily quota
+            rounds = self._start_session(planned_rounds=self.max_rounds)
             
             # Run the debate
-            debate_log = self.run_debate(idea, rounds=4)
-            
-            # Check if we used fallback responses
-            used_fallback = any(resp.get('fallback', False) for resp in debate_log)
+            debate_log = self.run_debate(idea, rounds=rounds, on_event=on_event)
             
             # Aggregate results
-            prd_content = self.aggregate_results(idea, debate_log)
+            sections = self._aggregate(idea, debate_log, on_event)
             
-            return {
-                'success': True,
-                'debate_log': debate_log,
-                'prd_content': prd_content,
-                'used_fallback': used_fallback or not self.check_api_quota(),
-                'api_calls_made': self.api_calls_made
-            }
+            return self._session_result(debate_log, sections)
             
         except Exception as e:
-            return {
-                'success': False,
-                'error': str(e),
-                'debate_log': [],
-                'prd_content': "",
-                'used_fallback': True,
-                'api_calls_made': self.api_calls_made
-            }
+            return self._session_error(e)
     
-    def refine_requirements_with_feedback(self, idea, previous_debate_log, user_feedback):
+    def refine_requirements_with_feedback(self, idea, previous_debate_log, user_feedback, on_event=None):
         """Create PRD based on user feedback and previous debate"""
         try:
-            # Reset API call counter for this session
-            self.api_calls_made = 0
+            # Reset API call counters and fit the debate to the remaining daily quota
+            rounds = self._start_session(planned_rounds=ROUNDS)
             
             # Run feedback-based debate
-            debate_log = self.run_feedback_debate(idea, previous_debate_log, user_feedback)
-            
-            # Check if we used fallback responses
-            used_fallback = any(resp.get('fallback', False) for resp in debate_log)
+            debate_log = self.run_feedback_debate(idea, previous_debate_log, user_feedback, rounds=rounds, on_event=on_event)
             
             # Aggregate results
-            prd_content = self.aggregate_results(idea, debate_log)
+            sections = self._aggregate(idea, debate_log, on_event)
             
-            return {
-                'success': True,
-                'debate_log': debate_log,
-                'prd_content': prd_content,
-                'used_fallback': used_fallback or not self.check_api_quota(),
-                'api_calls_made': self.api_calls_made
-            }
+            return self._session_result(debate_log, sections)
             
         except Exception as e:
-            return {
-                'success': False,
-                'error': str(e),
-                'debate_log': [],
-                'prd_content': "",
-                'used_fallback': True,
-                'api_calls_made': self.api_calls_made
-            }
+            return self._session_error(e)
@@ -0,0 +1,95 @@
+import base64
+import json
+from datetime import datetime
+from bson import ObjectId
+from pymongo import DESCENDING
+
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded"""
+
+
+def encode_cursor(sort_value, doc_id):
+    """Encode a (sort key, _id) position as an opaque URL-safe token"""
+    payload = json.dumps({'v': sort_value.isoformat(), 'id': str(doc_id)}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Decode a token from encode_cursor back into (sort value, ObjectId)"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.fromisoformat(payload['v']), ObjectId(payload['id'])
+    except Exception:
+        raise InvalidCursor('Invalid pagination cursor')
+
+
+def clamp_page_size(limit, default=DEFAULT_PAGE_SIZE):
+    """Coerce a requested page size into 1..MAX_PAGE_SIZE"""
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def page_params(query_params, default_limit=DEFAULT_PAGE_SIZE):
+    """Read (limit, cursor) from request query parameters"""
+    return clamp_page_size(query_params.get('limit', default_limit), default_limit), query_params.get('cursor') or None
+
+
+def _keyset_query(query, sort_field, direction, cursor):
+    """Narrow query to the documents after cursor in (sort_field, _id) order"""
+    if not cursor:
+        return query
+    sort_value, last_id = decode_cursor(cursor)
+    op = '$lt' if direction == DESCENDING else '$gt'
+    return {'$and': [query, {'$or': [
+        {sort_field: {op: sort_value}},
+        {sort_field: sort_value, '_id': {op: last_id}}
+    ]}]}
+
+
+def _finish_page(documents, sort_field, limit):
+    """Trim the look-ahead document and build the cursor for the next page"""
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        last = documents[-1]
+        next_cursor = encode_cursor(last[sort_field], last['_id'])
+    return documents, next_cursor
+
+
+def keyset_page(collection, query, sort_field, direction=DESCENDING, limit=DEFAULT_PAGE_SIZE, cursor=None, projection=None):
+    """Fetch one page ordered by (sort_field, _id), resuming after cursor.
+
+    Returns (documents, next_cursor); next_cursor is None on the last page.
+    Needs a compound index on the query's equality fields followed by
+    (sort_field, _id) in the same direction to stay a bounded index scan.
+    """
+    query = _keyset_query(query, sort_field, direction, cursor)
+
+    # One extra document tells us whether another page exists
+    documents = list(
+        collection.find(query, projection)
+        .sort([(sort_field, direction), ('_id', direction)])
+        .limit(limit + 1)
+    )
+    return _finish_page(documents, sort_field, limit)
+
+
+async def akeyset_page(collection, query, sort_field, direction=DESCENDING, limit=DEFAULT_PAGE_SIZE, cursor=None, projection=None):
+    """keyset_page for an AsyncCollection"""
+    query = _keyset_query(query, sort_field, direction, cursor)
+    documents = await (
+        collection.find(query, projection)
+        .sort([(sort_field, direction), ('_id', direction)])
+        .limit(limit + 1)
+        .to_list(None)
+    )
+    return _finish_page(documents, sort_field, limit)
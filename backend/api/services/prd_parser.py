@@ -0,0 +1,134 @@
+import re
+
+
+# PRD sections in the order the aggregation prompt asks for them; the position is the section number
+SECTION_KEYS = (
+    'overview',
+    'problem_statement',
+    'debate_summary',
+    'objectives',
+    'scope',
+    'requirements',
+    'user_stories',
+    'trade_offs_decisions',
+    'next_steps',
+    'success_metrics',
+)
+
+_SECTION_TITLES = {
+    'OVERVIEW': 'overview',
+    'PROBLEM STATEMENT': 'problem_statement',
+    'DEBATE SUMMARY': 'debate_summary',
+    'OBJECTIVES': 'objectives',
+    'SCOPE': 'scope',
+    'REQUIREMENTS': 'requirements',
+    'USER STORIES': 'user_stories',
+    'TRADE-OFFS': 'trade_offs_decisions',
+    'TRADE OFFS': 'trade_offs_decisions',
+    'TRADEOFFS': 'trade_offs_decisions',
+    'NEXT STEPS': 'next_steps',
+    'SUCCESS METRICS': 'success_metrics',
+}
+
+# One numbered section header per line, optionally wrapped in markdown heading or emphasis
+# markers: "6. REQUIREMENTS:", "## 6. Requirements", "**6. Requirements:** text",
+# "8. Trade-offs & Decisions". Text after the colon belongs to the section. A title followed
+# by other words ("5. Scope creep: ...") is a list item, not a header.
+_HEADER_PATTERN = re.compile(
+    r'(?:#{1,6}[ \t]*)?[*_]*[ \t]*'
+    r'(?P<number>\d{1,2})[ \t]*[.)][ \t]*[*_]*[ \t]*'
+    r'(?P<title>OVERVIEW|PROBLEM[ \t]+STATEMENT|DEBATE[ \t]+SUMMARY|OBJECTIVES|SCOPE|REQUIREMENTS'
+    r'|USER[ \t]+STORIES|TRADE[- ]?OFFS|NEXT[ \t]+STEPS|SUCCESS[ \t]+METRICS)'
+    r'(?:[ \t]*\([^)\n]*\)|[ \t]*(?:&|AND)[ \t]*DECISIONS)?'
+    r'[*_ \t]*(?::(?P<inline>.*))?$',
+    re.IGNORECASE
+)
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def _section_for_header(match):
+    """Section key for a header match, or None when the number does not belong to the title"""
+    key = _SECTION_TITLES.get(_WHITESPACE.sub(' ', match.group('title').upper()))
+    if key is None or SECTION_KEYS.index(key) + 1 != int(match.group('number')):
+        return None
+    return key
+
+
+class PrdSectionParser:
+    """Split PRD text into its numbered sections in a single pass.
+
+    Text can be fed in arbitrary chunks as it streams from the LLM. feed() and
+    close() return the sections completed by that call as (key, content) pairs,
+    so a caller can publish each section as soon as the next header arrives.
+    Content lines are stripped, blank lines dropped and every kept line ends
+    with a newline, matching what has always been stored for a PRD.
+    """
+
+    def __init__(self):
+        self._lines = {key: [] for key in SECTION_KEYS}
+        self._partial = []
+        self._current = None
+
+    def feed(self, text):
+        """Consume a chunk of PRD text; returns the sections it completed"""
+        if '\n' not in text:
+            self._partial.append(text)
+            return []
+
+        completed = []
+        lines = text.split('\n')
+        self._partial.append(lines[0])
+        self._consume("".join(self._partial), completed)
+        for line in lines[1:-1]:
+            self._consume(line, completed)
+        self._partial = [lines[-1]]
+        return completed
+
+    def close(self):
+        """Consume any unterminated last line; returns the sections that completed"""
+        completed = []
+        self._consume("".join(self._partial), completed)
+        self._partial = []
+        if self._current is not None:
+            completed.append((self._current, self.section(self._current)))
+            self._current = None
+        return completed
+
+    def section(self, key):
+        """Text collected so far for one section"""
+        return "".join(self._lines[key])
+
+    @property
+    def sections(self):
+        """Every section key mapped to its text, '' for sections that never appeared"""
+        return {key: "".join(lines) for key, lines in self._lines.items()}
+
+    def _consume(self, line, completed):
+        line = line.strip()
+        if not line:
+            return
+
+        # Only lines starting with a digit, '#', '*' or '_' can be headers
+        match = _HEADER_PATTERN.match(line) if line[0] in '0123456789#*_' else None
+        key = _section_for_header(match) if match else None
+        if key is None:
+            if self._current is not None:
+                self._lines[self._current].append(line + '\n')
+            return
+
+        if self._current is not None and self._current != key:
+            completed.append((self._current, self.section(self._current)))
+        self._current = key
+        inline = match.group('inline')
+        inline = inline.strip(' \t*_') if inline else ''
+        if inline:
+            self._lines[key].append(inline + '\n')
+
+
+def parse_prd_sections(prd_text):
+    """Parse PRD content into structured sections"""
+    parser = PrdSectionParser()
+    parser.feed(prd_text)
+    parser.close()
+    return parser.sections
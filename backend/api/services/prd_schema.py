@@ -0,0 +1,69 @@
+import re
+from pydantic import BaseModel, Field, ValidationError
+from .prd_parser import SECTION_KEYS
+
+
+# Headers used when a PRD is rendered back to the numbered text format
+SECTION_HEADERS = {
+    'overview': '1. OVERVIEW',
+    'problem_statement': '2. PROBLEM STATEMENT',
+    'debate_summary': '3. DEBATE SUMMARY (AGENT PERSPECTIVES)',
+    'objectives': '4. OBJECTIVES',
+    'scope': '5. SCOPE',
+    'requirements': '6. REQUIREMENTS',
+    'user_stories': '7. USER STORIES',
+    'trade_offs_decisions': '8. TRADE-OFFS & DECISIONS',
+    'next_steps': '9. NEXT STEPS',
+    'success_metrics': '10. SUCCESS METRICS',
+}
+
+
+class PrdDocument(BaseModel):
+    """The ten PRD sections the aggregator returns, one field each"""
+
+    overview: str = Field(description="What the product intends to do, its purpose and vision")
+    problem_statement: str = Field(description="The problem being solved, the pain points and the value proposition")
+    debate_summary: str = Field(description="Each stakeholder's concerns and priorities, the conflicts and the final consensus")
+    objectives: str = Field(description="High-level goals describing what success looks like")
+    scope: str = Field(description="In-scope and out-of-scope items for this version")
+    requirements: str = Field(description="Functional and non-functional requirements")
+    user_stories: str = Field(description="User stories in the form 'As a [role], I want [feature], so that [benefit]'")
+    trade_offs_decisions: str = Field(description="Compromises, deprioritized or postponed features and why")
+    next_steps: str = Field(description="Concrete action items once the PRD is agreed")
+    success_metrics: str = Field(description="KPIs and benchmarks that show whether the product met its goals")
+
+
+# JSON Schema handed to the provider to constrain the aggregator's output
+PRD_JSON_SCHEMA = PrdDocument.model_json_schema()
+
+_CODE_FENCE = re.compile(r'^```(?:json)?\s*(.*?)\s*```$', re.DOTALL)
+
+
+def _normalize_section(text):
+    """Strip lines and drop blank ones, the shape parse_prd_sections produces"""
+    return "".join(line.strip() + '\n' for line in text.splitlines() if line.strip())
+
+
+def parse_structured_prd(content):
+    """Validate the aggregator's JSON into a sections dict, or None if it does not match PrdDocument"""
+    text = content.strip()
+    fenced = _CODE_FENCE.match(text)
+    if fenced:
+        text = fenced.group(1)
+    if not text.startswith('{'):
+        return None
+
+    try:
+        document = PrdDocument.model_validate_json(text)
+    except ValidationError:
+        return None
+    return {key: _normalize_section(getattr(document, key)) for key in SECTION_KEYS}
+
+
+def render_prd_content(sections):
+    """Render stored sections as the numbered PRD text; parse_prd_sections reads it back unchanged"""
+    return "\n".join(
+        f"{SECTION_HEADERS[key]}:\n{sections[key]}"
+        for key in SECTION_KEYS
+        if sections.get(key)
+    )
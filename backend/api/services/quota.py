@@ -0,0 +1,230 @@
+import os
+import threading
+from datetime import datetime, timedelta
+import pytz
+from django.conf import settings
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+
+# Gemini free-tier quotas reset daily at midnight Pacific Time (see check_api_quota.py)
+QUOTA_TIMEZONE = pytz.timezone('US/Pacific')
+
+
+def quota_window(now=None):
+    """Return (window_id, resets_at) for the daily quota window containing now"""
+    now = now or datetime.now(pytz.utc)
+    if now.tzinfo is None:
+        now = pytz.utc.localize(now)
+    local_now = now.astimezone(QUOTA_TIMEZONE)
+    next_midnight = QUOTA_TIMEZONE.localize(
+        datetime.combine(local_now.date() + timedelta(days=1), datetime.min.time())
+    )
+    return local_now.strftime('%Y-%m-%d'), next_midnight.astimezone(pytz.utc)
+
+
+class MongoQuotaLedger:
+    """Daily LLM quota shared by every worker process through one Mongo document per model and day.
+
+    The a-prefixed methods are for async callers and go through
+    async_collection, a callable returning the AsyncCollection for the
+    running event loop.
+    """
+
+    def __init__(self, collection, daily_limit, clock=None, async_collection=None):
+        self.collection = collection
+        self.daily_limit = daily_limit
+        self.clock = clock
+        self.async_collection = async_collection
+        self._ensured = set()
+
+    def _window_key(self, model):
+        key, window = self._window(model)
+        if window is not None:
+            try:
+                self.collection.update_one({'_id': key}, {'$setOnInsert': window}, upsert=True)
+            except DuplicateKeyError:
+                pass  # Another worker created the window first
+            self._ensured.add(key)
+        return key
+
+    async def _awindow_key(self, model):
+        """Async _window_key"""
+        key, window = self._window(model)
+        if window is not None:
+            try:
+                await self.async_collection().update_one({'_id': key}, {'$setOnInsert': window}, upsert=True)
+            except DuplicateKeyError:
+                pass  # Another worker created the window first
+            self._ensured.add(key)
+        return key
+
+    def _window(self, model):
+        """Return today's window key and, until this process has ensured it exists, the document to create"""
+        window_id, resets_at = quota_window(self.clock() if self.clock else None)
+        key = f"{model}:{window_id}"
+        if key in self._ensured:
+            return key, None
+        return key, {
+            'model': model,
+            'window': window_id,
+            'reserved': 0,
+            'committed': 0,
+            'exhausted': False,
+            'resets_at': resets_at.replace(tzinfo=None),
+            # Kept a day past reset for inspection, then removed by the TTL index
+            'expires_at': (resets_at + timedelta(days=1)).replace(tzinfo=None)
+        }
+
+    def _reserve_filter(self, key):
+        """Match the window only while it has calls left"""
+        return {'_id': key, 'exhausted': False, 'reserved': {'$lt': self.daily_limit}}
+
+    def reserve(self, model):
+        """Atomically claim one call from today's quota; returns False when none remain"""
+        doc = self.collection.find_one_and_update(
+            self._reserve_filter(self._window_key(model)),
+            {'$inc': {'reserved': 1}},
+            return_document=ReturnDocument.AFTER
+        )
+        return doc is not None
+
+    async def areserve(self, model):
+        """Async reserve"""
+        doc = await self.async_collection().find_one_and_update(
+            self._reserve_filter(await self._awindow_key(model)),
+            {'$inc': {'reserved': 1}},
+            return_document=ReturnDocument.AFTER
+        )
+        return doc is not None
+
+    def commit(self, model):
+        """Record that a reserved call was actually sent to the provider"""
+        self.collection.update_one({'_id': self._window_key(model)}, {'$inc': {'committed': 1}})
+
+    async def acommit(self, model):
+        """Async commit"""
+        await self.async_collection().update_one({'_id': await self._awindow_key(model)}, {'$inc': {'committed': 1}})
+
+    def release(self, model):
+        """Return a reserved call that was never sent"""
+        self.collection.update_one(
+            {'_id': self._window_key(model), 'reserved': {'$gt': 0}},
+            {'$inc': {'reserved': -1}}
+        )
+
+    def mark_exhausted(self, model):
+        """Stop all workers from calling the provider until the window resets"""
+        self.collection.update_one({'_id': self._window_key(model)}, {'$set': {'exhausted': True}})
+
+    async def amark_exhausted(self, model):
+        """Async mark_exhausted"""
+        await self.async_collection().update_one({'_id': await self._awindow_key(model)}, {'$set': {'exhausted': True}})
+
+    def remaining(self, model):
+        """Calls left in today's window across all workers"""
+        doc = self.collection.find_one({'_id': self._window_key(model)}, {'reserved': 1, 'exhausted': 1})
+        return self._remaining(doc)
+
+    async def aremaining(self, model):
+        """Async remaining"""
+        doc = await self.async_collection().find_one({'_id': await self._awindow_key(model)}, {'reserved': 1, 'exhausted': 1})
+        return self._remaining(doc)
+
+    def _remaining(self, doc):
+        """Calls left according to a window document"""
+        if not doc or doc.get('exhausted'):
+            return 0
+        return max(self.daily_limit - doc.get('reserved', 0), 0)
+
+
+class LocalQuotaLedger:
+    """In-process stand-in for MongoQuotaLedger, for local development and tests"""
+
+    def __init__(self, daily_limit, clock=None):
+        self.daily_limit = daily_limit
+        self.clock = clock
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def _window(self, model):
+        window_id, _ = quota_window(self.clock() if self.clock else None)
+        key = f"{model}:{window_id}"
+        if key not in self._windows:
+            # Drop windows from previous days
+            self._windows = {k: v for k, v in self._windows.items() if k.endswith(f":{window_id}")}
+            self._windows[key] = {'reserved': 0, 'committed': 0, 'exhausted': False}
+        return self._windows[key]
+
+    def reserve(self, model):
+        """Atomically claim one call from today's quota; returns False when none remain"""
+        with self._lock:
+            window = self._window(model)
+            if window['exhausted'] or window['reserved'] >= self.daily_limit:
+                return False
+            window['reserved'] += 1
+            return True
+
+    def commit(self, model):
+        """Record that a reserved call was actually sent to the provider"""
+        with self._lock:
+            self._window(model)['committed'] += 1
+
+    def release(self, model):
+        """Return a reserved call that was never sent"""
+        with self._lock:
+            window = self._window(model)
+            window['reserved'] = max(window['reserved'] - 1, 0)
+
+    def mark_exhausted(self, model):
+        """Stop all callers from calling the provider until the window resets"""
+        with self._lock:
+            self._window(model)['exhausted'] = True
+
+    def remaining(self, model):
+        """Calls left in today's window"""
+        with self._lock:
+            window = self._window(model)
+            if window['exhausted']:
+                return 0
+            return max(self.daily_limit - window['reserved'], 0)
+
+    # Nothing here blocks, so async callers share the sync implementation
+    async def areserve(self, model):
+        return self.reserve(model)
+
+    async def acommit(self, model):
+        self.commit(model)
+
+    async def amark_exhausted(self, model):
+        self.mark_exhausted(model)
+
+    async def aremaining(self, model):
+        return self.remaining(model)
+
+
+_ledger = None
+_ledger_pid = None
+_ledger_lock = threading.Lock()
+
+
+def get_quota_ledger():
+    """Return the process-wide quota ledger selected by LLM_QUOTA_BACKEND"""
+    global _ledger, _ledger_pid
+    pid = os.getpid()
+    if _ledger is None or _ledger_pid != pid:
+        with _ledger_lock:
+            if _ledger is None or _ledger_pid != pid:
+                daily_limit = getattr(settings, 'GEMINI_DAILY_QUOTA', 50)
+                if getattr(settings, 'LLM_QUOTA_BACKEND', 'mongo') == 'mongo':
+                    from .mongodb_service import get_mongodb_service
+                    from .async_mongodb_service import get_async_mongodb_service
+                    _ledger = MongoQuotaLedger(
+                        get_mongodb_service().llm_quota_collection,
+                        daily_limit,
+                        async_collection=lambda: get_async_mongodb_service().llm_quota_collection
+                    )
+                else:
+                    _ledger = LocalQuotaLedger(daily_limit)
+                _ledger_pid = pid
+    return _ledger
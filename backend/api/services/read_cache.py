@@ -0,0 +1,290 @@
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from .metrics import READ_CACHE_HIT_RATIO, READ_CACHE_LOOKUPS
+
+
+logger = logging.getLogger(__name__)
+
+
+def idea_details_key(idea_id):
+    """Key for get_idea_details"""
+    return f'idea_details:{idea_id}'
+
+
+def idea_iterations_key(idea_id):
+    """Key for get_idea_with_iterations"""
+    return f'idea_iterations:{idea_id}'
+
+
+def chat_sessions_key(user_id):
+    """Key for the first pages of a user's chat session list"""
+    return f'chat_sessions:{user_id}'
+
+
+def idea_keys(idea_id):
+    """Every cache key holding a read of one idea"""
+    return idea_details_key(idea_id), idea_iterations_key(idea_id)
+
+
+def _entity(key):
+    """Metric label for a cache key: the part before the id"""
+    return key.split(':', 1)[0]
+
+
+class LocalLRU:
+    """In-process LRU of pickled values bounded by total size in bytes.
+
+    Entries expire after ttl_seconds, which bounds how long this process can
+    serve a value another process has since invalidated.
+    """
+
+    def __init__(self, max_bytes, max_entry_bytes, ttl_seconds, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.size_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the pickled value for key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, blob = entry
+            if self.clock() >= expires_at:
+                self._pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return blob
+
+    def set(self, key, blob):
+        """Store a pickled value, evicting least recently used entries to stay under max_bytes"""
+        if len(blob) > self.max_entry_bytes:
+            return
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (self.clock() + self.ttl_seconds, blob)
+            self.size_bytes += len(blob)
+            while self.size_bytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    def delete(self, key):
+        """Drop key if present"""
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _pop(self, key):
+        """Remove an entry and release its bytes; caller holds the lock"""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size_bytes -= len(entry[1])
+
+
+class ReadCache:
+    """Read-through cache for idea and chat-session reads, invalidated by the writes that change them.
+
+    Values are pickled on the way in, so every hit hands the caller its own
+    copy to serialize or mutate. The in-process LRU is checked first, then the
+    optional shared tier (a Django cache alias, so entries written by one
+    worker serve the others). Writes call invalidate() with the keys they
+    affect, which drops them from both tiers; other processes may keep
+    serving their local copy for up to the local TTL.
+    """
+
+    def __init__(self, local, shared=None, shared_ttl_seconds=300):
+        self.local = local
+        self.shared = shared
+        self.shared_ttl_seconds = shared_ttl_seconds
+        self._invalidations = 0
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, load):
+        """Return the cached value for key, or call load() and cache what it returns unless it is None"""
+        blob, generation = self._lookup(key)
+        if blob is None:
+            blob = self._shared_get(key)
+            self._record_shared(key, blob)
+        if blob is not None:
+            return pickle.loads(blob)
+
+        value = load()
+        if value is not None:
+            blob = self._remember(key, value, generation)
+            if blob is not None:
+                self._shared_set(key, blob)
+        return value
+
+    async def aget_or_load(self, key, load):
+        """get_or_load for a coroutine function load"""
+        blob, generation = self._lookup(key)
+        if blob is None:
+            blob = await self._ashared_get(key)
+            self._record_shared(key, blob)
+        if blob is not None:
+            return pickle.loads(blob)
+
+        value = await load()
+        if value is not None:
+            blob = self._remember(key, value, generation)
+            if blob is not None:
+                await self._ashared_set(key, blob)
+        return value
+
+    def invalidate(self, *keys):
+        """Drop keys from both tiers"""
+        self._invalidate_local(keys)
+        if self.shared is not None:
+            try:
+                self.shared.delete_many(keys)
+            except Exception as e:
+                logger.warning("Read cache invalidation failed: %s", e)
+
+    async def ainvalidate(self, *keys):
+        """invalidate for async callers"""
+        self._invalidate_local(keys)
+        if self.shared is not None:
+            try:
+                await self.shared.adelete_many(keys)
+            except Exception as e:
+                logger.warning("Read cache invalidation failed: %s", e)
+
+    def stats(self):
+        """Return lookup counters and hit ratio per entity for this process"""
+        with self._lock:
+            return {
+                entity: dict(counts, hit_ratio=(counts['local'] + counts['shared']) / sum(counts.values()))
+                for entity, counts in self._counts.items()
+            }
+
+    def clear(self):
+        """Drop the local tier and reset counters"""
+        self.local.clear()
+        with self._lock:
+            self._invalidations += 1
+            self._counts.clear()
+
+    def _lookup(self, key):
+        """Check the local tier; returns (blob or None, invalidation generation before the load)"""
+        with self._lock:
+            generation = self._invalidations
+        blob = self.local.get(key)
+        if blob is not None:
+            self._record(key, 'local')
+        return blob, generation
+
+    def _remember(self, key, value, generation):
+        """Pickle and store a loaded value locally unless an invalidation ran while it loaded"""
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            if self._invalidations != generation:
+                return None
+            self.local.set(key, blob)
+        return blob if len(blob) <= self.local.max_entry_bytes else None
+
+    def _invalidate_local(self, keys):
+        """Drop keys locally and make loads already in flight skip caching their result"""
+        with self._lock:
+            self._invalidations += 1
+        for key in keys:
+            self.local.delete(key)
+
+    def _record_shared(self, key, blob):
+        """Count a shared-tier lookup, keeping a hit in the local tier for the next one"""
+        if blob is None:
+            self._record(key, 'miss')
+            return
+        self._record(key, 'shared')
+        self.local.set(key, blob)
+
+    def _record(self, key, result):
+        """Count a lookup and refresh the entity's hit ratio gauge"""
+        entity = _entity(key)
+        READ_CACHE_LOOKUPS.labels(entity, result).inc()
+        with self._lock:
+            counts = self._counts.setdefault(entity, {'local': 0, 'shared': 0, 'miss': 0})
+            counts[result] += 1
+            hit_ratio = (counts['local'] + counts['shared']) / sum(counts.values())
+        READ_CACHE_HIT_RATIO.labels(entity).set(hit_ratio)
+
+    def _shared_get(self, key):
+        if self.shared is None:
+            return None
+        try:
+            return self.shared.get(key)
+        except Exception as e:
+            logger.warning("Read cache lookup failed: %s", e)
+            return None
+
+    async def _ashared_get(self, key):
+        if self.shared is None:
+            return None
+        try:
+            return await self.shared.aget(key)
+        except Exception as e:
+            logger.warning("Read cache lookup failed: %s", e)
+            return None
+
+    def _shared_set(self, key, blob):
+        if self.shared is None:
+            return
+        try:
+            self.shared.set(key, blob, self.shared_ttl_seconds)
+        except Exception as e:
+            logger.warning("Read cache write failed: %s", e)
+
+    async def _ashared_set(self, key, blob):
+        if self.shared is None:
+            return
+        try:
+            await self.shared.aset(key, blob, self.shared_ttl_seconds)
+        except Exception as e:
+            logger.warning("Read cache write failed: %s", e)
+
+
+_cache = None
+_cache_pid = None
+_cache_lock = threading.Lock()
+
+
+def get_read_cache():
+    """Return the process-wide read cache, or None when READ_CACHE_ENABLED is off"""
+    global _cache, _cache_pid
+    if not getattr(settings, 'READ_CACHE_ENABLED', True):
+        return None
+    pid = os.getpid()
+    if _cache is None or _cache_pid != pid:
+        with _cache_lock:
+            if _cache is None or _cache_pid != pid:
+                shared = None
+                if 'read_cache' in settings.CACHES:
+                    from django.core.cache import caches
+                    shared = caches['read_cache']
+                _cache = ReadCache(
+                    LocalLRU(
+                        max_bytes=getattr(settings, 'READ_CACHE_MAX_BYTES', 32 * 1024 * 1024),
+                        max_entry_bytes=getattr(settings, 'READ_CACHE_MAX_ENTRY_BYTES', 1024 * 1024),
+                        ttl_seconds=getattr(settings, 'READ_CACHE_LOCAL_TTL_SECONDS', 10)
+                    ),
+                    shared=shared,
+                    shared_ttl_seconds=getattr(settings, 'READ_CACHE_TTL_SECONDS', 300)
+                )
+                _cache_pid = pid
+    return _cache
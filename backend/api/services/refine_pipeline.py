@@ -0,0 +1,257 @@
+import logging
+from .multi_agent import MultiAgentSystem
+from .async_multi_agent import AsyncMultiAgentSystem
+from .prd_schema import render_prd_content
+
+
+logger = logging.getLogger(__name__)
+
+
+REFINE_CREDIT_COST = 2
+FEEDBACK_CREDIT_COST = 1
+
+FALLBACK_MESSAGE = 'Analysis completed using fallback responses due to API quota limitations. For more detailed AI-powered analysis, please try again later when quota resets.'
+
+
+def build_previous_debate_log(idea_data):
+    """Flatten stored debate rounds into the debate_log shape the agents expect"""
+    previous_debate_log = []
+    for round_num, debates in idea_data['debate_rounds'].items():
+        for debate in debates:
+            previous_debate_log.append({
+                'agent': debate['agent'],
+                'response': debate['message'],
+                'summary': debate.get('summary', ''),
+                'round': round_num
+            })
+    return previous_debate_log
+
+
+def _log_result(idea_id, result):
+    """Log a one-line summary of an agent result; the PRD and debate text stay out of the logs"""
+    logger.info('refinement finished', extra={
+        'idea_id': idea_id,
+        'success': result.get('success', False),
+        'debate_turns': len(result.get('debate_log') or []),
+        'sections_filled': sum(1 for text in (result.get('sections') or {}).values() if text),
+        'used_fallback': result.get('used_fallback', False),
+        'api_calls_made': result.get('api_calls_made', 0),
+        'cache_hits': result.get('cache_hits', 0),
+        'rounds_executed': result.get('rounds_executed', 0)
+    })
+
+
+def with_prd_content(document):
+    """Render prd_content from the sections of a refine response or requirements document that lacks it"""
+    if document and not document.get('prd_content') and document.get('sections'):
+        document['prd_content'] = render_prd_content(document['sections'])
+    return document
+
+
+def _add_fallback_info(response_data, result):
+    """Attach fallback information from the agent result to the response"""
+    if result.get('used_fallback', False):
+        response_data['fallback_used'] = True
+        response_data['fallback_message'] = FALLBACK_MESSAGE
+    else:
+        response_data['fallback_used'] = False
+    response_data['api_calls_made'] = result.get('api_calls_made', 0)
+    response_data['cache_hits'] = result.get('cache_hits', 0)
+    response_data['rounds_executed'] = result.get('rounds_executed', 0)
+    response_data['convergence_scores'] = result.get('convergence_scores', [])
+    return response_data
+
+
+def run_refinement(mongodb_service, user_id, idea_text, agent_system=None, on_event=None, use_cache=True, user=None, job_id=None):
+    """Run the multi-agent debate for a new idea and persist it.
+
+    Credits must already be deducted; the caller refunds them when the
+    returned dict has ``success`` set to False or an exception escapes.
+    ``on_event`` receives debate turns and PRD sections as they are produced;
+    ``use_cache=False`` bypasses the LLM response cache for fresh output;
+    ``user`` is the user document returned when the credits were reserved;
+    ``job_id`` is the refine job to mark as saved along with the idea.
+    """
+    agent_system = agent_system or MultiAgentSystem(use_cache=use_cache)
+    
+    # Run requirement refinement; nothing is stored for a debate that fails
+    result = agent_system.refine_requirements(idea_text, on_event=on_event)
+    
+    if not result['success']:
+        _log_result(None, result)
+        return {
+            'success': False,
+            'error': result.get('error', 'Unknown error occurred')
+        }
+    
+    # Save the idea, its debate log and the PRD sections together;
+    # prd_content is rendered from the sections when a client asks for it
+    idea_data = {
+        'title': idea_text[:200],  # Truncate if too long
+        'description': idea_text,
+        'user_id': user_id
+    }
+    sections = result['sections']
+    idea_id = mongodb_service.save_refinement(idea_data, result['debate_log'], {'sections': sections}, job_id=job_id)
+    _log_result(idea_id, result)
+    
+    # The balance was settled when the credits were reserved
+    updated_user = user if user is not None else mongodb_service.get_user_by_id(user_id)
+    
+    response_data = {
+        'success': True,
+        'idea_id': idea_id,
+        'sections': sections,
+        'debate_log': result['debate_log'],
+        'user': updated_user
+    }
+    return _add_fallback_info(response_data, result)
+
+
+def run_feedback_refinement(mongodb_service, user_id, idea_id, user_feedback, idea_data=None, agent_system=None, on_event=None, use_cache=True, user=None, job_id=None):
+    """Run a feedback iteration for an existing idea and persist it.
+
+    Credits must already be deducted; the caller refunds them when the
+    returned dict has ``success`` set to False or an exception escapes.
+    ``on_event`` receives debate turns and PRD sections as they are produced;
+    ``use_cache=False`` bypasses the LLM response cache for fresh output;
+    ``user`` is the user document returned when the credits were reserved;
+    ``job_id`` is the refine job to mark as saved along with the iteration.
+    """
+    if idea_data is None:
+        idea_data = mongodb_service.get_idea_with_iterations(idea_id)
+        if not idea_data:
+            return {'success': False, 'error': 'Idea not found'}
+    
+    agent_system = agent_system or MultiAgentSystem(use_cache=use_cache)
+    
+    # Get the original idea text and previous debate log
+    original_idea = idea_data['idea']['description']
+    previous_debate_log = build_previous_debate_log(idea_data)
+    
+    # Run feedback-based refinement
+    result = agent_system.refine_requirements_with_feedback(
+        original_idea,
+        previous_debate_log,
+        user_feedback,
+        on_event=on_event
+    )
+    _log_result(idea_id, result)
+    
+    if not result['success']:
+        return {
+            'success': False,
+            'error': result.get('error', 'Unknown error occurred')
+        }
+    
+    # Save the new debate log and feedback iteration together
+    sections = result['sections']
+    iteration_data = {
+        'user_feedback': user_feedback,
+        'sections': sections,
+        'iteration_number': len(idea_data['requirements_iterations']) + 1
+    }
+    mongodb_service.save_feedback_refinement(idea_id, result['debate_log'], iteration_data, job_id=job_id)
+    
+    # The balance was settled when the credits were reserved
+    updated_user = user if user is not None else mongodb_service.get_user_by_id(user_id)
+    
+    response_data = {
+        'success': True,
+        'idea_id': idea_id,
+        'debate_log': result['debate_log'],
+        'sections': sections,
+        'user': updated_user
+    }
+    return _add_fallback_info(response_data, result)
+
+
+def saved_refinement_result(mongodb_service, user_id, idea_id):
+    """Rebuild the response for a refinement whose output was saved but never reported"""
+    idea_data = mongodb_service.get_idea_with_iterations(idea_id)
+    if not idea_data or not idea_data['requirements_iterations']:
+        return {'success': False, 'error': 'Saved idea not found'}
+    
+    response_data = {
+        'success': True,
+        'idea_id': idea_id,
+        'sections': idea_data['requirements_iterations'][-1].get('sections', {}),
+        'debate_log': build_previous_debate_log(idea_data),
+        'user': mongodb_service.get_user_by_id(user_id)
+    }
+    return _add_fallback_info(response_data, {})
+
+
+async def arun_refinement(mongodb_service, user_id, idea_text, agent_system=None, on_event=None, use_cache=True, user=None):
+    """run_refinement for an AsyncMongoDBService and AsyncMultiAgentSystem"""
+    agent_system = agent_system or AsyncMultiAgentSystem(use_cache=use_cache)
+    
+    result = await agent_system.arefine_requirements(idea_text, on_event=on_event)
+    
+    if not result['success']:
+        _log_result(None, result)
+        return {
+            'success': False,
+            'error': result.get('error', 'Unknown error occurred')
+        }
+    
+    sections = result['sections']
+    idea_id = await mongodb_service.save_refinement({
+        'title': idea_text[:200],  # Truncate if too long
+        'description': idea_text,
+        'user_id': user_id
+    }, result['debate_log'], {'sections': sections})
+    _log_result(idea_id, result)
+    
+    updated_user = user if user is not None else await mongodb_service.get_user_by_id(user_id)
+    
+    response_data = {
+        'success': True,
+        'idea_id': idea_id,
+        'sections': sections,
+        'debate_log': result['debate_log'],
+        'user': updated_user
+    }
+    return _add_fallback_info(response_data, result)
+
+
+async def arun_feedback_refinement(mongodb_service, user_id, idea_id, user_feedback, idea_data=None, agent_system=None, on_event=None, use_cache=True, user=None):
+    """run_feedback_refinement for an AsyncMongoDBService and AsyncMultiAgentSystem"""
+    if idea_data is None:
+        idea_data = await mongodb_service.get_idea_with_iterations(idea_id)
+        if not idea_data:
+            return {'success': False, 'error': 'Idea not found'}
+    
+    agent_system = agent_system or AsyncMultiAgentSystem(use_cache=use_cache)
+    
+    result = await agent_system.arefine_requirements_with_feedback(
+        idea_data['idea']['description'],
+        build_previous_debate_log(idea_data),
+        user_feedback,
+        on_event=on_event
+    )
+    _log_result(idea_id, result)
+    
+    if not result['success']:
+        return {
+            'success': False,
+            'error': result.get('error', 'Unknown error occurred')
+        }
+    
+    sections = result['sections']
+    await mongodb_service.save_feedback_refinement(idea_id, result['debate_log'], {
+        'user_feedback': user_feedback,
+        'sections': sections,
+        'iteration_number': len(idea_data['requirements_iterations']) + 1
+    })
+    
+    updated_user = user if user is not None else await mongodb_service.get_user_by_id(user_id)
+    
+    response_data = {
+        'success': True,
+        'idea_id': idea_id,
+        'debate_log': result['debate_log'],
+        'sections': sections,
+        'user': updated_user
+    }
+    return _add_fallback_info(response_data, result)
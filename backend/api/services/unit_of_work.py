@@ -0,0 +1,50 @@
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import OperationFailure
+from .metrics import MONGO_UNIT_OF_WORK_ROUND_TRIPS
+
+
+# Server error returned when a transaction is started on a standalone mongod
+_ILLEGAL_OPERATION = 20
+
+
+def transactions_unsupported(error):
+    """True when the deployment rejected a transaction because it is not a replica set or sharded cluster"""
+    return isinstance(error, OperationFailure) and error.code == _ILLEGAL_OPERATION
+
+
+class UnitOfWork:
+    """Writes collected for one operation and committed together.
+
+    Staging does no I/O. Operations are grouped by collection name in the
+    order each collection was first used, so a commit issues one ordered
+    bulk_write per collection: MongoDBService.commit and
+    AsyncMongoDBService.commit run those inside one multi-document
+    transaction when the deployment supports it, otherwise one after another.
+    Stage the writes that make the result visible (the idea, its summary)
+    last, so a commit cut short without a transaction leaves nothing a user
+    can see half-written.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.batches = {}
+
+    def insert(self, collection, document):
+        """Stage one insert"""
+        self.batches.setdefault(collection, []).append(InsertOne(document))
+
+    def insert_many(self, collection, documents):
+        """Stage an insert per document"""
+        for document in documents:
+            self.insert(collection, document)
+
+    def update(self, collection, query, update, upsert=False):
+        """Stage an update_one"""
+        self.batches.setdefault(collection, []).append(UpdateOne(query, update, upsert=upsert))
+
+    def __len__(self):
+        return sum(len(operations) for operations in self.batches.values())
+
+    def observe(self, mode, round_trips):
+        """Report how many round trips the commit took"""
+        MONGO_UNIT_OF_WORK_ROUND_TRIPS.labels(self.name, mode).observe(round_trips)
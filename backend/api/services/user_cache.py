@@ -0,0 +1,124 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+
+
+def hash_token(id_token):
+    """Key cache entries by a digest so raw bearer tokens are never held as dict keys"""
+    return hashlib.sha256(id_token.encode('utf-8')).hexdigest()
+
+
+class VerifiedUserCache:
+    """In-process cache of verified ID tokens and the user documents they resolve to.
+
+    Token entries live until the token's own exp, so a cached token is never
+    accepted after Google would reject it. User documents are cached separately
+    for at most AUTH_USER_CACHE_TTL_SECONDS and are replaced or dropped whenever
+    this process changes the user's credits or profile.
+    """
+
+    def __init__(self, max_entries=None, user_ttl_seconds=None, login_write_interval=None, clock=time.time):
+        if max_entries is None:
+            max_entries = getattr(settings, 'AUTH_CACHE_MAX_ENTRIES', 1024)
+        if user_ttl_seconds is None:
+            user_ttl_seconds = getattr(settings, 'AUTH_USER_CACHE_TTL_SECONDS', 30)
+        if login_write_interval is None:
+            login_write_interval = getattr(settings, 'LAST_LOGIN_WRITE_INTERVAL_SECONDS', 300)
+        self.max_entries = max_entries
+        self.user_ttl_seconds = user_ttl_seconds
+        self.login_write_interval = login_write_interval
+        self.clock = clock
+        self._tokens = OrderedDict()
+        self._users = {}
+        self._last_login_writes = {}
+        self._lock = threading.Lock()
+
+    def get(self, id_token):
+        """Return (user_info, user) for a previously verified token, or None.
+
+        user is None when the token is still valid but its user document has
+        expired or was invalidated and must be reloaded.
+        """
+        key = hash_token(id_token)
+        now = self.clock()
+        with self._lock:
+            entry = self._tokens.get(key)
+            if entry is None:
+                return None
+            token_expires_at, user_id, user_info = entry
+            if now >= token_expires_at:
+                del self._tokens[key]
+                return None
+            self._tokens.move_to_end(key)
+
+            cached_user = self._users.get(user_id)
+            if cached_user is None or now >= cached_user[0]:
+                self._users.pop(user_id, None)
+                return user_info, None
+            return user_info, dict(cached_user[1])
+
+    def put(self, id_token, user_info, user, token_expires_at):
+        """Remember a verified token until it expires, along with its user document"""
+        now = self.clock()
+        if token_expires_at <= now:
+            return
+        key = hash_token(id_token)
+        with self._lock:
+            self._tokens[key] = (token_expires_at, user['_id'], user_info)
+            self._tokens.move_to_end(key)
+            while len(self._tokens) > self.max_entries:
+                self._tokens.popitem(last=False)
+            self._users[user['_id']] = (now + self.user_ttl_seconds, dict(user))
+            self._prune_users()
+
+    def store_user(self, user):
+        """Cache a freshly loaded user document"""
+        with self._lock:
+            self._users[user['_id']] = (self.clock() + self.user_ttl_seconds, dict(user))
+            self._prune_users()
+
+    def update_user(self, user):
+        """Replace a cached user document with a fresher copy, if this process has one cached"""
+        with self._lock:
+            if user['_id'] in self._users:
+                self._users[user['_id']] = (self.clock() + self.user_ttl_seconds, dict(user))
+
+    def invalidate_user(self, user_id):
+        """Drop a user's cached document so the next request reloads it"""
+        with self._lock:
+            self._users.pop(str(user_id), None)
+
+    def should_record_login(self, user_id):
+        """Return True at most once per login_write_interval per user"""
+        now = self.clock()
+        with self._lock:
+            last_write = self._last_login_writes.get(user_id)
+            if last_write is not None and now - last_write < self.login_write_interval:
+                return False
+            self._last_login_writes[user_id] = now
+            if len(self._last_login_writes) > self.max_entries:
+                cutoff = now - self.login_write_interval
+                self._last_login_writes = {
+                    uid: written for uid, written in self._last_login_writes.items() if written >= cutoff
+                }
+            return True
+
+    def _prune_users(self):
+        """Drop user documents no token entry refers to; caller holds the lock"""
+        if len(self._users) <= self.max_entries:
+            return
+        live_ids = {user_id for _, user_id, _ in self._tokens.values()}
+        self._users = {user_id: entry for user_id, entry in self._users.items() if user_id in live_ids}
+
+    def clear(self):
+        """Forget every cached token and user"""
+        with self._lock:
+            self._tokens.clear()
+            self._users.clear()
+            self._last_login_writes.clear()
+
+
+# Shared by every request in this process
+verified_user_cache = VerifiedUserCache()
@@ -0,0 +1,183 @@
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+
+# Per-request context stamped on every record logged while the request is handled
+_request_id = contextvars.ContextVar('request_id', default=None)
+_user_id = contextvars.ContextVar('user_id', default=None)
+_started_at = contextvars.ContextVar('request_started_at', default=None)
+
+# LogRecord attributes that are not caller-supplied extra fields
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+_CONTEXT_ATTRIBUTES = {'request_id', 'user_id', 'elapsed_ms'}
+
+
+def begin_request(request_id=None):
+    """Start a request context; returns (request_id, token to pass to end_request)"""
+    request_id = request_id or uuid.uuid4().hex
+    tokens = (_request_id.set(request_id), _user_id.set(None), _started_at.set(time.perf_counter()))
+    return request_id, tokens
+
+
+def end_request(tokens):
+    """Restore the context that was active before begin_request"""
+    request_token, user_token, started_token = tokens
+    _request_id.reset(request_token)
+    _user_id.reset(user_token)
+    _started_at.reset(started_token)
+
+
+def bind_user(user_id):
+    """Attach the authenticated user to the current request's log lines"""
+    _user_id.set(str(user_id) if user_id is not None else None)
+
+
+def elapsed_ms():
+    """Milliseconds since the current request started, or None outside a request"""
+    started_at = _started_at.get()
+    return round((time.perf_counter() - started_at) * 1000, 1) if started_at is not None else None
+
+
+def truncate(value, max_chars):
+    """Shorten a string to max_chars, noting how much was cut"""
+    if max_chars and len(value) > max_chars:
+        return f"{value[:max_chars]}...[{len(value) - max_chars} chars truncated]"
+    return value
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamp records with the request id, user id and time since the request started"""
+
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        record.user_id = _user_id.get()
+        record.elapsed_ms = elapsed_ms()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of records below WARNING.
+
+    The decision is made per request id, so a sampled request keeps all of its
+    lines; warnings and errors are always kept.
+    """
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = float(rate)
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate >= 1:
+            return True
+        request_id = getattr(record, 'request_id', None) or _request_id.get()
+        if request_id:
+            return zlib.crc32(request_id.encode()) % 10_000 < self.rate * 10_000
+        return random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; message and extra fields are truncated to max_field_chars"""
+
+    def __init__(self, max_field_chars=512):
+        super().__init__()
+        self.max_field_chars = int(max_field_chars)
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': truncate(record.getMessage(), self.max_field_chars),
+        }
+        for attribute in _CONTEXT_ATTRIBUTES:
+            value = getattr(record, attribute, None)
+            if value is not None:
+                entry[attribute] = value
+        for key, value in vars(record).items():
+            if key in _RECORD_ATTRIBUTES or key in _CONTEXT_ATTRIBUTES or key.startswith('_'):
+                continue
+            entry[key] = self._field(value)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+    def _field(self, value):
+        if isinstance(value, (bool, int, float)) or value is None:
+            return value
+        if isinstance(value, (dict, list, tuple)):
+            value = json.dumps(value, default=str)
+        elif not isinstance(value, str):
+            value = str(value)
+        return truncate(value, self.max_field_chars)
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """Hand records to a listener thread that formats and writes them.
+
+    The request thread only runs the filters and merges the message arguments;
+    JSON encoding and the write to stream happen on the listener thread. A
+    forked child (job workers, preloaded servers) starts its own listener on
+    first use.
+    """
+
+    def __init__(self, stream=None, max_queue_size=10_000):
+        super().__init__(queue.Queue(max_queue_size))
+        self.target = logging.StreamHandler(stream or sys.stdout)
+        self.dropped = 0
+        self._listener = None
+        self._listener_pid = None
+        atexit.register(self.stop)
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def _ensure_listener(self):
+        pid = os.getpid()
+        if self._listener is None or self._listener_pid != pid:
+            self._listener = QueueListener(self.queue, self.target)
+            self._listener.start()
+            self._listener_pid = pid
+
+    def prepare(self, record):
+        # Resolve the message now (its arguments may change later) but leave formatting to the listener
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        # Never block a request on logging; the next line that gets through reports what was dropped
+        dropped, self.dropped = self.dropped, 0
+        if dropped:
+            record.dropped_records = dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += dropped + 1
+
+    def emit(self, record):
+        self._ensure_listener()
+        super().emit(record)
+
+    def stop(self):
+        """Flush queued records and stop the listener thread"""
+        if self._listener is not None and self._listener_pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
@@ -1,3 +1,1854 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
 
-# Create your tests here.
+from bson import ObjectId
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.test import SimpleTestCase, override_settings
+from prometheus_client import REGISTRY
+from pymongo import ASCENDING, DESCENDING, InsertOne
+from pymongo.errors import BulkWriteError, OperationFailure
+from google.auth import crypt
+from google.auth import jwt as google_jwt
+
+from .auth_middleware import GoogleCertCache, verify_google_token
+from .views import _job_event_stream, _pipeline_event_stream, _sse_response
+from .services.async_multi_agent import AsyncMultiAgentSystem
+from .services.async_mongodb_service import (
+    AsyncMongoDBService,
+    _async_clients,
+    _async_services,
+    get_async_mongo_client,
+    get_async_mongodb_service,
+)
+from .services.multi_agent import AggregationError, MultiAgentSystem, PRD_FORMAT_STRUCTURED, PRD_FORMAT_TEXT
+from .services.convergence import ConvergenceTracker, jaccard_similarity
+from .services.debate_context import build_debate_context, estimate_tokens, summarize_stance
+from .services.index_migrations import find_plan_problems
+from .services.job_queue import JOB_FAILED, JOB_RUNNING, JOB_SUCCEEDED, JobQueue
+from .services import mongodb_service
+from .services.metrics import llm_call
+from .services.pagination import (
+    MAX_PAGE_SIZE,
+    InvalidCursor,
+    akeyset_page,
+    clamp_page_size,
+    decode_cursor,
+    encode_cursor,
+    keyset_page,
+)
+from .services.mongodb_service import (
+    MongoDBService,
+    _buckets_from_debates,
+    _debate_bucket,
+    _debate_documents,
+    _group_debate_buckets,
+    _group_debate_rounds,
+)
+from .services.llm_cache import LLMResponseCache
+from .services.llm_providers import StubChatModel, StubProviderError, create_llm
+from .services.prd_parser import SECTION_KEYS
+from .services.quota import MongoQuotaLedger
+from .services.read_cache import LocalLRU, ReadCache, get_read_cache, idea_iterations_key
+from .services.unit_of_work import UnitOfWork
+from .services.user_cache import VerifiedUserCache, verified_user_cache
+from .structured_logging import (
+    BackgroundQueueHandler,
+    JsonFormatter,
+    RequestContextFilter,
+    SamplingFilter,
+    begin_request,
+    bind_user,
+    end_request,
+)
+
+
+def _generate_keypair():
+    """Generate an RSA keypair as (private PEM, public PEM)"""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    )
+    public_pem = key.public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    return private_pem, public_pem
+
+
+@override_settings(GOOGLE_CLIENT_ID='test-client-id')
+class VerifyGoogleTokenTests(SimpleTestCase):
+    """Offline tests for local ID-token verification against a stubbed cert source"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.private_pem, cls.public_pem = _generate_keypair()
+
+    def setUp(self):
+        self.fetch_count = 0
+        self.fetch_error = None
+        self.now = time.time()
+        self.cache = GoogleCertCache(fetcher=self._fetch_certs, clock=lambda: self.now)
+
+    def _fetch_certs(self):
+        self.fetch_count += 1
+        if self.fetch_error:
+            raise self.fetch_error
+        return {'key-1': self.public_pem.decode()}, 3600
+
+    def _make_token(self, kid='key-1', private_pem=None, **overrides):
+        now = int(time.time())
+        payload = {
+            'iss': 'https://accounts.google.com',
+            'aud': 'test-client-id',
+            'sub': '1234567890',
+            'email': 'user@example.com',
+            'name': 'Test User',
+            'picture': 'https://example.com/avatar.png',
+            'iat': now,
+            'exp': now + 3600,
+        }
+        payload.update(overrides)
+        signer = crypt.RSASigner.from_string(private_pem or self.private_pem, key_id=kid)
+        return google_jwt.encode(signer, payload).decode()
+
+    def test_valid_token_returns_user_info(self):
+        result = verify_google_token(self._make_token(), cert_cache=self.cache)
+
+        self.assertTrue(result['success'])
+        self.assertEqual(result['user_info']['email'], 'user@example.com')
+        self.assertEqual(result['user_info']['sub'], '1234567890')
+
+    def test_certs_are_cached_between_verifications(self):
+        for _ in range(3):
+            self.assertTrue(verify_google_token(self._make_token(), cert_cache=self.cache)['success'])
+
+        self.assertEqual(self.fetch_count, 1)
+
+    def test_certs_refresh_after_max_age(self):
+        verify_google_token(self._make_token(), cert_cache=self.cache)
+        self.now += 3601
+        verify_google_token(self._make_token(), cert_cache=self.cache)
+
+        self.assertEqual(self.fetch_count, 2)
+
+    def test_stale_certs_survive_fetch_outage(self):
+        verify_google_token(self._make_token(), cert_cache=self.cache)
+        self.now += 3601
+        self.fetch_error = ConnectionError('certs endpoint unavailable')
+
+        result = verify_google_token(self._make_token(), cert_cache=self.cache)
+
+        self.assertTrue(result['success'])
+
+    def test_wrong_audience_is_rejected(self):
+        token = self._make_token(aud='someone-else')
+
+        self.assertFalse(verify_google_token(token, cert_cache=self.cache)['success'])
+
+    def test_expired_token_is_rejected(self):
+        token = self._make_token(iat=int(time.time()) - 7200, exp=int(time.time()) - 3600)
+
+        self.assertFalse(verify_google_token(token, cert_cache=self.cache)['success'])
+
+    def test_wrong_issuer_is_rejected(self):
+        token = self._make_token(iss='https://evil.example.com')
+
+        self.assertFalse(verify_google_token(token, cert_cache=self.cache)['success'])
+
+    def test_token_signed_by_unknown_key_is_rejected(self):
+        other_private_pem, _ = _generate_keypair()
+        token = self._make_token(private_pem=other_private_pem)
+
+        self.assertFalse(verify_google_token(token, cert_cache=self.cache)['success'])
+
+    def test_unknown_key_id_triggers_one_refresh(self):
+        verify_google_token(self._make_token(), cert_cache=self.cache)
+
+        result = verify_google_token(self._make_token(kid='rotated-key'), cert_cache=self.cache)
+
+        self.assertFalse(result['success'])
+        self.assertEqual(self.fetch_count, 2)
+
+        # Further unknown key ids inside the refresh interval reuse the certs just fetched
+        for kid in ('made-up-1', 'made-up-2', 'rotated-key'):
+            self.now += 10
+            self.assertFalse(verify_google_token(self._make_token(kid=kid), cert_cache=self.cache)['success'])
+        self.assertEqual(self.fetch_count, 2)
+
+        self.now += 30
+        verify_google_token(self._make_token(kid='made-up-3'), cert_cache=self.cache)
+        self.assertEqual(self.fetch_count, 3)
+
+    def test_malformed_token_is_rejected(self):
+        self.assertFalse(verify_google_token('not-a-jwt', cert_cache=self.cache)['success'])
+
+
+def _round(responses):
+    """Build one round of debate entries from an {agent: response} dict"""
+    return [{'agent': agent, 'response': response} for agent, response in responses.items()]
+
+
+class ConvergenceTrackerTests(SimpleTestCase):
+    """Round-over-round change detection used to stop debates early"""
+
+    def test_jaccard_ignores_case_and_punctuation(self):
+        self.assertEqual(jaccard_similarity("Ship the MVP first.", "ship the mvp first"), 1.0)
+        self.assertEqual(jaccard_similarity("ship the mvp first", "hire a design team"), 0.0)
+
+    def test_stable_rounds_converge_after_min_rounds(self):
+        tracker = ConvergenceTracker(threshold=0.3, min_rounds=3)
+        stable = _round({'PM': 'focus on onboarding and retention', 'Dev': 'use a managed database'})
+        self.assertFalse(tracker.observe(1, stable))
+        self.assertFalse(tracker.observe(2, stable))
+        self.assertTrue(tracker.observe(3, stable))
+        self.assertEqual([score['change'] for score in tracker.scores], [0.0, 0.0])
+
+    def test_changing_rounds_do_not_converge(self):
+        tracker = ConvergenceTracker(threshold=0.3, min_rounds=1)
+        tracker.observe(1, _round({'PM': 'focus on onboarding and retention'}))
+        self.assertFalse(tracker.observe(2, _round({'PM': 'pivot to an enterprise sales motion'})))
+        self.assertEqual(tracker.scores[0]['agents'], {'PM': 1.0})
+
+
+class DebateContextTests(SimpleTestCase):
+    """Prompt context for the next round stays bounded as the debate grows"""
+
+    agents = ('Product Manager', 'Design Lead', 'Engineering Lead')
+
+    def _response(self, agent, round_num, padding=2):
+        return (
+            f"{agent} opening view for round {round_num}. "
+            + "Scope and risk need more detail. " * padding
+            + f"We should prioritise item {round_num}."
+        )
+
+    def _log(self, rounds, padding=2):
+        return [
+            {'agent': agent, 'round': round_num, 'response': self._response(agent, round_num, padding)}
+            for round_num in range(1, rounds + 1)
+            for agent in self.agents
+        ]
+
+    def test_context_stays_within_the_budget_as_rounds_accumulate(self):
+        for padding in (2, 200):
+            for rounds in range(1, 13):
+                context = build_debate_context(self._log(rounds, padding), token_budget=500)
+                self.assertLessEqual(estimate_tokens(context), 500, (padding, rounds))
+
+    def test_latest_round_is_kept_verbatim(self):
+        context = build_debate_context(self._log(4), token_budget=3000)
+        for agent in self.agents:
+            self.assertIn(f"{agent}: {self._response(agent, 4)}", context)
+        self.assertIn('Latest round (4):', context)
+
+    def test_older_rounds_fold_into_each_agents_latest_stance(self):
+        log = self._log(4)
+        log[0]['summary'] = 'Stored stance'
+        context = build_debate_context(log, token_budget=3000)
+        for agent in self.agents:
+            self.assertNotIn(self._response(agent, 1), context)
+            self.assertNotIn(f"{agent} (as of round 1)", context)
+            self.assertIn(f"- {agent} (as of round 3): {summarize_stance(self._response(agent, 3))}", context)
+        self.assertNotIn('Stored stance', context)
+
+    def test_stored_summary_is_preferred_over_the_full_response(self):
+        log = self._log(2)
+        log[0]['summary'] = 'Stored stance'
+        self.assertIn('- Product Manager (as of round 1): Stored stance', build_debate_context(log, token_budget=3000))
+
+    def test_stances_are_dropped_before_they_crowd_out_the_latest_round(self):
+        log = self._log(2)
+        for entry in log[:len(self.agents)]:
+            entry['summary'] = 'Long stance ' * 100
+        context = build_debate_context(log, token_budget=300)
+        earlier, latest = context.split('\n\nLatest round (2):')
+        self.assertLessEqual(len(earlier), 300 * 4 // 3)
+        self.assertTrue(earlier.endswith('…'))
+        self.assertIn(f"Product Manager: {self._response('Product Manager', 2)}", latest)
+
+    def test_empty_debate_has_no_context(self):
+        self.assertEqual(build_debate_context([]), '')
+
+
+class QueryPlanCheckTests(SimpleTestCase):
+    """Detection of collection scans and in-memory sorts in explain output"""
+
+    def test_index_scan_passes(self):
+        explain = {'queryPlanner': {'winningPlan': {
+            'stage': 'FETCH',
+            'inputStage': {'stage': 'IXSCAN', 'indexName': 'user_id_1_created_at_-1__id_-1'}
+        }}}
+        self.assertEqual(find_plan_problems(explain), [])
+
+    def test_collscan_and_blocking_sort_are_reported(self):
+        explain = {'queryPlanner': {'winningPlan': {'queryPlan': {
+            'stage': 'SORT',
+            'inputStage': {'stage': 'COLLSCAN'}
+        }}}}
+        self.assertEqual(sorted(find_plan_problems(explain)), ['COLLSCAN', 'SORT'])
+
+    def test_or_branches_are_inspected(self):
+        explain = {'queryPlanner': {'winningPlan': {
+            'stage': 'SORT_MERGE',
+            'inputStages': [{'stage': 'IXSCAN'}, {'stage': 'FETCH', 'inputStage': {'stage': 'COLLSCAN'}}]
+        }}}
+        self.assertEqual(find_plan_problems(explain), ['COLLSCAN'])
+
+
+class VerifiedUserCacheTests(SimpleTestCase):
+    """Token and user document caching used by require_auth"""
+
+    def setUp(self):
+        self.now = 1000.0
+        self.cache = VerifiedUserCache(max_entries=10, user_ttl_seconds=30, login_write_interval=300,
+                                       clock=lambda: self.now)
+        self.user = {'_id': 'user-1', 'email': 'user@example.com', 'credits': 10}
+
+    def test_token_is_not_served_past_its_exp(self):
+        self.cache.put('token', {'email': 'user@example.com'}, self.user, token_expires_at=1060)
+        self.assertEqual(self.cache.get('token')[1]['credits'], 10)
+        self.now = 1060
+        self.assertIsNone(self.cache.get('token'))
+
+    def test_invalidated_user_is_reloaded_without_reverifying(self):
+        self.cache.put('token', {'email': 'user@example.com'}, self.user, token_expires_at=5000)
+        self.cache.invalidate_user('user-1')
+        user_info, user = self.cache.get('token')
+        self.assertEqual(user_info['email'], 'user@example.com')
+        self.assertIsNone(user)
+
+    def test_update_user_replaces_cached_document(self):
+        self.cache.put('token', {}, self.user, token_expires_at=5000)
+        self.cache.update_user(dict(self.user, credits=8))
+        self.assertEqual(self.cache.get('token')[1]['credits'], 8)
+
+    def test_login_writes_are_coalesced(self):
+        self.assertTrue(self.cache.should_record_login('user-1'))
+        self.now += 299
+        self.assertFalse(self.cache.should_record_login('user-1'))
+        self.now += 1
+        self.assertTrue(self.cache.should_record_login('user-1'))
+
+
+class _UnlimitedLedger:
+    """Quota ledger stand-in that never runs out"""
+
+    def remaining(self, model):
+        return None
+
+    def reserve(self, model):
+        return True
+
+    def commit(self, model):
+        pass
+
+    def mark_exhausted(self, model):
+        pass
+
+    async def aremaining(self, model):
+        return None
+
+    async def areserve(self, model):
+        return True
+
+    async def acommit(self, model):
+        pass
+
+    async def amark_exhausted(self, model):
+        pass
+
+
+class _CountingLedger(_UnlimitedLedger):
+    """Unlimited ledger that counts committed calls"""
+
+    def __init__(self):
+        self.commits = 0
+
+    def commit(self, model):
+        self.commits += 1
+
+
+class _SlowLLM:
+    """Chat model stand-in that records how many calls overlap"""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.peak = 0
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def invoke(self, messages):
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        # Later calls return sooner, so concurrent turns finish out of persona order
+        time.sleep(0.05 / call)
+        with self._lock:
+            self.in_flight -= 1
+        return SimpleNamespace(content=f'1. OVERVIEW: response {call}')
+
+    async def ainvoke(self, messages):
+        self.calls += 1
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        # Numbered so the aggregator's answer parses as a PRD section
+        return SimpleNamespace(content=f'1. OVERVIEW: response {self.calls}')
+
+    def bind(self, **kwargs):
+        return self
+
+
+@override_settings(GEMINI_API_KEY='test-key')
+class AsyncMultiAgentSystemTests(SimpleTestCase):
+    """Awaited LLM calls in the async refinement path"""
+
+    def _system(self, **kwargs):
+        system = AsyncMultiAgentSystem(use_cache=False, quota_ledger=_UnlimitedLedger(), debate_mode='per_agent',
+                                       max_rounds=1, min_rounds=1, **kwargs)
+        system.llm = _SlowLLM()
+        return system
+
+    def test_round_agents_are_awaited_concurrently_up_to_the_limit(self):
+        system = self._system(max_concurrency=2)
+
+        result = asyncio.run(system.arefine_requirements('A habit tracker for remote teams'))
+
+        self.assertTrue(result['success'])
+        self.assertEqual(len(result['debate_log']), len(system.agents))
+        self.assertEqual(system.llm.peak, 2)
+        self.assertEqual(result['api_calls_made'], len(system.agents) + 1)
+
+    def test_debate_log_keeps_persona_order(self):
+        system = self._system()
+
+        result = asyncio.run(system.arefine_requirements('A habit tracker for remote teams'))
+
+        self.assertEqual([entry['agent'] for entry in result['debate_log']],
+                         [agent['name'] for agent in system.agents.values()])
+
+
+@override_settings(GEMINI_API_KEY='test-key')
+class MultiAgentSystemRoundTests(SimpleTestCase):
+    """Threaded agent calls in the sync debate round"""
+
+    def _system(self, **kwargs):
+        system = MultiAgentSystem(use_cache=False, quota_ledger=_UnlimitedLedger(), debate_mode='per_agent',
+                                  max_rounds=1, min_rounds=1, **kwargs)
+        system.llm = _SlowLLM()
+        return system
+
+    def test_round_agents_run_concurrently_up_to_the_limit(self):
+        system = self._system(max_concurrency=2)
+
+        round_log = system._run_round('A habit tracker for remote teams', 1)
+
+        self.assertEqual(len(round_log), len(system.agents))
+        self.assertEqual(system.llm.peak, 2)
+        self.assertEqual(system.api_calls_made, len(system.agents))
+
+    def test_round_log_keeps_persona_order_when_turns_finish_out_of_order(self):
+        system = self._system()
+        system.max_concurrency = len(system.agents)
+        finished = []
+
+        round_log = system._run_round('A habit tracker for remote teams', 1,
+                                      on_event=lambda event: finished.append(event['agent']))
+
+        personas = [agent['name'] for agent in system.agents.values()]
+        self.assertEqual([entry['agent'] for entry in round_log], personas)
+        self.assertEqual(sorted(finished), sorted(personas))
+        self.assertNotEqual(finished, personas)
+
+    def test_single_worker_runs_agents_one_at_a_time(self):
+        system = self._system(max_concurrency=1)
+
+        system._run_round('A habit tracker for remote teams', 1)
+
+        self.assertEqual(system.llm.peak, 1)
+
+
+class _PanelLLM:
+    """Chat model stand-in that answers the panel prompt with panel_json and each agent prompt by name"""
+
+    def __init__(self, panel_json):
+        self.panel_json = panel_json
+        self.agent_calls = 0
+        self._lock = threading.Lock()
+
+    def _answer(self, messages):
+        if 'Panel members:' in messages[-1].content:
+            return SimpleNamespace(content=self.panel_json)
+        with self._lock:
+            self.agent_calls += 1
+        return SimpleNamespace(content='Answered on its own')
+
+    def invoke(self, messages):
+        return self._answer(messages)
+
+    async def ainvoke(self, messages):
+        return self._answer(messages)
+
+
+@override_settings(GEMINI_API_KEY='test-key')
+class PanelModeTests(SimpleTestCase):
+    """One structured call per round answering for every persona"""
+
+    def _system(self, panel, system_class=MultiAgentSystem):
+        system = system_class(use_cache=False, quota_ledger=_UnlimitedLedger(), debate_mode='panel',
+                              max_rounds=1, min_rounds=1)
+        system.llm = _PanelLLM(panel if isinstance(panel, str) else json.dumps(panel))
+        system.cache = LLMResponseCache()
+        return system
+
+    def _full_panel(self, system):
+        return {agent_key: f"{agent['name']} weighs in" for agent_key, agent in system.agents.items()}
+
+    def test_fenced_json_is_parsed(self):
+        system = self._system({})
+        panel = self._full_panel(system)
+
+        self.assertEqual(system._parse_panel_response(f"```json\n{json.dumps(panel)}\n```"), panel)
+        self.assertEqual(system._parse_panel_response(f"```\n{json.dumps(panel)}\n```"), panel)
+
+    def test_json_wrapped_in_prose_is_recovered(self):
+        system = self._system({})
+
+        parsed = system._parse_panel_response('Sure, here is the panel: {"engineering_lead": "Use Postgres"} Hope this helps!')
+
+        self.assertEqual(parsed, {'engineering_lead': 'Use Postgres'})
+
+    def test_garbled_json_yields_no_turns(self):
+        system = self._system({})
+
+        for content in ('{"engineering_lead": "Use Postgres"', 'no json at all', '{"engineering_lead": }', '["Use Postgres"]', ''):
+            self.assertEqual(system._parse_panel_response(content), {}, content)
+
+    def test_unknown_keys_and_non_string_values_are_dropped(self):
+        system = self._system({})
+
+        parsed = system._parse_panel_response(json.dumps({
+            'engineering_lead': '  Use Postgres  ',
+            'ceo': 'Not on the panel',
+            'design_lead': 42,
+            'marketing_sales_head': ['a', 'list'],
+            'business_manager': None,
+            'product_manager': '   ',
+        }))
+
+        self.assertEqual(parsed, {'engineering_lead': 'Use Postgres'})
+
+    def _partial_round(self, system_class):
+        system = self._system({}, system_class)
+        covered = list(system.agents)[:2]
+        system.llm.panel_json = json.dumps({agent_key: 'From the panel' for agent_key in covered})
+
+        if system_class is AsyncMultiAgentSystem:
+            round_log = asyncio.run(system._arun_round('A habit tracker for remote teams', 1))
+        else:
+            round_log = system._run_round('A habit tracker for remote teams', 1)
+        return system, covered, round_log
+
+    def test_agents_missing_from_the_panel_are_asked_individually(self):
+        for system_class in (MultiAgentSystem, AsyncMultiAgentSystem):
+            system, covered, round_log = self._partial_round(system_class)
+
+            self.assertEqual([entry['agent'] for entry in round_log], [agent['name'] for agent in system.agents.values()])
+            expected = ['From the panel' if agent_key in covered else 'Answered on its own' for agent_key in system.agents]
+            self.assertEqual([entry['response'] for entry in round_log], expected, system_class.__name__)
+            self.assertEqual(system.llm.agent_calls, len(system.agents) - len(covered))
+
+    def test_partial_panel_response_is_not_cached(self):
+        for system_class in (MultiAgentSystem, AsyncMultiAgentSystem):
+            system, _, _ = self._partial_round(system_class)
+
+            panel_key = system._cache_key(system._build_panel_messages('A habit tracker for remote teams'))
+            self.assertIsNone(system.cache.get(panel_key), system_class.__name__)
+
+    def test_full_panel_response_is_cached(self):
+        for system_class in (MultiAgentSystem, AsyncMultiAgentSystem):
+            system = self._system({}, system_class)
+            system.llm.panel_json = json.dumps(self._full_panel(system))
+
+            if system_class is AsyncMultiAgentSystem:
+                asyncio.run(system._arun_round('A habit tracker for remote teams', 1))
+            else:
+                system._run_round('A habit tracker for remote teams', 1)
+
+            panel_key = system._cache_key(system._build_panel_messages('A habit tracker for remote teams'))
+            self.assertEqual(system.cache.get(panel_key), system.llm.panel_json, system_class.__name__)
+            self.assertEqual(system.llm.agent_calls, 0)
+
+
+class _Message:
+    def __init__(self, content):
+        self.content = content
+
+
+class StubChatModelTests(SimpleTestCase):
+    """Offline provider used for benchmarks and load tests"""
+
+    def _model(self, **kwargs):
+        self.slept = []
+        return StubChatModel(latency_ms=100, tokens_per_second=0, sleep=self.slept.append, **kwargs)
+
+    def test_content_is_deterministic_per_prompt(self):
+        model = self._model()
+        first = model.invoke([_Message('Describe a habit tracker')]).content
+        self.assertEqual(model.invoke([_Message('Describe a habit tracker')]).content, first)
+        self.assertNotEqual(model.invoke([_Message('Describe a recipe planner')]).content, first)
+
+    def test_panel_prompt_gets_every_persona_key(self):
+        prompt = '- key "product_manager" (Product Manager)\n- key "designer" (Design Lead)\nRespond with JSON'
+        content = self._model().invoke([_Message(prompt)]).content
+        self.assertEqual(sorted(json.loads(content)), ['designer', 'product_manager'])
+
+    def test_stream_reassembles_invoke_content(self):
+        model = self._model()
+        streamed = "".join(chunk.content for chunk in model.stream([_Message('Describe a habit tracker')]))
+        self.assertEqual(streamed, model.invoke([_Message('Describe a habit tracker')]).content)
+
+    def test_rate_limit_injection_looks_like_a_quota_error(self):
+        model = self._model(rate_limit_rate=1.0)
+        with self.assertRaisesRegex(StubProviderError, '429'):
+            model.invoke([_Message('Describe a habit tracker')])
+        self.assertEqual(model.rate_limited, 1)
+
+    def test_fixed_latency_is_slept(self):
+        model = self._model()
+        model.invoke([_Message('Describe a habit tracker')])
+        self.assertEqual(self.slept, [0.1])
+
+    @override_settings(LLM_PROVIDER='stub')
+    def test_provider_is_selected_by_settings(self):
+        model_name, llm = create_llm()
+        self.assertEqual(model_name, 'stub')
+        self.assertIsInstance(llm, StubChatModel)
+        with self.assertRaises(ValueError):
+            create_llm('unknown')
+
+
+@override_settings(GEMINI_API_KEY='test-key')
+class PrdAggregationTests(SimpleTestCase):
+    """Structured and text PRD aggregation against the stub provider"""
+
+    def _system(self, prd_format, **stub_kwargs):
+        system = MultiAgentSystem(use_cache=False, quota_ledger=_UnlimitedLedger(), debate_mode='panel',
+                                  max_rounds=1, min_rounds=1, prd_format=prd_format, llm_provider='stub')
+        system.llm = StubChatModel(latency_ms=0, tokens_per_second=0, **stub_kwargs)
+        return system
+
+    def test_structured_aggregation_returns_every_section(self):
+        result = self._system(PRD_FORMAT_STRUCTURED).refine_requirements('A habit tracker for remote teams')
+
+        self.assertTrue(result['success'])
+        self.assertNotIn('prd_content', result)
+        self.assertEqual(list(result['sections']), list(SECTION_KEYS))
+        self.assertTrue(all(result['sections'].values()))
+
+    def test_streamed_aggregation_emits_tokens_and_each_section(self):
+        for prd_format in (PRD_FORMAT_STRUCTURED, PRD_FORMAT_TEXT):
+            events = []
+            result = self._system(prd_format).refine_requirements('A habit tracker for remote teams', on_event=events.append)
+
+            sections = {event['section']: event['content'] for event in events if event['type'] == 'prd_section'}
+            self.assertEqual(sections, result['sections'], prd_format)
+            self.assertGreater(len([event for event in events if event['type'] == 'prd_token']), len(SECTION_KEYS), prd_format)
+
+    def test_async_streamed_aggregation_emits_tokens_and_each_section(self):
+        system = AsyncMultiAgentSystem(use_cache=False, quota_ledger=_UnlimitedLedger(), debate_mode='panel',
+                                       max_rounds=1, min_rounds=1, prd_format=PRD_FORMAT_STRUCTURED, llm_provider='stub')
+        system.llm = StubChatModel(latency_ms=0, tokens_per_second=0)
+        events = []
+
+        result = asyncio.run(system.arefine_requirements('A habit tracker for remote teams', on_event=events.append))
+
+        self.assertTrue(result['success'])
+        sections = {event['section']: event['content'] for event in events if event['type'] == 'prd_section'}
+        self.assertEqual(sections, result['sections'])
+        self.assertTrue(all(result['sections'].values()))
+        self.assertGreater(len([event for event in events if event['type'] == 'prd_token']), len(SECTION_KEYS))
+
+    def test_aggregator_errors_fail_the_refinement(self):
+        system = self._system(PRD_FORMAT_STRUCTURED)
+        system.llm.error_rate = 1.0
+
+        result = system.refine_requirements('A habit tracker for remote teams')
+
+        self.assertFalse(result['success'])
+        self.assertIn('Error aggregating results', result['error'])
+
+    def _rate_limited_stream(self, system, chunks, error='429 Resource has been exhausted (e.g. check quota).'):
+        def stream(messages, **kwargs):
+            for text in chunks:
+                yield SimpleNamespace(content=text)
+            raise StubProviderError(error)
+        system.llm.stream = stream
+
+    def _streamed_commits(self, chunks, error):
+        system = self._system(PRD_FORMAT_TEXT)
+        system.quota_ledger = _CountingLedger()
+        self._rate_limited_stream(system, chunks, error)
+        try:
+            list(system.stream_aggregate_results('A habit tracker for remote teams', []))
+        except AggregationError:
+            pass
+        return system.quota_ledger.commits
+
+    def test_streamed_aggregation_commits_only_calls_the_provider_answered(self):
+        rate_limit = '429 Resource has been exhausted (e.g. check quota).'
+        self.assertEqual(self._streamed_commits([], rate_limit), 0)
+        self.assertEqual(self._streamed_commits(['1. OVERVIEW: A habit tracker'], rate_limit), 1)
+        self.assertEqual(self._streamed_commits([], '500 Internal error encountered (stub provider).'), 1)
+        self.assertEqual(self._streamed_commits(['1. OVERVIEW: A habit tracker'], '500 Internal error'), 1)
+
+    def test_rate_limit_before_streaming_falls_back(self):
+        system = self._system(PRD_FORMAT_TEXT)
+        self._rate_limited_stream(system, [])
+
+        result = system.refine_requirements('A habit tracker for remote teams', on_event=lambda event: None)
+
+        self.assertTrue(result['success'])
+        self.assertTrue(result['used_fallback'])
+
+    def test_rate_limit_after_streaming_started_fails_the_refinement(self):
+        system = self._system(PRD_FORMAT_TEXT)
+        self._rate_limited_stream(system, ['1. OVERVIEW: A habit tracker'])
+        events = []
+
+        result = system.refine_requirements('A habit tracker for remote teams', on_event=events.append)
+
+        self.assertFalse(result['success'])
+        self.assertIn('Error aggregating results', result['error'])
+        self.assertEqual([event['token'] for event in events if event['type'] == 'prd_token'], ['1. OVERVIEW: A habit tracker'])
+
+
+class MetricsTests(SimpleTestCase):
+    """Prometheus instrumentation of LLM calls and the scrape endpoint"""
+
+    def _sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_llm_call_counts_rate_limits_and_reraises(self):
+        labels = {'model': 'stub', 'agent': 'metrics_test', 'outcome': 'rate_limited'}
+        before = self._sample('focalai_llm_call_duration_seconds_count', **labels)
+
+        with self.assertRaises(StubProviderError):
+            with llm_call('stub', 'metrics_test', [_Message('prompt')]):
+                raise StubProviderError('429 Resource has been exhausted (e.g. check quota).')
+
+        self.assertEqual(self._sample('focalai_llm_call_duration_seconds_count', **labels), before + 1)
+        self.assertEqual(self._sample('focalai_llm_rate_limited_total', model='stub', agent='metrics_test'), before + 1)
+
+    def test_llm_call_prefers_provider_token_counts(self):
+        labels = {'model': 'stub', 'agent': 'metrics_tokens', 'direction': 'output'}
+        before = self._sample('focalai_llm_tokens_total', **labels)
+
+        with llm_call('stub', 'metrics_tokens', [_Message('prompt')]) as call:
+            call.record(SimpleNamespace(content='ignored', usage_metadata={'input_tokens': 7, 'output_tokens': 42}))
+
+        self.assertEqual(self._sample('focalai_llm_tokens_total', **labels), before + 42)
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_metrics_endpoint_requires_the_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'focalai_http_request_duration_seconds', response.content)
+
+
+def _matches(document, query):
+    """Evaluate the subset of the MongoDB query language the services use against a dict"""
+    for field, condition in query.items():
+        if field == '$or':
+            if not any(_matches(document, branch) for branch in condition):
+                return False
+            continue
+        if field == '$and':
+            if not all(_matches(document, branch) for branch in condition):
+                return False
+            continue
+        value = document.get(field)
+        if isinstance(condition, dict) and any(key.startswith('$') for key in condition):
+            for operator, operand in condition.items():
+                if operator == '$in':
+                    passed = value in operand
+                elif value is None:
+                    passed = False
+                else:
+                    passed = {'$lt': value < operand, '$gt': value > operand, '$gte': value >= operand}[operator]
+                if not passed:
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+class _FakeCursor(list):
+    """find() result supporting the sort/limit/to_list chain the services build"""
+
+    def sort(self, key, direction=1):
+        keys = [(key, direction)] if isinstance(key, str) else key
+        for field, field_direction in reversed(keys):
+            super().sort(key=lambda document: document[field], reverse=field_direction < 0)
+        return self
+
+    def limit(self, count):
+        del self[count:]
+        return self
+
+    async def to_list(self, length=None):
+        return list(self)
+
+
+class _FakeCollection:
+    """In-memory stand-in for the collection methods the job queue and credit ledger call"""
+
+    def __init__(self, documents=()):
+        self.documents = [dict(document) for document in documents]
+
+    def insert_one(self, document):
+        document.setdefault('_id', ObjectId())
+        self.documents.append(dict(document))
+        return SimpleNamespace(inserted_id=document['_id'])
+
+    def insert_many(self, documents, ordered=True):
+        errors = []
+        for index, document in enumerate(documents):
+            if '_id' in document and any(existing['_id'] == document['_id'] for existing in self.documents):
+                errors.append({'index': index, 'code': 11000, 'errmsg': 'E11000 duplicate key error'})
+                if ordered:
+                    break
+                continue
+            self.insert_one(document)
+        if errors:
+            raise BulkWriteError({'writeErrors': errors, 'nInserted': len(documents) - len(errors)})
+        return SimpleNamespace(inserted_ids=[document['_id'] for document in documents])
+
+    def find_one(self, query, projection=None, sort=None):
+        documents = self.find(query, projection)
+        if sort:
+            documents.sort(sort)
+        return documents[0] if documents else None
+
+    def count_documents(self, query):
+        return len(self.find(query))
+
+    def find(self, query, projection=None):
+        return _FakeCursor(dict(document) for document in self.documents if _matches(document, query))
+
+    def update_one(self, query, update, upsert=False):
+        document = next((document for document in self.documents if _matches(document, query)), None)
+        if document is not None:
+            self._apply(document, update)
+        elif upsert:
+            document = {field: value for field, value in query.items() if not isinstance(value, dict)}
+            document.update(update.get('$setOnInsert', {}))
+            self._apply(document, update)
+            self.documents.append(document)
+            return SimpleNamespace(matched_count=0)
+        return SimpleNamespace(matched_count=int(document is not None))
+
+    def find_one_and_update(self, query, update, sort=None, return_document=None):
+        candidates = [document for document in self.documents if _matches(document, query)]
+        if sort:
+            candidates.sort(key=lambda document: document[sort[0][0]])
+        if not candidates:
+            return None
+        before = dict(candidates[0])
+        self._apply(candidates[0], update)
+        return dict(candidates[0]) if return_document else before
+
+    def bulk_write(self, operations, ordered=True, session=None):
+        for operation in operations:
+            if isinstance(operation, InsertOne):
+                self.insert_one(dict(operation._doc))
+            else:
+                self.update_one(operation._filter, operation._doc, upsert=operation._upsert)
+
+    def _apply(self, document, update):
+        document.update(update.get('$set', {}))
+        for field, amount in update.get('$inc', {}).items():
+            document[field] = document.get(field, 0) + amount
+        for field, value in update.get('$push', {}).items():
+            document[field] = document.get(field, []) + [value]
+        for field, condition in update.get('$pull', {}).items():
+            document[field] = [item for item in document.get(field, []) if not _matches(item, condition)]
+
+
+class _AsyncCollection:
+    """Awaitable view of a _FakeCollection, standing in for an AsyncCollection"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+        if name == 'find':
+            # AsyncCollection.find returns its cursor without awaiting
+            return method
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+
+class _FakeDatabase:
+    """Database handing out one _FakeCollection per name, passed through wrap"""
+
+    def __init__(self, wrap):
+        self.collections = {}
+        self.wrap = wrap
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return self.wrap(self.collections.setdefault(name, _FakeCollection()))
+
+    def __getitem__(self, name):
+        return self.__getattr__(name)
+
+
+class _FakeMongoClient:
+    def __init__(self, wrap=lambda collection: collection):
+        self.database = _FakeDatabase(wrap)
+
+    def __getitem__(self, name):
+        return self.database
+
+
+class _RefundRecorder:
+    def __init__(self, jobs):
+        self.refine_jobs_collection = _FakeCollection(jobs)
+        self.refunds = []
+
+    def refund_credits(self, user_id, amount, description):
+        self.refunds.append((user_id, amount))
+
+
+class JobQueueTests(SimpleTestCase):
+    """Claims, leases and refunds of queued refine jobs"""
+
+    def _queue(self, **job):
+        job = dict({
+            '_id': ObjectId(), 'job_type': 'refine', 'user_id': 'u1', 'payload': {'idea': 'Idea'},
+            'status': JOB_RUNNING, 'attempts': 1, 'worker_id': 'w1', 'credits_charged': 2,
+            'credit_description': 'Requirement generation', 'credits_refunded': False,
+            'lease_expires_at': datetime.utcnow() - timedelta(seconds=1), 'created_at': datetime.utcnow()
+        }, **job)
+        queue = JobQueue(_RefundRecorder([job]))
+        return queue, str(job['_id'])
+
+    def _job(self, queue):
+        return queue.collection.documents[0]
+
+    def test_claim_next_takes_over_an_expired_lease(self):
+        queue, _ = self._queue()
+
+        job = queue.claim_next('w2')
+
+        self.assertEqual((job['worker_id'], job['attempts']), ('w2', 2))
+        self.assertGreater(job['lease_expires_at'], datetime.utcnow())
+        self.assertIsNone(queue.claim_next('w3'))
+
+    def test_refund_runs_once(self):
+        queue, job_id = self._queue(status=JOB_FAILED)
+
+        self.assertTrue(queue.refund(job_id))
+        self.assertFalse(queue.refund(job_id))
+        self.assertEqual(queue.mongodb_service.refunds, [('u1', 2)])
+
+    def test_fail_abandoned_fails_and_refunds_jobs_out_of_attempts(self):
+        queue, _ = self._queue(attempts=2)
+
+        self.assertEqual(queue.fail_abandoned(), 1)
+        self.assertEqual(queue.fail_abandoned(), 0)
+        self.assertEqual(self._job(queue)['status'], JOB_FAILED)
+        self.assertEqual(queue.mongodb_service.refunds, [('u1', 2)])
+
+    def test_fail_abandoned_spares_jobs_with_attempts_left_or_a_live_lease(self):
+        queue, _ = self._queue(attempts=1)
+        renewed, _ = self._queue(attempts=2, lease_expires_at=datetime.utcnow() + timedelta(seconds=60))
+
+        self.assertEqual(queue.fail_abandoned() + renewed.fail_abandoned(), 0)
+
+    def test_late_outcome_after_a_takeover_is_discarded(self):
+        queue, job_id = self._queue()
+        queue.claim_next('w2')
+
+        self.assertFalse(queue.renew_lease(job_id, 'w1'))
+        self.assertFalse(queue.complete(job_id, {'success': True}, 'w1'))
+        self.assertFalse(queue.fail(job_id, 'too slow', 'w1'))
+        self.assertEqual((self._job(queue)['status'], self._job(queue)['worker_id']), (JOB_RUNNING, 'w2'))
+        self.assertEqual(queue.mongodb_service.refunds, [])
+
+        self.assertTrue(queue.complete(job_id, {'success': True}, 'w2'))
+        self.assertEqual(self._job(queue)['status'], JOB_SUCCEEDED)
+
+
+class _CrashingJobQueue(JobQueue):
+    """Job queue whose worker dies between saving a job's output and completing it"""
+
+    def complete(self, job_id, result, worker_id):
+        return False
+
+
+@override_settings(
+    MONGODB_URI='mongodb://localhost:27017',
+    MONGODB_USE_TRANSACTIONS=False,
+    LLM_PROVIDER='stub',
+    LLM_STUB_LATENCY_MS=0,
+    LLM_STUB_TOKENS_PER_SECOND=0,
+    LLM_QUOTA_BACKEND='local',
+    DEBATE_MODE='per_agent',
+    DEBATE_MAX_ROUNDS=1,
+    DEBATE_MIN_ROUNDS=1,
+)
+class JobTakeoverTests(SimpleTestCase):
+    """A job re-claimed after its output was saved completes without running again"""
+
+    def setUp(self):
+        self.client = _FakeMongoClient()
+        self.service = MongoDBService(client=self.client)
+        self.collections = self.client.database.collections
+        self.user_id = str(self.collections['users'].insert_one({'email': 'jobs@example.com', 'credits': 3}).inserted_id)
+
+    def _count(self, name):
+        return len(self.collections[name].documents) if name in self.collections else 0
+
+    def _take_over(self, job_id):
+        """Expire the first worker's lease and claim the job as w2"""
+        self.collections['refine_jobs'].update_one({'_id': ObjectId(job_id)}, {'$set': {'lease_expires_at': datetime.utcnow() - timedelta(seconds=1)}})
+        return JobQueue(self.service).claim_next('w2')
+
+    def test_refine_job_output_is_saved_once(self):
+        job_id = JobQueue(self.service).enqueue('refine', self.user_id, {'idea': 'A habit tracker', 'fresh': True}, 2, 'Requirement generation')
+        crashing = _CrashingJobQueue(self.service)
+        first = crashing.process(crashing.claim_next('w1'), 'w1')
+
+        job = self._take_over(job_id)
+        self.assertEqual((job['idea_id'], job['attempts']), (first['idea_id'], 2))
+        # No provider is configured for the retry, so it can only succeed without running the debate
+        with override_settings(LLM_PROVIDER='unconfigured'):
+            second = JobQueue(self.service).process(job, 'w2')
+
+        self.assertEqual((self._count('ideas'), self._count('requirements')), (1, 1))
+        self.assertEqual((second['idea_id'], second['sections']), (first['idea_id'], first['sections']))
+        self.assertEqual(len(second['debate_log']), len(first['debate_log']))
+        job = self.service.refine_jobs_collection.find_one({'_id': ObjectId(job_id)})
+        self.assertEqual((job['status'], job['result']['idea_id']), (JOB_SUCCEEDED, first['idea_id']))
+        self.assertFalse(job['credits_refunded'])
+
+    def test_feedback_job_iteration_is_saved_once(self):
+        idea_id = self.service.save_refinement({'user_id': self.user_id, 'title': 'Habits', 'description': 'A habit tracker'}, [], {'sections': {}})
+        job_id = JobQueue(self.service).enqueue('feedback', self.user_id, {'idea_id': idea_id, 'feedback': 'Add streaks', 'fresh': True}, 1, 'Feedback refinement')
+        crashing = _CrashingJobQueue(self.service)
+        first = crashing.process(crashing.claim_next('w1'), 'w1')
+
+        job = self._take_over(job_id)
+        with override_settings(LLM_PROVIDER='unconfigured'):
+            second = JobQueue(self.service).process(job, 'w2')
+
+        self.assertEqual(self._count('requirements'), 2)
+        self.assertEqual((second['idea_id'], second['sections']), (idea_id, first['sections']))
+        self.assertEqual(self.service.refine_jobs_collection.find_one({'_id': ObjectId(job_id)})['status'], JOB_SUCCEEDED)
+
+
+@override_settings(MONGODB_URI='mongodb://localhost:27017')
+class AsyncMongoClientTests(SimpleTestCase):
+    """One AsyncMongoClient per event loop, closed with its loop"""
+
+    def test_each_loop_gets_one_client_closed_when_the_loop_ends(self):
+        async def lookups():
+            client = get_async_mongo_client()
+            self.assertIs(get_async_mongo_client(), client)
+            self.assertIs(get_async_mongodb_service().client, client)
+            return client
+
+        first = asyncio.run(lookups())
+        second = asyncio.run(lookups())
+
+        self.assertIsNot(first, second)
+        self.assertTrue(first._closed)
+        self.assertTrue(second._closed)
+        self.assertEqual(_async_clients, {})
+
+
+@override_settings(GEMINI_API_KEY='test-key')
+class AsyncQuotaAndCacheTests(SimpleTestCase):
+    """The async debate path awaits the quota ledger and response cache instead of using threads"""
+
+    def setUp(self):
+        self.quota = _FakeCollection()
+        self.responses = _FakeCollection()
+
+    def _ledger(self, daily_limit):
+        # No blocking collection: any sync call would fail and the ledger would fail open
+        return MongoQuotaLedger(None, daily_limit, async_collection=lambda: _AsyncCollection(self.quota))
+
+    def _cache(self):
+        return LLMResponseCache(async_collection=lambda: _AsyncCollection(self.responses))
+
+    def test_ledger_reserves_until_the_daily_limit(self):
+        ledger = self._ledger(2)
+
+        async def reserve_three():
+            return [await ledger.areserve('gemini') for _ in range(3)]
+
+        self.assertEqual(asyncio.run(reserve_three()), [True, True, False])
+        self.assertEqual(asyncio.run(ledger.aremaining('gemini')), 0)
+
+    def test_debate_commits_every_call_to_the_ledger_and_caches_responses(self):
+        system = AsyncMultiAgentSystem(use_cache=False, quota_ledger=self._ledger(100), debate_mode='per_agent',
+                                       max_rounds=1, min_rounds=1)
+        system.cache = self._cache()
+        system.llm = _SlowLLM()
+
+        result = asyncio.run(system.arefine_requirements('A habit tracker for remote teams'))
+
+        self.assertTrue(result['success'])
+        [window] = self.quota.documents
+        self.assertEqual(window['reserved'], len(system.agents) + 1)
+        self.assertEqual(window['committed'], len(system.agents) + 1)
+        self.assertEqual(len(self.responses.documents), len(system.agents) + 1)
+
+        # A fresh process finds the responses in the Mongo tier
+        system.cache = self._cache()
+        asyncio.run(system.arefine_requirements('A habit tracker for remote teams'))
+        self.assertEqual(system.cache.stats()['mongo_hits'], len(system.agents) + 1)
+        self.assertEqual(system.llm.calls, len(system.agents) + 1)
+
+
+class _CreditLedgerChecks:
+    """Credit reservation and outbox flushing, shared by the sync and async service tests"""
+
+    def setUp(self):
+        self.user_id = str(ObjectId())
+        self.service = self._service()
+        self.users.insert_one({'_id': ObjectId(self.user_id), 'email': 'user@example.com', 'credits': 5, 'credit_outbox': []})
+
+    @property
+    def users(self):
+        return self.client.database.collections['users']
+
+    @property
+    def ledger(self):
+        return self.client.database.collections['credit_transactions']
+
+    def _user(self):
+        return self.users.find_one({'_id': ObjectId(self.user_id)})
+
+    def test_reservation_is_refused_when_the_balance_is_too_low(self):
+        before = REGISTRY.get_sample_value('focalai_credit_reservation_failures_total') or 0
+
+        self.assertIsNone(self._call('reserve_credits', self.user_id, 6))
+
+        self.assertEqual(self._user()['credits'], 5)
+        self.assertEqual(self._user()['credit_outbox'], [])
+        self.assertEqual(REGISTRY.get_sample_value('focalai_credit_reservation_failures_total'), before + 1)
+
+    def test_reservation_deducts_and_queues_a_ledger_entry(self):
+        user = self._call('reserve_credits', self.user_id, 2)
+
+        self.assertEqual(user['credits'], 3)
+        self.assertNotIn('credit_outbox', user)
+        [entry] = self._user()['credit_outbox']
+        self.assertEqual((entry['transaction_type'], entry['amount']), ('deduction', -2))
+        self.assertEqual(self.ledger.documents, [])
+
+    @override_settings(CREDIT_OUTBOX_FLUSH_SIZE=3)
+    def test_outbox_is_flushed_once_it_reaches_the_flush_size(self):
+        self._call('reserve_credits', self.user_id, 2)
+        self._call('refund_credits', self.user_id, 2, 'Credit refund')
+        self.assertEqual(self.ledger.documents, [])
+
+        self._call('_change_credits', self.user_id, 10, 'addition', 'Credit purchase')
+
+        self.assertEqual([entry['amount'] for entry in self.ledger.documents], [-2, 2, 10])
+        self.assertEqual(self._user()['credit_outbox'], [])
+        self.assertEqual(self._user()['credits'], 15)
+
+    def test_retried_flush_skips_entries_already_in_the_ledger(self):
+        for _ in range(3):
+            self._call('reserve_credits', self.user_id, 1)
+        outbox = self._user()['credit_outbox']
+        # A previous flush wrote the first entry, then died before pulling it from the outbox
+        self.ledger.insert_one(dict(outbox[0]))
+
+        self._call('_flush_entries', ObjectId(self.user_id), outbox)
+
+        self.assertEqual(sorted(entry['_id'] for entry in self.ledger.documents), sorted(entry['_id'] for entry in outbox))
+        self.assertEqual(self._user()['credit_outbox'], [])
+
+    def test_failed_flush_keeps_the_outbox(self):
+        self._call('reserve_credits', self.user_id, 1)
+        outbox = self._user()['credit_outbox']
+
+        def insert_many(documents, ordered=True):
+            raise BulkWriteError({'writeErrors': [{'index': 0, 'code': 121, 'errmsg': 'Document failed validation'}]})
+        self.ledger.insert_many = insert_many
+
+        with self.assertLogs('api.services', level='ERROR'):
+            self._call('_flush_entries', ObjectId(self.user_id), outbox)
+
+        self.assertEqual(self._user()['credit_outbox'], outbox)
+
+
+@override_settings(MONGODB_URI='mongodb://localhost:27017')
+class CreditLedgerTests(_CreditLedgerChecks, SimpleTestCase):
+    def _service(self):
+        self.client = _FakeMongoClient()
+        return MongoDBService(client=self.client)
+
+    def _call(self, method, *args):
+        return getattr(self.service, method)(*args)
+
+
+class AsyncCreditLedgerTests(_CreditLedgerChecks, SimpleTestCase):
+    def _service(self):
+        self.client = _FakeMongoClient(wrap=_AsyncCollection)
+        return AsyncMongoDBService(client=self.client)
+
+    def _call(self, method, *args):
+        return asyncio.run(getattr(self.service, method)(*args))
+
+
+def _requirements(headline):
+    return {'sections': {'requirements': f"\n- {headline}\nMore detail", 'next_steps': 'Ship the beta'}}
+
+
+def _debates(count):
+    return [{'agent': 'Product Manager', 'round': turn + 1, 'response': f"Turn {turn}. We should ship."} for turn in range(count)]
+
+
+class _IdeaSummaryChecks:
+    """The idea_summaries read model tracks every write to an idea"""
+
+    def setUp(self):
+        self.service = self._service()
+
+    @property
+    def summaries(self):
+        return self.client.database.collections['idea_summaries']
+
+    def _summary(self, idea_id):
+        return self.summaries.find_one({'_id': ObjectId(idea_id)})
+
+    def _new_idea(self):
+        return self._call('save_idea', {'user_id': 'u1', 'title': 'Habits', 'description': 'A habit tracker'})
+
+    def test_saved_idea_starts_an_empty_summary(self):
+        summary = self._summary(self._new_idea())
+        self.assertEqual(
+            (summary['user_id'], summary['title'], summary['debate_count'], summary['iteration_count']),
+            ('u1', 'Habits', 0, 0)
+        )
+        self.assertEqual((summary['section_headlines'], summary['last_refined_at']), ({}, None))
+
+    def test_saved_debates_add_to_the_debate_count(self):
+        idea_id = self._new_idea()
+        self._call('save_debates', idea_id, _debates(3))
+        self._call('save_debates', idea_id, _debates(2))
+        self._call('save_debates', idea_id, [])
+        self.assertEqual(self._summary(idea_id)['debate_count'], 5)
+
+    def test_saved_requirements_count_iterations_and_refresh_headlines(self):
+        idea_id = self._new_idea()
+        self._call('save_requirements', idea_id, _requirements('First draft'))
+        requirements = _requirements('Second draft')
+        self._call('save_requirements', idea_id, requirements)
+
+        summary = self._summary(idea_id)
+        self.assertEqual(summary['iteration_count'], 2)
+        self.assertEqual(summary['section_headlines'], {'requirements': 'Second draft', 'next_steps': 'Ship the beta'})
+        self.assertEqual(summary['last_refined_at'], requirements['created_at'])
+
+    def test_history_reads_the_headlines_back(self):
+        idea_id = self._new_idea()
+        self._call('save_requirements', idea_id, _requirements('First draft'))
+        history, _ = self._call('get_idea_history', 'u1')
+        self.assertEqual(history[0]['latest_requirement']['refined_requirements'], 'First draft')
+
+
+@override_settings(MONGODB_URI='mongodb://localhost:27017', MONGODB_USE_TRANSACTIONS=False)
+class IdeaSummaryTests(_IdeaSummaryChecks, SimpleTestCase):
+    def _service(self):
+        self.client = _FakeMongoClient()
+        return MongoDBService(client=self.client)
+
+    def _call(self, method, *args):
+        return getattr(self.service, method)(*args)
+
+    def _rebuild(self):
+        """Run the rebuild_idea_summaries command against the fake client"""
+        saved = mongodb_service._client, mongodb_service._client_pid
+        mongodb_service._client, mongodb_service._client_pid = self.client, os.getpid()
+        try:
+            call_command('rebuild_idea_summaries', stdout=io.StringIO())
+        finally:
+            mongodb_service._client, mongodb_service._client_pid = saved
+
+    def test_rebuild_matches_incremental_maintenance(self):
+        for storage in ('bucketed', 'per_message'):
+            with self.subTest(storage=storage), override_settings(DEBATE_STORAGE=storage):
+                self.service = self._service()
+                refined_id = self.service.save_refinement({'user_id': 'u1', 'title': 'Refined'}, _debates(4), _requirements('First draft'))
+                self.service.save_feedback_refinement(refined_id, _debates(3), dict(_requirements('Second draft'), iteration_number=2))
+                manual_id = self._new_idea()
+                self.service.save_debates(manual_id, _debates(2))
+                self.service.save_requirements(manual_id, _requirements('Manual draft'))
+                self._new_idea()
+
+                # updated_at follows the latest write incrementally but the idea document on rebuild
+                incremental = [dict(summary, updated_at=None) for summary in self.summaries.documents]
+                self.summaries.documents.clear()
+                self._rebuild()
+                rebuilt = [dict(summary, updated_at=None) for summary in self.summaries.documents]
+
+                key = lambda summary: summary['_id']
+                self.assertEqual(sorted(rebuilt, key=key), sorted(incremental, key=key))
+                self.assertEqual([summary['debate_count'] for summary in sorted(rebuilt, key=key)], [7, 2, 0])
+
+
+class AsyncIdeaSummaryTests(_IdeaSummaryChecks, SimpleTestCase):
+    def _service(self):
+        self.client = _FakeMongoClient(wrap=_AsyncCollection)
+        return AsyncMongoDBService(client=self.client)
+
+    def _call(self, method, *args):
+        return asyncio.run(getattr(self.service, method)(*args))
+
+
+class _JobSequence:
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+
+    async def get_refine_job(self, job_id, user_id=None):
+        now = datetime.utcnow()
+        return {'_id': job_id, 'job_type': 'refine', 'status': self.statuses.pop(0), 'result': {},
+                'error': 'x', 'created_at': now, 'updated_at': now}
+
+
+class JobEventStreamTests(SimpleTestCase):
+    def _events(self, service, timeout=60):
+        async def collect():
+            return [event async for event in _job_event_stream(service, 'job', 'u1', poll_interval=0, timeout=timeout)]
+        return asyncio.run(collect())
+
+    def test_status_changes_are_streamed_until_the_job_finishes(self):
+        events = self._events(_JobSequence(JOB_RUNNING, JOB_RUNNING, JOB_SUCCEEDED))
+
+        statuses = [event for event in events if event.startswith('event: status')]
+        self.assertEqual(len(statuses), 2)
+        self.assertIn('"succeeded"', statuses[-1])
+
+    def test_stream_stops_at_the_deadline(self):
+        events = self._events(_JobSequence(JOB_RUNNING, JOB_RUNNING), timeout=-1)
+
+        self.assertTrue(events[-1].startswith('event: timeout'))
+
+
+class PipelineEventStreamTests(SimpleTestCase):
+    """Server-Sent Events from a refine pipeline running on the request's event loop"""
+
+    def test_first_event_arrives_before_the_pipeline_finishes(self):
+        release = asyncio.Event()
+        progress = []
+
+        async def run_pipeline(on_event):
+            on_event({'type': 'turn', 'agent': 'Product Manager', 'response': 'Ship it'})
+            await release.wait()
+            progress.append('finished')
+            return {'success': True, 'idea_id': 'idea-1', 'debate_log': [], 'sections': {}}
+
+        async def refund():
+            progress.append('refunded')
+
+        async def consume():
+            response = _sse_response(_pipeline_event_stream(run_pipeline, refund))
+            self.assertTrue(response.is_async)
+            chunks = []
+            async for chunk in response:
+                if not chunks:
+                    self.assertEqual(progress, [])
+                    release.set()
+                chunks.append(chunk.decode())
+            return chunks
+
+        chunks = asyncio.run(consume())
+
+        self.assertTrue(chunks[0].startswith('event: turn'))
+        self.assertTrue(chunks[-1].startswith('event: done'))
+        self.assertIn('"idea_id": "idea-1"', chunks[-1])
+        self.assertEqual(progress, ['finished'])
+
+    def test_failed_pipeline_is_refunded(self):
+        refunds = []
+
+        async def run_pipeline(on_event):
+            raise AggregationError('Error aggregating results: boom')
+
+        async def refund():
+            refunds.append(1)
+
+        async def collect():
+            return [event async for event in _pipeline_event_stream(run_pipeline, refund)]
+
+        events = asyncio.run(collect())
+
+        self.assertEqual(refunds, [1])
+        self.assertEqual(len(events), 1)
+        self.assertTrue(events[0].startswith('event: error'))
+
+
+def _install_async_fake_mongo(test_case):
+    """Point the running event loop's async Mongo service at in-memory collections"""
+    loop = asyncio.get_running_loop()
+    get_async_mongo_client()
+    client = _FakeMongoClient(wrap=_AsyncCollection)
+    _async_clients[loop] = (client, _async_clients[loop][1])
+    _async_services.pop(loop, None)
+    test_case.addCleanup(_async_clients.pop, loop, None)
+    get_async_mongodb_service()
+    return client.database.collections
+
+
+def _sign_in(collections, token, email, credits=5):
+    """Store a user and serve them for token from the verified user cache"""
+    user_id = ObjectId()
+    user = {'_id': str(user_id), 'email': email, 'credits': credits}
+    collections['users'].insert_one(dict(user, _id=user_id, credit_outbox=[]))
+    verified_user_cache.put(token, {'email': email}, user, time.time() + 3600)
+    verified_user_cache.should_record_login(user['_id'])
+    return user_id
+
+
+@override_settings(
+    MONGODB_URI='mongodb://localhost:27017',
+    MONGODB_USE_TRANSACTIONS=False,
+    LLM_PROVIDER='stub',
+    LLM_STUB_LATENCY_MS=0,
+    LLM_STUB_TOKENS_PER_SECOND=0,
+    LLM_QUOTA_BACKEND='local',
+    DEBATE_MODE='per_agent',
+    DEBATE_MAX_ROUNDS=1,
+    DEBATE_MIN_ROUNDS=1,
+)
+class RefineStreamAsgiTests(SimpleTestCase):
+    """/api/refine/stream/ served through the ASGI handler, as under uvicorn"""
+
+    async def test_refine_stream_reaches_the_client_event_by_event(self):
+        collections = _install_async_fake_mongo(self)
+        user_id = _sign_in(collections, 'stream-token', 'stream@example.com')
+
+        response = await self.async_client.post(
+            '/api/refine/stream/',
+            data={'idea': 'A habit tracker for remote teams', 'fresh': True},
+            content_type='application/json',
+            headers={'Authorization': 'Bearer stream-token'}
+        )
+
+        # A sync iterator would be drained with sync_to_async(list) before the first byte is sent
+        self.assertTrue(response.is_async)
+        events = [chunk.decode() async for chunk in response.streaming_content]
+        self.assertTrue(events[0].startswith('event: turn'))
+        self.assertIn('event: prd_token', ''.join(events))
+        self.assertTrue(events[-1].startswith('event: done'), events[-1])
+        self.assertEqual(len(collections['ideas'].documents), 1)
+        self.assertEqual(collections['users'].find_one({'_id': user_id})['credits'], 3)
+
+
+class PaginationTests(SimpleTestCase):
+    """Keyset pagination over (sort key, _id)"""
+
+    def _collection(self):
+        # Pairs of ideas share a created_at, so only the _id tie-break orders them
+        start = datetime(2024, 5, 1, 12, 0)
+        return _FakeCollection(
+            {'_id': ObjectId(), 'user_id': 'u1', 'created_at': start + timedelta(minutes=index // 2)}
+            for index in range(7)
+        )
+
+    def _pages(self, collection, direction, limit):
+        pages, cursor = [], None
+        while True:
+            documents, cursor = keyset_page(collection, {'user_id': 'u1'}, 'created_at', direction, limit=limit, cursor=cursor)
+            pages.append(documents)
+            if cursor is None:
+                return pages
+
+    def _order(self, collection, direction):
+        return sorted(
+            collection.documents,
+            key=lambda document: (document['created_at'], document['_id']),
+            reverse=direction == DESCENDING
+        )
+
+    def test_cursor_round_trips(self):
+        created_at, doc_id = datetime(2024, 5, 1, 12, 30, 15, 250000), ObjectId()
+        token = encode_cursor(created_at, doc_id)
+        self.assertNotIn('=', token)
+        self.assertEqual(decode_cursor(token), (created_at, doc_id))
+
+    def test_malformed_and_tampered_cursors_are_rejected(self):
+        token = encode_cursor(datetime(2024, 5, 1), ObjectId())
+        tampered = encode_cursor(datetime(2024, 5, 1), ObjectId())[:-4] + 'AAAA'
+        for bad in ('garbage!', '', token[:-3], tampered, 'eyJ2IjoxfQ'):
+            with self.assertRaises(InvalidCursor, msg=bad):
+                decode_cursor(bad)
+
+    def test_page_size_is_clamped(self):
+        self.assertEqual(clamp_page_size(0), 1)
+        self.assertEqual(clamp_page_size(-5), 1)
+        self.assertEqual(clamp_page_size(500), MAX_PAGE_SIZE)
+        self.assertEqual(clamp_page_size('25'), 25)
+        self.assertEqual(clamp_page_size('abc', 10), 10)
+        self.assertEqual(clamp_page_size(None, 10), 10)
+
+    def test_pages_follow_sort_key_then_id_across_ties(self):
+        collection = self._collection()
+        for direction in (DESCENDING, ASCENDING):
+            pages = self._pages(collection, direction, limit=2)
+            self.assertEqual([len(page) for page in pages], [2, 2, 2, 1])
+            self.assertEqual(
+                [document['_id'] for page in pages for document in page],
+                [document['_id'] for document in self._order(collection, direction)]
+            )
+
+    def test_next_cursor_only_when_another_page_exists(self):
+        collection = self._collection()
+        documents, cursor = keyset_page(collection, {'user_id': 'u1'}, 'created_at', limit=7)
+        self.assertEqual((len(documents), cursor), (7, None))
+        documents, cursor = keyset_page(collection, {'user_id': 'u1'}, 'created_at', limit=6)
+        self.assertEqual(len(documents), 6)
+        documents, cursor = keyset_page(collection, {'user_id': 'u1'}, 'created_at', limit=6, cursor=cursor)
+        self.assertEqual((len(documents), cursor), (1, None))
+        self.assertEqual(keyset_page(collection, {'user_id': 'nobody'}, 'created_at'), ([], None))
+
+    async def test_async_pages_match_sync_pages(self):
+        collection = self._collection()
+        pages, cursor = [], None
+        while True:
+            documents, cursor = await akeyset_page(_AsyncCollection(collection), {'user_id': 'u1'}, 'created_at', limit=3, cursor=cursor)
+            pages.append(documents)
+            if cursor is None:
+                break
+        self.assertEqual(pages, self._pages(collection, DESCENDING, limit=3))
+
+
+@override_settings(MONGODB_URI='mongodb://localhost:27017')
+class PaginatedViewTests(SimpleTestCase):
+    """A bad cursor is the client's mistake, answered with a 400"""
+
+    async def _get(self, path):
+        collections = _install_async_fake_mongo(self)
+        _sign_in(collections, 'page-token', 'pages@example.com')
+        session_id = collections['chat_sessions'].insert_one({
+            'user_id': 'pages@example.com',
+            'title': 'Pages',
+            'created_at': datetime(2024, 5, 1),
+            'updated_at': datetime(2024, 5, 1)
+        }).inserted_id
+        return await self.async_client.get(
+            path.format(session_id=session_id),
+            headers={'Authorization': 'Bearer page-token'}
+        )
+
+    async def test_history_rejects_an_invalid_cursor(self):
+        response = await self._get('/api/history/?cursor=garbage!')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'success': False, 'error': 'Invalid pagination cursor'})
+
+    async def test_chat_session_list_rejects_an_invalid_cursor(self):
+        response = await self._get('/api/chat/sessions/list/?cursor=garbage!')
+        self.assertEqual(response.status_code, 400)
+
+    async def test_chat_messages_reject_an_invalid_cursor(self):
+        response = await self._get('/api/chat/sessions/{session_id}/?cursor=garbage!')
+        self.assertEqual(response.status_code, 400)
+
+    async def test_valid_cursor_pages_the_chat_session_list(self):
+        response = await self._get('/api/chat/sessions/list/?limit=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((len(response.json()['sessions']), response.json()['next_cursor']), (1, None))
+
+
+class _RecordingCollection:
+    def __init__(self, name, calls):
+        self.name = name
+        self.calls = calls
+
+    def bulk_write(self, operations, ordered=True, session=None):
+        self.calls.append((self.name, len(operations), session))
+
+
+class _RecordingDatabase:
+    def __init__(self):
+        self.calls = []
+
+    def __getitem__(self, name):
+        return _RecordingCollection(name, self.calls)
+
+    __getattr__ = __getitem__
+
+
+class _NoTransactionSession:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def with_transaction(self, callback):
+        raise OperationFailure('Transaction numbers are only allowed on a replica set member or mongos', code=20)
+
+
+class _TransactionSession(_NoTransactionSession):
+    def with_transaction(self, callback):
+        return callback(self)
+
+
+class _RecordingClient:
+    def __init__(self, session):
+        self.database = _RecordingDatabase()
+        self.session = session
+
+    def __getitem__(self, name):
+        return self.database
+
+    def start_session(self):
+        return self.session
+
+
+class UnitOfWorkTests(SimpleTestCase):
+    """Staging and committing the refine pipeline's writes"""
+
+    def _service(self, session):
+        return MongoDBService(client=_RecordingClient(session))
+
+    def _sample(self, **labels):
+        return REGISTRY.get_sample_value('focalai_mongo_unit_of_work_round_trips_sum', labels) or 0
+
+    def test_operations_are_grouped_by_collection_in_first_use_order(self):
+        unit_of_work = UnitOfWork('test')
+        unit_of_work.insert_many('debates', [{'n': 1}, {'n': 2}])
+        unit_of_work.insert('ideas', {'n': 3})
+        unit_of_work.update('debates', {'n': 1}, {'$set': {'n': 4}})
+
+        self.assertEqual(list(unit_of_work.batches), ['debates', 'ideas'])
+        self.assertEqual(len(unit_of_work), 4)
+
+    def test_refinement_is_one_transaction_with_the_idea_and_summary_last(self):
+        service = self._service(_TransactionSession())
+        before = self._sample(unit='refine', mode='transaction')
+        debates = [{'agent': 'pm', 'response': 'Ship it', 'summary': 'ship', 'round': 1}] * 5
+
+        idea_id = service.save_refinement({'title': 'Idea', 'description': 'Idea', 'user_id': 'u1'}, debates, {'sections': {}})
+
+        calls = service.client.database.calls
+        self.assertEqual([(name, count) for name, count, _ in calls], [
+            ('debate_iterations', 1), ('requirements', 1), ('ideas', 1), ('idea_summaries', 1)
+        ])
+        self.assertTrue(all(session is service.client.session for _, _, session in calls))
+        self.assertEqual(len(idea_id), 24)
+        self.assertEqual(self._sample(unit='refine', mode='transaction'), before + 5)
+
+    def test_standalone_server_falls_back_to_bulk_writes_once(self):
+        service = self._service(_NoTransactionSession())
+        before = self._sample(unit='feedback', mode='bulk')
+
+        with self.assertLogs('api.services.mongodb_service', level='WARNING'):
+            service.save_feedback_refinement('0' * 24, [], {'user_feedback': 'More', 'sections': {}, 'iteration_number': 2})
+
+        self.assertFalse(service.use_transactions)
+        self.assertEqual([(name, session) for name, _, session in service.client.database.calls], [
+            ('requirements', None), ('idea_summaries', None)
+        ])
+        self.assertEqual(self._sample(unit='feedback', mode='bulk'), before + 2)
+
+
+class DebateBucketTests(SimpleTestCase):
+    """Per-iteration debate documents and their migration from per-message ones"""
+
+    def _debate_log(self, rounds, prefix):
+        return [
+            {'agent': agent, 'response': f'{prefix} {agent} round {round_num}', 'summary': 'stance', 'round': round_num}
+            for round_num in range(1, rounds + 1)
+            for agent in ('product_manager', 'engineer')
+        ]
+
+    def test_bucketed_reads_match_per_message_reads(self):
+        first, second = self._debate_log(3, 'first'), self._debate_log(2, 'second')
+
+        buckets = [_debate_bucket('idea', 1, first), _debate_bucket('idea', 2, second)]
+        per_message = sorted(
+            _debate_documents('idea', first) + _debate_documents('idea', second),
+            key=lambda debate: debate['round_number']
+        )
+        strip = lambda rounds: {n: [(m['agent'], m['message']) for m in messages] for n, messages in rounds.items()}
+
+        self.assertEqual(buckets[0]['message_count'], 6)
+        self.assertEqual([r['round_number'] for r in buckets[0]['rounds']], [1, 2, 3])
+        self.assertEqual(list(_group_debate_buckets(buckets)), [1, 2, 3])
+        self.assertEqual(strip(_group_debate_buckets(buckets)), strip(_group_debate_rounds(per_message)))
+
+    def test_migration_assigns_each_debate_to_the_next_prd(self):
+        refined_at = [datetime(2026, 1, 1, 10), datetime(2026, 1, 2, 10)]
+        debates = [
+            {'round_number': round_num, 'agent_name': 'engineer', 'message': f'm{day}{round_num}',
+             'stance_summary': 's', 'timestamp': datetime(2026, 1, day, 9, round_num)}
+            for round_num in (1, 2)
+            for day in (1, 2, 3)
+        ]
+
+        buckets = _buckets_from_debates('idea', debates, refined_at)
+
+        self.assertEqual([b['iteration_number'] for b in buckets], [1, 2, 3])
+        self.assertEqual([m['message'] for r in buckets[1]['rounds'] for m in r['messages']], ['m21', 'm22'])
+        self.assertEqual(buckets[0]['created_at'], datetime(2026, 1, 1, 9, 1))
+        self.assertEqual(sum(b['message_count'] for b in buckets), 6)
+
+
+class ReadCacheTests(SimpleTestCase):
+    """Read-through caching of idea and chat-session reads"""
+
+    def _cache(self, shared=None, max_bytes=10_000):
+        return ReadCache(LocalLRU(max_bytes=max_bytes, max_entry_bytes=2_000, ttl_seconds=60), shared=shared)
+
+    def test_lru_evicts_by_size_and_skips_oversized_entries(self):
+        lru = LocalLRU(max_bytes=100, max_entry_bytes=60, ttl_seconds=60)
+        lru.set('a', b'x' * 40)
+        lru.set('b', b'x' * 40)
+        lru.get('a')
+        lru.set('c', b'x' * 40)
+        lru.set('d', b'x' * 61)
+
+        self.assertIsNone(lru.get('b'))
+        self.assertIsNone(lru.get('d'))
+        self.assertEqual(lru.size_bytes, 80)
+
+    def test_hits_return_independent_copies(self):
+        cache = self._cache()
+        loads = []
+        load = lambda: loads.append(1) or {'idea': {'title': 'Idea'}}
+
+        first = cache.get_or_load('idea_details:1', load)
+        first['idea']['title'] = 'changed by a view'
+        second = cache.get_or_load('idea_details:1', load)
+
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(second['idea']['title'], 'Idea')
+        self.assertEqual(cache.stats()['idea_details']['hit_ratio'], 0.5)
+
+    def test_invalidation_during_a_load_keeps_the_stale_result_out(self):
+        cache = self._cache()
+
+        def load():
+            cache.invalidate('idea_details:1')
+            return {'version': 1}
+
+        cache.get_or_load('idea_details:1', load)
+
+        self.assertEqual(cache.get_or_load('idea_details:1', lambda: {'version': 2}), {'version': 2})
+
+    def test_shared_tier_serves_other_processes_and_is_invalidated(self):
+        shared = LocMemCache('read-cache-test', {})
+        writer, reader = self._cache(shared), self._cache(shared)
+
+        writer.get_or_load('chat_sessions:u1', lambda: ([{'title': 'Chat'}], None))
+        self.assertEqual(reader.get_or_load('chat_sessions:u1', lambda: None), ([{'title': 'Chat'}], None))
+        self.assertEqual(reader.stats()['chat_sessions']['shared'], 1)
+
+        writer.invalidate('chat_sessions:u1')
+        self.assertIsNone(shared.get('chat_sessions:u1'))
+
+    def test_async_reads_share_the_cache(self):
+        cache = self._cache(LocMemCache('read-cache-async-test', {}))
+
+        async def load():
+            return {'idea': 'loaded'}
+
+        async def read_twice():
+            first = await cache.aget_or_load('idea_iterations:1', load)
+            await cache.ainvalidate('idea_iterations:1')
+            return first, await cache.aget_or_load('idea_iterations:1', load)
+
+        self.assertEqual(asyncio.run(read_twice()), ({'idea': 'loaded'}, {'idea': 'loaded'}))
+        self.assertEqual(cache.stats()['idea_iterations']['miss'], 2)
+
+    def test_saving_a_feedback_iteration_invalidates_the_idea(self):
+        service = MongoDBService(client=_RecordingClient(_TransactionSession()))
+        idea_id = '1' * 24
+        loads = []
+        service._load_idea_with_iterations = lambda idea_id: loads.append(idea_id) or {'idea': {'_id': idea_id}}
+        get_read_cache().invalidate(idea_iterations_key(idea_id))
+
+        service.get_idea_with_iterations(idea_id)
+        service.get_idea_with_iterations(idea_id)
+        service.save_feedback_refinement(idea_id, [], {'user_feedback': 'More', 'sections': {}, 'iteration_number': 2})
+        service.get_idea_with_iterations(idea_id)
+
+        self.assertEqual(len(loads), 2)
+
+
+class StructuredLoggingTests(SimpleTestCase):
+    def _record(self, message, level=logging.INFO, **extra):
+        record = logging.LogRecord('api.test', level, __file__, 1, message, None, None)
+        for key, value in extra.items():
+            setattr(record, key, value)
+        return record
+
+    def test_formatter_adds_request_context_and_truncates_fields(self):
+        request_id, tokens = begin_request('req-123')
+        try:
+            bind_user('user-1')
+            record = self._record('refinement finished', prd='x' * 100, turns=12)
+            RequestContextFilter().filter(record)
+        finally:
+            end_request(tokens)
+
+        entry = json.loads(JsonFormatter(max_field_chars=10).format(record))
+
+        self.assertEqual(entry['request_id'], request_id)
+        self.assertEqual(entry['user_id'], 'user-1')
+        self.assertIsNotNone(entry['elapsed_ms'])
+        self.assertEqual(entry['turns'], 12)
+        self.assertEqual(entry['prd'], 'x' * 10 + '...[90 chars truncated]')
+
+    def test_sampling_is_per_request_and_keeps_warnings(self):
+        sampler = SamplingFilter(rate=0.5)
+        request_ids = [f'req-{i}' for i in range(200)]
+        kept = [sampler.filter(self._record('info', request_id=request_id)) for request_id in request_ids]
+
+        self.assertTrue(any(kept) and not all(kept))
+        # Every line of a request gets the same decision
+        self.assertEqual(kept, [sampler.filter(self._record('debug', level=logging.DEBUG, request_id=request_id)) for request_id in request_ids])
+        self.assertTrue(all(sampler.filter(self._record('warning', level=logging.WARNING, request_id=request_id)) for request_id in request_ids))
+
+    def test_queue_handler_writes_on_the_listener_thread(self):
+        stream = io.StringIO()
+        handler = BackgroundQueueHandler(stream=stream)
+        handler.setFormatter(JsonFormatter())
+
+        handler.handle(self._record('hello %s'))
+        handler.stop()
+
+        self.assertEqual(json.loads(stream.getvalue())['message'], 'hello %s')
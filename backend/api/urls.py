@@ -13,6 +13,16 @@ urlpatterns = [
     path('history/', views.get_history, name='get_history'),
     path('idea/<int:idea_id>/', views.get_idea_details, name='get_idea_details'),
     
+    # Streaming refinement (Server-Sent Events)
+    path('refine/stream/', views.refine_requirements_stream, name='refine_requirements_stream'),
+    path('refine-feedback/stream/', views.refine_requirements_with_feedback_stream, name='refine_requirements_with_feedback_stream'),
+    
+    # Asynchronous refine jobs
+    path('refine/jobs/', views.submit_refine_job, name='submit_refine_job'),
+    path('refine-feedback/jobs/', views.submit_feedback_job, name='submit_feedback_job'),
+    path('jobs/<str:job_id>/', views.get_job_status, name='get_job_status'),
+    path('jobs/<str:job_id>/stream/', views.stream_job_status, name='stream_job_status'),
+    
     # User Management URLs (now require authentication)
     path('users/profile/', user_views.get_user_profile, name='get_user_profile'),
     path('users/deduct-credits/', user_views.deduct_credits, name='deduct_credits'),
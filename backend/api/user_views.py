@@ -2,10 +2,15 @@ from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 import json
-from .services.mongodb_service import MongoDBService
+import logging
+from .services.mongodb_service import get_mongodb_service
+from .services.pagination import page_params, InvalidCursor
 from .auth_middleware import require_auth, get_user_from_request
 
 
+logger = logging.getLogger(__name__)
+
+
 @require_http_methods(["GET"])
 @require_auth
 def get_user_profile(request):
@@ -18,14 +23,13 @@ def get_user_profile(request):
                 'error': 'User authentication required'
             }, status=401)
         
-        print(f"✅ User profile retrieved successfully: {user['email']}")
         return JsonResponse({
             'success': True,
             'user': user
         })
         
     except Exception as e:
-        print(f"❌ Unexpected error in get_user_profile: {str(e)}")
+        logger.exception("Unexpected error in get_user_profile")
         return JsonResponse({
             'success': False,
             'error': str(e)
@@ -38,7 +42,6 @@ def get_user_profile(request):
 def deduct_credits(request):
     """API endpoint to deduct credits for requirement generation"""
     try:
-        print(f"🔧 Deduct credits request received: {request.body}")
         data = json.loads(request.body)
         amount = data.get('amount', 2)  # Default 2 credits
         description = data.get('description', 'Requirement generation')
@@ -50,48 +53,44 @@ def deduct_credits(request):
                 'error': 'User authentication required'
             }, status=401)
         
-        print(f"💰 Processing credit deduction: {amount} credits for user {user['email']}")
-        
         try:
-            mongodb_service = MongoDBService()
-            print(f"✅ MongoDB service initialized successfully")
+            mongodb_service = get_mongodb_service()
         except Exception as e:
-            print(f"❌ Failed to initialize MongoDB service: {str(e)}")
+            logger.exception("Failed to initialize MongoDB service")
             return JsonResponse({
                 'success': False,
                 'error': f'Database connection failed: {str(e)}'
             }, status=500)
         
-        # Deduct credits
-        success, message = mongodb_service.deduct_credits(user['_id'], amount, description)
+        # Deduct credits; the updated user comes back from the same atomic update
+        updated_user = mongodb_service.reserve_credits(user['_id'], amount, description)
         
-        if success:
-            # Get updated user data
-            updated_user = mongodb_service.get_user_by_id(user['_id'])
+        if updated_user is not None:
             mongodb_service.close()
             
-            print(f"✅ Credits deducted successfully: {message}")
+            message = f"Successfully deducted {amount} credits"
+            logger.info("Credits deducted", extra={'amount': amount})
             return JsonResponse({
                 'success': True,
                 'message': message,
                 'user': updated_user
             })
         else:
+            message = f"Insufficient credits. Required: {amount}, Available: {mongodb_service.get_user_credits(user['_id'])}"
             mongodb_service.close()
-            print(f"❌ Credit deduction failed: {message}")
+            logger.info("Credit deduction refused", extra={'amount': amount})
             return JsonResponse({
                 'success': False,
                 'error': message
             }, status=400)
         
-    except json.JSONDecodeError as e:
-        print(f"❌ JSON decode error: {str(e)}")
+    except json.JSONDecodeError:
         return JsonResponse({
             'success': False,
             'error': 'Invalid JSON data'
         }, status=400)
     except Exception as e:
-        print(f"❌ Unexpected error in deduct_credits: {str(e)}")
+        logger.exception("Unexpected error in deduct_credits")
         return JsonResponse({
             'success': False,
             'error': str(e)
@@ -110,30 +109,33 @@ def get_user_transactions(request):
                 'error': 'User authentication required'
             }, status=401)
         
-        print(f"🔧 Get user transactions request for user: {user['email']}")
-        
         try:
-            mongodb_service = MongoDBService()
-            print(f"✅ MongoDB service initialized successfully")
+            mongodb_service = get_mongodb_service()
         except Exception as e:
-            print(f"❌ Failed to initialize MongoDB service: {str(e)}")
+            logger.exception("Failed to initialize MongoDB service")
             return JsonResponse({
                 'success': False,
                 'error': f'Database connection failed: {str(e)}'
             }, status=500)
         
-        # Get transactions
-        transactions = mongodb_service.get_user_transactions(user['_id'])
+        # Get one page of transactions
+        limit, cursor = page_params(request.GET, default_limit=20)
+        transactions, next_cursor = mongodb_service.get_user_transactions(user['_id'], limit=limit, cursor=cursor)
         mongodb_service.close()
         
-        print(f"✅ User transactions retrieved successfully: {len(transactions)} transactions")
         return JsonResponse({
             'success': True,
-            'transactions': transactions
+            'transactions': transactions,
+            'next_cursor': next_cursor
         })
         
+    except InvalidCursor as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=400)
     except Exception as e:
-        print(f"❌ Unexpected error in get_user_transactions: {str(e)}")
+        logger.exception("Unexpected error in get_user_transactions")
         return JsonResponse({
             'success': False,
             'error': str(e)
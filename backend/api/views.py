@@ -1,62 +1,39 @@
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.utils import timezone
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+import asyncio
+import hmac
 import json
-from .services.multi_agent import MultiAgentSystem
-from .services.mongodb_service import MongoDBService
+import logging
+import time
+from .services.mongodb_service import get_mongodb_service
+from .services.async_mongodb_service import get_async_mongodb_service
+from .services.pagination import page_params, InvalidCursor
+from .services.metrics import render_metrics, CONTENT_TYPE_LATEST
+from .services.refine_pipeline import (
+    REFINE_CREDIT_COST,
+    FEEDBACK_CREDIT_COST,
+    arun_refinement,
+    arun_feedback_refinement,
+    with_prd_content,
+)
+from .services.job_queue import (
+    JobQueue,
+    JOB_TYPE_REFINE,
+    JOB_TYPE_FEEDBACK,
+    TERMINAL_STATUSES,
+    serialize_job,
+)
 from .auth_middleware import require_auth, get_user_from_request
 from .user_views import get_user_profile, deduct_credits, get_user_transactions
 from datetime import datetime
 
 
-def _parse_prd_sections(prd_text):
-    """Parse PRD content into structured sections"""
-    sections = {
-        'overview': '',
-        'problem_statement': '',
-        'debate_summary': '',
-        'objectives': '',
-        'scope': '',
-        'requirements': '',
-        'user_stories': '',
-        'trade_offs_decisions': '',
-        'next_steps': '',
-        'success_metrics': ''
-    }
-    
-    lines = prd_text.split('\n')
-    current_section = None
-    
-    for line in lines:
-        line = line.strip()
-        
-        # Check for section headers
-        if '1. OVERVIEW' in line.upper():
-            current_section = 'overview'
-        elif '2. PROBLEM STATEMENT' in line.upper():
-            current_section = 'problem_statement'
-        elif '3. DEBATE SUMMARY' in line.upper():
-            current_section = 'debate_summary'
-        elif '4. OBJECTIVES' in line.upper():
-            current_section = 'objectives'
-        elif '5. SCOPE' in line.upper():
-            current_section = 'scope'
-        elif '6. REQUIREMENTS' in line.upper():
-            current_section = 'requirements'
-        elif '7. USER STORIES' in line.upper():
-            current_section = 'user_stories'
-        elif '8. TRADE-OFFS' in line.upper() or '8. TRADE OFFS' in line.upper():
-            current_section = 'trade_offs_decisions'
-        elif '9. NEXT STEPS' in line.upper():
-            current_section = 'next_steps'
-        elif '10. SUCCESS METRICS' in line.upper():
-            current_section = 'success_metrics'
-        elif current_section and line:
-            sections[current_section] += line + '\n'
-    
-    return sections
+logger = logging.getLogger(__name__)
 
 
 @csrf_exempt
@@ -70,6 +47,15 @@ def test_connection(request):
     })
 
 
+@require_http_methods(["GET"])
+def metrics(request):
+    """Prometheus scrape endpoint, guarded by METRICS_TOKEN when one is configured"""
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse(status=401)
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE_LATEST)
+
+
 @csrf_exempt
 @require_http_methods(["GET"])
 @require_auth
@@ -84,14 +70,76 @@ def test_auth(request):
     })
 
 
+def _charge_credits(mongodb_service, user, amount, description):
+    """Reserve credits for a refinement, returning (updated_user, error_response)"""
+    charged_user = mongodb_service.reserve_credits(user['_id'], amount, description)
+    if charged_user is None:
+        return None, JsonResponse({
+            'success': False,
+            'error': f'Insufficient credits. Required: {amount}, Available: {mongodb_service.get_user_credits(user["_id"])}'
+        }, status=402)
+    return charged_user, None
+
+
+def _load_owned_idea(mongodb_service, user, idea_id):
+    """Load an idea with its iterations, returning (idea_data, error_response)"""
+    # Get the original idea and previous debate
+    idea_data = mongodb_service.get_idea_with_iterations(idea_id)
+    if not idea_data:
+        return None, JsonResponse({
+            'success': False,
+            'error': 'Idea not found'
+        }, status=404)
+    
+    # Check if user owns this idea
+    if idea_data['idea']['user_id'] != user['_id']:
+        return None, JsonResponse({
+            'success': False,
+            'error': 'Access denied'
+        }, status=403)
+    
+    return idea_data, None
+
+
+async def _acharge_credits(mongodb_service, user, amount, description):
+    """_charge_credits for an AsyncMongoDBService"""
+    charged_user = await mongodb_service.reserve_credits(user['_id'], amount, description)
+    if charged_user is None:
+        return None, JsonResponse({
+            'success': False,
+            'error': f'Insufficient credits. Required: {amount}, Available: {await mongodb_service.get_user_credits(user["_id"])}'
+        }, status=402)
+    return charged_user, None
+
+
+async def _aload_owned_idea(mongodb_service, user, idea_id):
+    """_load_owned_idea for an AsyncMongoDBService"""
+    idea_data = await mongodb_service.get_idea_with_iterations(idea_id)
+    if not idea_data:
+        return None, JsonResponse({
+            'success': False,
+            'error': 'Idea not found'
+        }, status=404)
+    
+    if idea_data['idea']['user_id'] != user['_id']:
+        return None, JsonResponse({
+            'success': False,
+            'error': 'Access denied'
+        }, status=403)
+    
+    return idea_data, None
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 @require_auth
-def refine_requirements(request):
+async def refine_requirements(request):
     """API endpoint to refine requirements using multi-agent debate"""
     try:
         data = json.loads(request.body)
         idea_text = data.get('idea', '').strip()
+        fresh = bool(data.get('fresh', False))  # Skip the LLM response cache
+        include_prd_content = bool(data.get('include_prd_content', False))  # Also return the PRD as numbered text
         
         if not idea_text:
             return JsonResponse({
@@ -107,93 +155,28 @@ def refine_requirements(request):
                 'error': 'User authentication required'
             }, status=401)
         
-        # Check if user has sufficient credits
-        mongodb_service = MongoDBService()
-        current_credits = mongodb_service.get_user_credits(user['_id'])
-        
-        if current_credits < 2:
-            mongodb_service.close()
-            return JsonResponse({
-                'success': False,
-                'error': f'Insufficient credits. Required: 2, Available: {current_credits}'
-            }, status=402)
+        mongodb_service = get_async_mongodb_service()
         
         # Deduct credits first
-        success, message = mongodb_service.deduct_credits(user['_id'], 2, 'Requirement generation')
-        if not success:
-            mongodb_service.close()
-            return JsonResponse({
-                'success': False,
-                'error': message
-            }, status=402)
-        
-        # Initialize services
-        agent_system = MultiAgentSystem()
-        
-        # Save idea to MongoDB with user_id
-        idea_data = {
-            'title': idea_text[:200],  # Truncate if too long
-            'description': idea_text,
-            'user_id': user['_id']
-        }
-        idea_id = mongodb_service.save_idea(idea_data)
-        
-        # Run requirement refinement
-        result = agent_system.refine_requirements(idea_text)
-        
-        print(f"🔍 Refinement result: {result}")
-        
-        if result['success']:
-            # Save debate log to MongoDB
-            mongodb_service.save_debates(idea_id, result['debate_log'])
-            
-            # Parse PRD content to extract sections
-            prd_text = result['prd_content']
-            
-            # Parse the PRD sections
-            sections = _parse_prd_sections(prd_text)
-            
-            # Save PRD to MongoDB
-            requirements_data = {
-                'prd_content': prd_text,
-                'sections': sections
-            }
-            mongodb_service.save_requirements(idea_id, requirements_data)
-            
-            # Get updated user data
-            updated_user = mongodb_service.get_user_by_id(user['_id'])
-            mongodb_service.close()
-            
-            # Prepare response with fallback information
-            response_data = {
-                'success': True,
-                'idea_id': idea_id,
-                'prd_content': result['prd_content'],
-                'sections': sections,
-                'debate_log': result['debate_log'],
-                'user': updated_user
-            }
-            
-            # Add fallback information if used
-            if result.get('used_fallback', False):
-                response_data['fallback_used'] = True
-                response_data['fallback_message'] = 'Analysis completed using fallback responses due to API quota limitations. For more detailed AI-powered analysis, please try again later when quota resets.'
-                response_data['api_calls_made'] = result.get('api_calls_made', 0)
-            else:
-                response_data['fallback_used'] = False
-                response_data['api_calls_made'] = result.get('api_calls_made', 0)
-            
-            print(f"📤 Sending response: {response_data}")
+        charged_user, error_response = await _acharge_credits(mongodb_service, user, REFINE_CREDIT_COST, 'Requirement generation')
+        if error_response:
+            return error_response
+        
+        try:
+            response_data = await arun_refinement(mongodb_service, user['_id'], idea_text, use_cache=not fresh, user=charged_user)
+        except Exception:
+            await mongodb_service.refund_credits(user['_id'], REFINE_CREDIT_COST, 'Credit refund - requirement generation failed')
+            raise
+        
+        if response_data['success']:
+            if include_prd_content:
+                with_prd_content(response_data)
             return JsonResponse(response_data)
         else:
             # Refund credits if requirement generation failed
-            mongodb_service.add_credits(user['_id'], 2, 'Credit refund - requirement generation failed')
-            mongodb_service.close()
+            await mongodb_service.refund_credits(user['_id'], REFINE_CREDIT_COST, 'Credit refund - requirement generation failed')
             
-            return JsonResponse({
-                'success': False,
-                'error': result.get('error', 'Unknown error occurred')
-            }, status=500)
+            return JsonResponse(response_data, status=500)
             
     except json.JSONDecodeError:
         return JsonResponse({
@@ -210,12 +193,14 @@ def refine_requirements(request):
 @csrf_exempt
 @require_http_methods(["POST"])
 @require_auth
-def refine_requirements_with_feedback(request):
+async def refine_requirements_with_feedback(request):
     """API endpoint to refine requirements based on user feedback"""
     try:
         data = json.loads(request.body)
         idea_id = data.get('idea_id', '').strip()
         user_feedback = data.get('feedback', '').strip()
+        fresh = bool(data.get('fresh', False))  # Skip the LLM response cache
+        include_prd_content = bool(data.get('include_prd_content', False))  # Also return the PRD as numbered text
         
         if not idea_id:
             return JsonResponse({
@@ -237,119 +222,399 @@ def refine_requirements_with_feedback(request):
                 'error': 'User authentication required'
             }, status=401)
         
-        # Check if user has sufficient credits (1 credit for feedback iteration)
-        mongodb_service = MongoDBService()
-        current_credits = mongodb_service.get_user_credits(user['_id'])
+        mongodb_service = get_async_mongodb_service()
+        idea_data, error_response = await _aload_owned_idea(mongodb_service, user, idea_id)
+        if error_response:
+            return error_response
+        
+        # Deduct 1 credit for feedback iteration
+        charged_user, error_response = await _acharge_credits(mongodb_service, user, FEEDBACK_CREDIT_COST, 'Feedback-based requirement refinement')
+        if error_response:
+            return error_response
+        
+        try:
+            response_data = await arun_feedback_refinement(
+                mongodb_service,
+                user['_id'],
+                idea_id,
+                user_feedback,
+                idea_data=idea_data,
+                use_cache=not fresh,
+                user=charged_user
+            )
+        except Exception:
+            await mongodb_service.refund_credits(user['_id'], FEEDBACK_CREDIT_COST, 'Credit refund - feedback refinement failed')
+            raise
+        
+        if response_data['success']:
+            if include_prd_content:
+                with_prd_content(response_data)
+            return JsonResponse(response_data)
+        else:
+            # Refund credits if refinement failed
+            await mongodb_service.refund_credits(user['_id'], FEEDBACK_CREDIT_COST, 'Credit refund - feedback refinement failed')
+            
+            return JsonResponse(response_data, status=500)
+            
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON data'
+        }, status=400)
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=500)
+
+
+# Asynchronous Refine Job Endpoints
+def _job_accepted_response(request, job_id, charged_user):
+    """Build the 202 response returned when a refine job is queued"""
+    return JsonResponse({
+        'success': True,
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': request.build_absolute_uri(f'/api/jobs/{job_id}/'),
+        'stream_url': request.build_absolute_uri(f'/api/jobs/{job_id}/stream/'),
+        'user': charged_user
+    }, status=202)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@require_auth
+def submit_refine_job(request):
+    """Queue a multi-agent refinement and return its job id immediately"""
+    try:
+        data = json.loads(request.body)
+        idea_text = data.get('idea', '').strip()
+        fresh = bool(data.get('fresh', False))  # Skip the LLM response cache
         
-        if current_credits < 1:
-            mongodb_service.close()
+        if not idea_text:
             return JsonResponse({
                 'success': False,
-                'error': f'Insufficient credits. Required: 1, Available: {current_credits}'
-            }, status=402)
+                'error': 'Idea text is required'
+            }, status=400)
+        
+        user = get_user_from_request(request)
+        mongodb_service = get_mongodb_service()
+        
+        # Credits are charged now and refunded by the worker if the job fails
+        charged_user, error_response = _charge_credits(mongodb_service, user, REFINE_CREDIT_COST, 'Requirement generation')
+        if error_response:
+            return error_response
+        
+        job_id = JobQueue(mongodb_service).enqueue(
+            JOB_TYPE_REFINE,
+            user['_id'],
+            {'idea': idea_text, 'fresh': fresh},
+            credits_charged=REFINE_CREDIT_COST,
+            credit_description='Requirement generation'
+        )
+        return _job_accepted_response(request, job_id, charged_user)
+        
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON data'
+        }, status=400)
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=500)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@require_auth
+def submit_feedback_job(request):
+    """Queue a feedback-based refinement and return its job id immediately"""
+    try:
+        data = json.loads(request.body)
+        idea_id = data.get('idea_id', '').strip()
+        user_feedback = data.get('feedback', '').strip()
+        fresh = bool(data.get('fresh', False))  # Skip the LLM response cache
         
-        # Get the original idea and previous debate
-        idea_data = mongodb_service.get_idea_with_iterations(idea_id)
-        if not idea_data:
-            mongodb_service.close()
+        if not idea_id:
             return JsonResponse({
                 'success': False,
-                'error': 'Idea not found'
-            }, status=404)
+                'error': 'Idea ID is required'
+            }, status=400)
         
-        # Check if user owns this idea
-        if idea_data['idea']['user_id'] != user['_id']:
-            mongodb_service.close()
+        if not user_feedback:
             return JsonResponse({
                 'success': False,
-                'error': 'Access denied'
-            }, status=403)
+                'error': 'User feedback is required'
+            }, status=400)
         
-        # Deduct 1 credit for feedback iteration
-        success, message = mongodb_service.deduct_credits(user['_id'], 1, 'Feedback-based requirement refinement')
-        if not success:
-            mongodb_service.close()
+        user = get_user_from_request(request)
+        mongodb_service = get_mongodb_service()
+        _, error_response = _load_owned_idea(mongodb_service, user, idea_id)
+        if error_response:
+            return error_response
+        
+        charged_user, error_response = _charge_credits(mongodb_service, user, FEEDBACK_CREDIT_COST, 'Feedback-based requirement refinement')
+        if error_response:
+            return error_response
+        
+        job_id = JobQueue(mongodb_service).enqueue(
+            JOB_TYPE_FEEDBACK,
+            user['_id'],
+            {'idea_id': idea_id, 'feedback': user_feedback, 'fresh': fresh},
+            credits_charged=FEEDBACK_CREDIT_COST,
+            credit_description='Feedback-based requirement refinement'
+        )
+        return _job_accepted_response(request, job_id, charged_user)
+        
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON data'
+        }, status=400)
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=500)
+
+
+def _wants_prd_content(request):
+    """True when a GET asks for the PRD as numbered text as well as sections"""
+    return request.GET.get('include_prd_content', '').lower() in ('1', 'true')
+
+
+@csrf_exempt
+@require_http_methods(["GET"])
+@require_auth
+def get_job_status(request, job_id):
+    """Poll a refine job for its status and, once finished, its result"""
+    try:
+        user = get_user_from_request(request)
+        job = JobQueue(get_mongodb_service()).get_job(job_id, user_id=user['_id'])
+        
+        if not job:
             return JsonResponse({
                 'success': False,
-                'error': message
-            }, status=402)
-        
-        # Get the original idea text
-        original_idea = idea_data['idea']['description']
-        
-        # Get previous debate log
-        previous_debate_log = []
-        for round_num, debates in idea_data['debate_rounds'].items():
-            for debate in debates:
-                previous_debate_log.append({
-                    'agent': debate['agent'],
-                    'response': debate['message'],
-                    'round': round_num
-                })
+                'error': 'Job not found'
+            }, status=404)
         
-        # Initialize services
-        agent_system = MultiAgentSystem()
+        data = serialize_job(job)
+        if _wants_prd_content(request):
+            with_prd_content(data.get('result'))
         
-        # Run feedback-based refinement
-        result = agent_system.refine_requirements_with_feedback(
-            original_idea, 
-            previous_debate_log, 
-            user_feedback
-        )
+        return JsonResponse({
+            'success': True,
+            'job': data
+        })
         
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=500)
+
+
+def _sse_event(event_type, data):
+    """Format one Server-Sent Event"""
+    return f"event: {event_type}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+def _sse_response(events):
+    """Wrap an event generator in a non-buffered text/event-stream response"""
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def _job_event_stream(mongodb_service, job_id, user_id, poll_interval, timeout):
+    """Yield Server-Sent Events for each job status change until it finishes"""
+    deadline = time.monotonic() + timeout
+    last_status = None
+    
+    while True:
+        job = await mongodb_service.get_refine_job(job_id, user_id=user_id)
+        if not job:
+            yield _sse_event('error', {'error': 'Job not found'})
+            return
+        
+        if job['status'] != last_status:
+            last_status = job['status']
+            yield _sse_event('status', serialize_job(job))
+        
+        if job['status'] in TERMINAL_STATUSES:
+            return
+        
+        if time.monotonic() > deadline:
+            yield _sse_event('timeout', {'job_id': job_id})
+            return
+        
+        # Comment line keeps proxies from closing an idle connection
+        yield ": keep-alive\n\n"
+        await asyncio.sleep(poll_interval)
+
+
+@csrf_exempt
+@require_http_methods(["GET"])
+@require_auth
+async def stream_job_status(request, job_id):
+    """Stream a refine job's status changes as Server-Sent Events without holding a worker thread"""
+    user = get_user_from_request(request)
+    
+    return _sse_response(_job_event_stream(
+        get_async_mongodb_service(),
+        job_id,
+        user['_id'],
+        poll_interval=getattr(settings, 'JOB_STREAM_POLL_SECONDS', 1.0),
+        timeout=getattr(settings, 'JOB_STREAM_TIMEOUT_SECONDS', 300)
+    ))
+
+
+# Streaming Refine Endpoints
+# Pipelines still running after their client disconnected; the loop only holds weak references to tasks
+_pipeline_tasks = set()
+
+
+async def _pipeline_event_stream(run_pipeline, refund):
+    """Run a refine pipeline as a task on this event loop and yield its events as SSE.
+
+    The pipeline keeps running (and persists its result) even if the client
+    disconnects; ``refund`` is awaited if it fails.
+    """
+    events = asyncio.Queue()
+    
+    async def produce():
+        try:
+            result = await run_pipeline(events.put_nowait)
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+        if not result['success']:
+            await refund()
+        events.put_nowait({'type': 'complete', 'result': result})
+    
+    task = asyncio.create_task(produce())
+    _pipeline_tasks.add(task)
+    task.add_done_callback(_pipeline_tasks.discard)
+    
+    while True:
+        event = await events.get()
+        event_type = event.pop('type')
+        if event_type != 'complete':
+            yield _sse_event(event_type, event)
+            continue
+        
+        result = event['result']
         if result['success']:
-            # Save new debate log
-            mongodb_service.save_debates(idea_id, result['debate_log'])
-            
-            # Parse PRD content to extract sections
-            prd_text = result['prd_content']
-            
-            # Parse the PRD sections
-            sections = _parse_prd_sections(prd_text)
-            
-            # Save feedback iteration to MongoDB
-            iteration_data = {
-                'user_feedback': user_feedback,
-                'prd_content': prd_text,
-                'sections': sections,
-                'iteration_number': len(idea_data['requirements_iterations']) + 1
-            }
-            mongodb_service.save_feedback_iteration(idea_id, iteration_data)
-            
-            # Get updated user data
-            updated_user = mongodb_service.get_user_by_id(user['_id'])
-            mongodb_service.close()
-            
-            # Prepare response with fallback information
-            response_data = {
-                'success': True,
-                'idea_id': idea_id,
-                'prd_content': result['prd_content'],
-                'debate_log': result['debate_log'],
-                'sections': sections,
-                'user': updated_user
-            }
-            
-            # Add fallback information if used
-            if result.get('used_fallback', False):
-                response_data['fallback_used'] = True
-                response_data['fallback_message'] = 'Analysis completed using fallback responses due to API quota limitations. For more detailed AI-powered analysis, please try again later when quota resets.'
-                response_data['api_calls_made'] = result.get('api_calls_made', 0)
-            else:
-                response_data['fallback_used'] = False
-                response_data['api_calls_made'] = result.get('api_calls_made', 0)
-            
-            return JsonResponse(response_data)
+            # The client already has the debate and PRD sections from earlier events
+            summary = {key: value for key, value in result.items() if key not in ('debate_log', 'sections')}
+            yield _sse_event('done', summary)
         else:
-            # Refund credits if refinement failed
-            mongodb_service.add_credits(user['_id'], 1, 'Credit refund - feedback refinement failed')
-            mongodb_service.close()
-            
+            yield _sse_event('error', {'error': result.get('error', 'Unknown error occurred')})
+        return
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@require_auth
+async def refine_requirements_stream(request):
+    """Refine requirements, streaming each agent turn and the PRD tokens as Server-Sent Events"""
+    try:
+        data = json.loads(request.body)
+        idea_text = data.get('idea', '').strip()
+        fresh = bool(data.get('fresh', False))  # Skip the LLM response cache
+        
+        if not idea_text:
             return JsonResponse({
                 'success': False,
-                'error': result.get('error', 'Unknown error occurred')
-            }, status=500)
-            
+                'error': 'Idea text is required'
+            }, status=400)
+        
+        user = get_user_from_request(request)
+        mongodb_service = get_async_mongodb_service()
+        
+        charged_user, error_response = await _acharge_credits(mongodb_service, user, REFINE_CREDIT_COST, 'Requirement generation')
+        if error_response:
+            return error_response
+        
+        async def run_pipeline(on_event):
+            return await arun_refinement(
+                mongodb_service,
+                user['_id'],
+                idea_text,
+                on_event=on_event,
+                use_cache=not fresh,
+                user=charged_user
+            )
+        
+        async def refund():
+            await mongodb_service.refund_credits(user['_id'], REFINE_CREDIT_COST, 'Credit refund - requirement generation failed')
+        
+        return _sse_response(_pipeline_event_stream(run_pipeline, refund))
+        
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON data'
+        }, status=400)
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=500)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@require_auth
+async def refine_requirements_with_feedback_stream(request):
+    """Run a feedback iteration, streaming each agent turn and the PRD tokens as Server-Sent Events"""
+    try:
+        data = json.loads(request.body)
+        idea_id = data.get('idea_id', '').strip()
+        user_feedback = data.get('feedback', '').strip()
+        fresh = bool(data.get('fresh', False))  # Skip the LLM response cache
+        
+        if not idea_id:
+            return JsonResponse({
+                'success': False,
+                'error': 'Idea ID is required'
+            }, status=400)
+        
+        if not user_feedback:
+            return JsonResponse({
+                'success': False,
+                'error': 'User feedback is required'
+            }, status=400)
+        
+        user = get_user_from_request(request)
+        mongodb_service = get_async_mongodb_service()
+        idea_data, error_response = await _aload_owned_idea(mongodb_service, user, idea_id)
+        if error_response:
+            return error_response
+        
+        charged_user, error_response = await _acharge_credits(mongodb_service, user, FEEDBACK_CREDIT_COST, 'Feedback-based requirement refinement')
+        if error_response:
+            return error_response
+        
+        async def run_pipeline(on_event):
+            return await arun_feedback_refinement(
+                mongodb_service,
+                user['_id'],
+                idea_id,
+                user_feedback,
+                idea_data=idea_data,
+                on_event=on_event,
+                use_cache=not fresh,
+                user=charged_user
+            )
+        
+        async def refund():
+            await mongodb_service.refund_credits(user['_id'], FEEDBACK_CREDIT_COST, 'Credit refund - feedback refinement failed')
+        
+        return _sse_response(_pipeline_event_stream(run_pipeline, refund))
+        
     except json.JSONDecodeError:
         return JsonResponse({
             'success': False,
@@ -363,24 +628,30 @@ def refine_requirements_with_feedback(request):
 
 
 @require_http_methods(["GET"])
-def get_history(request):
-    """API endpoint to get past ideas and debates"""
+@require_auth
+async def get_history(request):
+    """API endpoint to get the current user's past ideas"""
     try:
-        mongodb_service = MongoDBService()
-        history = mongodb_service.get_idea_history(limit=10)
-        mongodb_service.close()
+        user = get_user_from_request(request)
+        limit, cursor = page_params(request.GET, default_limit=10)
+        mongodb_service = get_async_mongodb_service()
+        history, next_cursor = await mongodb_service.get_idea_history(user['_id'], limit=limit, cursor=cursor)
         
         # Convert ObjectId to string for JSON serialization
         for item in history:
             item['_id'] = str(item['_id'])
-            if 'latest_requirement' in item and item['latest_requirement']:
-                item['latest_requirement']['_id'] = str(item['latest_requirement']['_id'])
         
         return JsonResponse({
             'success': True,
-            'history': history
+            'history': history,
+            'next_cursor': next_cursor
         })
         
+    except InvalidCursor as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=400)
     except Exception as e:
         return JsonResponse({
             'success': False,
@@ -392,7 +663,7 @@ def get_history(request):
 def get_idea_details(request, idea_id):
     """API endpoint to get detailed information about a specific idea"""
     try:
-        mongodb_service = MongoDBService()
+        mongodb_service = get_mongodb_service()
         details = mongodb_service.get_idea_details(idea_id)
         mongodb_service.close()
         
@@ -406,6 +677,8 @@ def get_idea_details(request, idea_id):
         details['idea']['_id'] = str(details['idea']['_id'])
         if details['requirement']:
             details['requirement']['_id'] = str(details['requirement']['_id'])
+            if _wants_prd_content(request):
+                with_prd_content(details['requirement'])
         
         return JsonResponse({
             'success': True,
@@ -425,7 +698,7 @@ def get_idea_details(request, idea_id):
 @csrf_exempt
 @require_http_methods(["POST"])
 @require_auth
-def create_chat_session(request):
+async def create_chat_session(request):
     """Create a new chat session"""
     try:
         user = get_user_from_request(request)
@@ -435,8 +708,8 @@ def create_chat_session(request):
         idea_summary = data.get('idea_summary', '')
         
         # Create session in MongoDB
-        mongodb_service = MongoDBService()
-        session_id = mongodb_service.create_chat_session(
+        mongodb_service = get_async_mongodb_service()
+        session_id = await mongodb_service.create_chat_session(
             user_id=user['email'],
             title=title,
             idea_summary=idea_summary
@@ -464,20 +737,28 @@ def create_chat_session(request):
 @csrf_exempt
 @require_http_methods(["GET"])
 @require_auth
-def get_chat_sessions(request):
+async def get_chat_sessions(request):
     """Get all chat sessions for the authenticated user"""
     try:
         user = get_user_from_request(request)
         
+        limit, cursor = page_params(request.GET, default_limit=50)
+        
         # Get sessions from MongoDB
-        mongodb_service = MongoDBService()
-        sessions = mongodb_service.get_user_chat_sessions(user['email'])
+        mongodb_service = get_async_mongodb_service()
+        sessions, next_cursor = await mongodb_service.get_user_chat_sessions(user['email'], limit=limit, cursor=cursor)
         
         return JsonResponse({
             'success': True,
-            'sessions': sessions
+            'sessions': sessions,
+            'next_cursor': next_cursor
         })
         
+    except InvalidCursor as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=400)
     except Exception as e:
         return JsonResponse({
             'success': False,
@@ -488,14 +769,14 @@ def get_chat_sessions(request):
 @csrf_exempt
 @require_http_methods(["GET"])
 @require_auth
-def get_chat_session(request, session_id):
+async def get_chat_session(request, session_id):
     """Get a specific chat session with its messages"""
     try:
         user = get_user_from_request(request)
         
         # Get session and messages from MongoDB
-        mongodb_service = MongoDBService()
-        session = mongodb_service.get_chat_session(session_id)
+        mongodb_service = get_async_mongodb_service()
+        session = await mongodb_service.get_chat_session(session_id)
         
         if not session:
             return JsonResponse({
@@ -511,14 +792,21 @@ def get_chat_session(request, session_id):
             }, status=403)
         
         # Get messages for this session
-        messages = mongodb_service.get_chat_messages(session_id)
+        limit, cursor = page_params(request.GET, default_limit=100)
+        messages, next_cursor = await mongodb_service.get_chat_messages(session_id, limit=limit, cursor=cursor)
         
         return JsonResponse({
             'success': True,
             'session': session,
-            'messages': messages
+            'messages': messages,
+            'next_cursor': next_cursor
         })
         
+    except InvalidCursor as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=400)
     except Exception as e:
         return JsonResponse({
             'success': False,
@@ -529,15 +817,15 @@ def get_chat_session(request, session_id):
 @csrf_exempt
 @require_http_methods(["PUT"])
 @require_auth
-def update_chat_session(request, session_id):
+async def update_chat_session(request, session_id):
     """Update a chat session (title, status, etc.)"""
     try:
         user = get_user_from_request(request)
         data = json.loads(request.body)
         
         # Verify user owns this session
-        mongodb_service = MongoDBService()
-        session = mongodb_service.get_chat_session(session_id)
+        mongodb_service = get_async_mongodb_service()
+        session = await mongodb_service.get_chat_session(session_id)
         
         if not session:
             return JsonResponse({
@@ -561,7 +849,7 @@ def update_chat_session(request, session_id):
             updates['idea_summary'] = data['idea_summary']
         
         if updates:
-            success = mongodb_service.update_chat_session(session_id, updates)
+            success = await mongodb_service.update_chat_session(session_id, updates)
             if success:
                 return JsonResponse({
                     'success': True,
@@ -588,14 +876,14 @@ def update_chat_session(request, session_id):
 @csrf_exempt
 @require_http_methods(["DELETE"])
 @require_auth
-def delete_chat_session(request, session_id):
+async def delete_chat_session(request, session_id):
     """Delete a chat session and all its messages"""
     try:
         user = get_user_from_request(request)
         
         # Verify user owns this session
-        mongodb_service = MongoDBService()
-        session = mongodb_service.get_chat_session(session_id)
+        mongodb_service = get_async_mongodb_service()
+        session = await mongodb_service.get_chat_session(session_id)
         
         if not session:
             return JsonResponse({
@@ -610,7 +898,7 @@ def delete_chat_session(request, session_id):
             }, status=403)
         
         # Delete session
-        success = mongodb_service.delete_chat_session(session_id)
+        success = await mongodb_service.delete_chat_session(session_id)
         if success:
             return JsonResponse({
                 'success': True,
@@ -632,7 +920,7 @@ def delete_chat_session(request, session_id):
 @csrf_exempt
 @require_http_methods(["POST"])
 @require_auth
-def add_chat_message(request):
+async def add_chat_message(request):
     """Add a new chat message to a session"""
     try:
         data = json.loads(request.body)
@@ -648,8 +936,8 @@ def add_chat_message(request):
             }, status=400)
         
         # Get the chat session
-        mongodb_service = MongoDBService()
-        session = mongodb_service.get_chat_session(session_id)
+        mongodb_service = get_async_mongodb_service()
+        session = await mongodb_service.get_chat_session(session_id)
         if not session:
             return JsonResponse({
                 'success': False,
@@ -657,21 +945,20 @@ def add_chat_message(request):
             }, status=404)
         
         # Verify user owns this session
-        if session.get('user_id') != request.user_id:
+        user = get_user_from_request(request)
+        if session.get('user_id') != user['email']:
             return JsonResponse({
                 'success': False,
                 'error': 'Unauthorized access to chat session'
             }, status=403)
         
         # Add the message
-        message_id = mongodb_service.add_chat_message(
+        message_id = await mongodb_service.add_chat_message(
             session_id=session_id,
             role=role,
             content=content,
             round_number=round_number
         )
-        mongodb_service.close()
-        
         if message_id:
             return JsonResponse({
                 'success': True,
@@ -696,7 +983,7 @@ def add_chat_message(request):
             'error': 'Invalid JSON data'
         }, status=400)
     except Exception as e:
-        print(f"Error adding chat message: {e}")
+        logger.exception("Error adding chat message")
         return JsonResponse({
             'success': False,
             'error': 'Internal server error'
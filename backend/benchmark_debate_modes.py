@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Benchmark per-agent vs panel debate modes: LLM calls, tokens and latency per refine.
+
+Runs offline against the stub LLM provider with a fixed time to first token plus a
+per-output-token cost, so the numbers reflect call counts and token volume
+rather than network conditions.
+
+Usage: python benchmark_debate_modes.py [--runs 3] [--time-scale 0.05]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+# Add the project directory to the Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Set up Django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'focalai_backend.settings')
+os.environ.setdefault('GOOGLE_CLIENT_ID', 'benchmark')
+os.environ.setdefault('GOOGLE_SECRET', 'benchmark')
+os.environ.setdefault('GEMINI_API_KEY', 'benchmark')
+os.environ['LLM_CACHE_ENABLED'] = 'False'
+import django
+django.setup()
+
+from api.services.multi_agent import MultiAgentSystem, DEBATE_MODE_PER_AGENT, DEBATE_MODE_PANEL
+from api.services.llm_providers import StubChatModel, LLM_PROVIDER_STUB
+from api.services.quota import LocalQuotaLedger
+
+# Gemini 1.5 Flash-like timing: time to first token plus streaming throughput
+CALL_OVERHEAD_SECONDS = 0.6
+SECONDS_PER_OUTPUT_TOKEN = 0.006
+AGENT_RESPONSE_TOKENS = 340
+
+
+def run_mode(debate_mode, runs, time_scale):
+    """Run refine_requirements several times in one mode and average the measurements"""
+    totals = {'calls': 0, 'input_tokens': 0, 'output_tokens': 0, 'seconds': 0.0}
+    for _ in range(runs):
+        agent_system = MultiAgentSystem(
+            debate_mode=debate_mode,
+            min_rounds=4,
+            max_rounds=4,
+            use_cache=False,
+            quota_ledger=LocalQuotaLedger(daily_limit=10_000),
+            llm_provider=LLM_PROVIDER_STUB
+        )
+        llm = StubChatModel(
+            latency_ms=CALL_OVERHEAD_SECONDS * 1000 * time_scale,
+            tokens_per_second=1 / (SECONDS_PER_OUTPUT_TOKEN * time_scale),
+            response_tokens=AGENT_RESPONSE_TOKENS
+        )
+        agent_system.llm = llm
+
+        started = time.perf_counter()
+        result = agent_system.refine_requirements("A mobile app that helps people find and book local fitness classes")
+        elapsed = (time.perf_counter() - started) / time_scale
+
+        assert result['success'] and not result['used_fallback'], result.get('error')
+        totals['calls'] += llm.calls
+        totals['input_tokens'] += llm.input_tokens
+        totals['output_tokens'] += llm.output_tokens
+        totals['seconds'] += elapsed
+
+    return {key: value / runs for key, value in totals.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--time-scale', type=float, default=0.05,
+                        help='Fraction of simulated latency actually slept; results are scaled back up')
+    args = parser.parse_args()
+
+    print("🧪 Debate mode benchmark (stub LLM, 4 rounds + aggregation)")
+    print("=" * 72)
+    print(f"{'mode':<12}{'LLM calls':>12}{'input tokens':>16}{'output tokens':>16}{'latency (s)':>16}")
+    for debate_mode in (DEBATE_MODE_PER_AGENT, DEBATE_MODE_PANEL):
+        stats = run_mode(debate_mode, args.runs, args.time_scale)
+        print(f"{debate_mode:<12}{stats['calls']:>12.0f}{stats['input_tokens']:>16.0f}"
+              f"{stats['output_tokens']:>16.0f}{stats['seconds']:>16.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for PRD section parsing on large PRDs.
+
+Compares the original line-by-line substring parser with the compiled-regex
+PrdSectionParser, both on the whole text and fed in small chunks the way the
+aggregation stream delivers it. Results are checked to agree before timing.
+
+Usage: python benchmark_prd_parser.py [--lines-per-section 2000] [--repeat 5] [--chunk-chars 16]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+# Add the project directory to the Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from api.services.prd_parser import PrdSectionParser, parse_prd_sections
+
+HEADERS = (
+    '1. OVERVIEW:',
+    '2. PROBLEM STATEMENT:',
+    '3. DEBATE SUMMARY (AGENT PERSPECTIVES):',
+    '4. OBJECTIVES:',
+    '5. SCOPE:',
+    '6. REQUIREMENTS:',
+    '7. USER STORIES:',
+    '8. TRADE-OFFS & DECISIONS:',
+    '9. NEXT STEPS:',
+    '10. SUCCESS METRICS:',
+)
+
+WORDS = "users booking studio calendar search latency payments release onboarding metrics retention class".split()
+
+
+def legacy_parse_prd_sections(prd_text):
+    """The parser this benchmark replaced, kept here as the baseline"""
+    sections = {
+        'overview': '', 'problem_statement': '', 'debate_summary': '', 'objectives': '', 'scope': '',
+        'requirements': '', 'user_stories': '', 'trade_offs_decisions': '', 'next_steps': '', 'success_metrics': ''
+    }
+    current_section = None
+    for line in prd_text.split('\n'):
+        line = line.strip()
+        if '1. OVERVIEW' in line.upper():
+            current_section = 'overview'
+        elif '2. PROBLEM STATEMENT' in line.upper():
+            current_section = 'problem_statement'
+        elif '3. DEBATE SUMMARY' in line.upper():
+            current_section = 'debate_summary'
+        elif '4. OBJECTIVES' in line.upper():
+            current_section = 'objectives'
+        elif '5. SCOPE' in line.upper():
+            current_section = 'scope'
+        elif '6. REQUIREMENTS' in line.upper():
+            current_section = 'requirements'
+        elif '7. USER STORIES' in line.upper():
+            current_section = 'user_stories'
+        elif '8. TRADE-OFFS' in line.upper() or '8. TRADE OFFS' in line.upper():
+            current_section = 'trade_offs_decisions'
+        elif '9. NEXT STEPS' in line.upper():
+            current_section = 'next_steps'
+        elif '10. SUCCESS METRICS' in line.upper():
+            current_section = 'success_metrics'
+        elif current_section and line:
+            sections[current_section] += line + '\n'
+    return sections
+
+
+def build_prd(lines_per_section, seed=0):
+    """A PRD with every section header followed by lines_per_section bullet lines"""
+    rng = random.Random(seed)
+    parts = []
+    for header in HEADERS:
+        parts.append(header)
+        for _ in range(lines_per_section):
+            parts.append("- " + " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 16))).capitalize() + ".")
+        parts.append("")
+    return "\n".join(parts)
+
+
+def parse_streamed(prd_text, chunk_chars):
+    """Feed the text to PrdSectionParser in fixed-size chunks"""
+    parser = PrdSectionParser()
+    for start in range(0, len(prd_text), chunk_chars):
+        parser.feed(prd_text[start:start + chunk_chars])
+    parser.close()
+    return parser.sections
+
+
+def best_of(repeat, func, *args):
+    """Fastest of repeat runs, in seconds"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines-per-section', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--chunk-chars', type=int, default=16,
+                        help='Chunk size for the streamed run; LLM stream chunks are typically a few tokens')
+    args = parser.parse_args()
+
+    prd_text = build_prd(args.lines_per_section)
+    expected = legacy_parse_prd_sections(prd_text)
+    assert parse_prd_sections(prd_text) == expected, "parsers disagree"
+    assert parse_streamed(prd_text, args.chunk_chars) == expected, "streamed parse disagrees"
+
+    megabytes = len(prd_text.encode('utf-8')) / 1_000_000
+    runs = (
+        ('legacy', legacy_parse_prd_sections, (prd_text,)),
+        ('single pass', parse_prd_sections, (prd_text,)),
+        (f'streamed ({args.chunk_chars} chars)', parse_streamed, (prd_text, args.chunk_chars)),
+    )
+
+    print(f"🧪 PRD parser benchmark ({prd_text.count(chr(10)) + 1} lines, {megabytes:.2f} MB, best of {args.repeat})")
+    print("=" * 56)
+    print(f"{'parser':<24}{'time (ms)':>16}{'MB/s':>16}")
+    for name, func, func_args in runs:
+        seconds = best_of(args.repeat, func, *func_args)
+        print(f"{name:<24}{seconds * 1000:>16.1f}{megabytes / seconds:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -52,6 +52,7 @@ def check_quota_status():
     print("\n🔧 Current System Features:")
     print("   ✅ Automatic fallback responses when quota exceeded")
     print("   ✅ API call tracking and quota management")
+    print("   ✅ Shared daily quota ledger across workers (GEMINI_DAILY_QUOTA, llm_quota collection)")
     print("   ✅ User-friendly error messages")
     print("   ✅ Graceful degradation to continue working")
 
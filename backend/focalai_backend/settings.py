@@ -54,6 +54,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics_middleware.request_metrics_middleware',
+    'api.logging_middleware.request_logging_middleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -95,6 +97,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'focalai_backend.wsgi.application'
+ASGI_APPLICATION = 'focalai_backend.asgi.application'
 
 
 # Database
@@ -113,13 +116,165 @@ WSGI_APPLICATION = 'focalai_backend.wsgi.application'
 MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
 MONGODB_DB_NAME = os.getenv('MONGODB_DB_NAME', 'focalai')
 
+# Connection pool sizing for the process-wide MongoClient
+MONGODB_MAX_POOL_SIZE = int(os.getenv('MONGODB_MAX_POOL_SIZE', '10'))
+MONGODB_MIN_POOL_SIZE = int(os.getenv('MONGODB_MIN_POOL_SIZE', '0'))
+MONGODB_MAX_IDLE_TIME_MS = int(os.getenv('MONGODB_MAX_IDLE_TIME_MS')) if os.getenv('MONGODB_MAX_IDLE_TIME_MS') else None
+
+# Commit each refine's writes in one multi-document transaction; falls back to plain bulk writes
+# on its own when the deployment is a standalone mongod without transaction support
+MONGODB_USE_TRANSACTIONS = os.getenv('MONGODB_USE_TRANSACTIONS', 'True').lower() == 'true'
+
+# 'bucketed' stores each iteration's debate as one debate_iterations document; 'per_message' keeps
+# one debates document per agent turn. `manage.py migrate_debates` moves debates saved per turn into buckets
+DEBATE_STORAGE = os.getenv('DEBATE_STORAGE', 'bucketed')
+
 # Google OAuth Configuration
 GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID', '')
 GOOGLE_CLIENT_SECRET = os.getenv('GOOGLE_SECRET', '')
 
+# Where ID-token signing certs and the tokeninfo fallback are fetched (overridden by the load test)
+GOOGLE_CERTS_URL = os.getenv('GOOGLE_CERTS_URL', 'https://www.googleapis.com/oauth2/v1/certs')
+GOOGLE_TOKENINFO_URL = os.getenv('GOOGLE_TOKENINFO_URL', 'https://oauth2.googleapis.com/tokeninfo')
+
 # Gemini API Configuration
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', '')
 
+# LLM provider for the debate engine: 'gemini', or 'stub' for offline load testing
+LLM_PROVIDER = os.getenv('LLM_PROVIDER', 'gemini')
+
+# Stub provider: time to first token (fixed, uniform, exponential or lognormal around
+# LLM_STUB_LATENCY_MS), output throughput, response length and injected failure rates
+LLM_STUB_LATENCY_MS = float(os.getenv('LLM_STUB_LATENCY_MS', '600'))
+LLM_STUB_LATENCY_JITTER_MS = float(os.getenv('LLM_STUB_LATENCY_JITTER_MS', '0'))
+LLM_STUB_LATENCY_DISTRIBUTION = os.getenv('LLM_STUB_LATENCY_DISTRIBUTION', 'fixed')
+LLM_STUB_TOKENS_PER_SECOND = float(os.getenv('LLM_STUB_TOKENS_PER_SECOND', '150'))
+LLM_STUB_RESPONSE_TOKENS = int(os.getenv('LLM_STUB_RESPONSE_TOKENS', '250'))
+LLM_STUB_ERROR_RATE = float(os.getenv('LLM_STUB_ERROR_RATE', '0'))
+LLM_STUB_RATE_LIMIT_RATE = float(os.getenv('LLM_STUB_RATE_LIMIT_RATE', '0'))
+LLM_STUB_SEED = int(os.getenv('LLM_STUB_SEED', '0'))
+
+# Maximum number of agents queried concurrently within a debate round
+DEBATE_MAX_CONCURRENCY = int(os.getenv('DEBATE_MAX_CONCURRENCY', '5'))
+
+# 'per_agent' makes one LLM call per agent per round; 'panel' answers for every agent in one structured call
+DEBATE_MODE = os.getenv('DEBATE_MODE', 'per_agent')
+
+# 'structured' has the aggregator return schema-validated JSON with one field per PRD section;
+# 'text' asks for free-form numbered sections that are parsed afterwards. Streaming endpoints
+# always aggregate as text so the PRD reaches the client token by token
+PRD_FORMAT = os.getenv('PRD_FORMAT', 'structured')
+
+# Debate round bounds; between them a debate stops once the mean round-over-round change
+# in agent responses (1 - shingled Jaccard similarity) drops below the threshold
+DEBATE_MIN_ROUNDS = int(os.getenv('DEBATE_MIN_ROUNDS', '2'))
+DEBATE_MAX_ROUNDS = int(os.getenv('DEBATE_MAX_ROUNDS', '4'))
+DEBATE_CONVERGENCE_THRESHOLD = float(os.getenv('DEBATE_CONVERGENCE_THRESHOLD', '0.35'))
+
+# Approximate token budget for the debate history included in each agent prompt
+DEBATE_CONTEXT_TOKEN_BUDGET = int(os.getenv('DEBATE_CONTEXT_TOKEN_BUDGET', '3000'))
+
+# Shared daily Gemini quota ledger ('mongo' across workers, 'local' for single-process development)
+GEMINI_DAILY_QUOTA = int(os.getenv('GEMINI_DAILY_QUOTA', '50'))
+LLM_QUOTA_BACKEND = os.getenv('LLM_QUOTA_BACKEND', 'mongo')
+
+# LLM response cache (in-process LRU backed by a Mongo collection with a TTL index)
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'True').lower() == 'true'
+LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', '512'))
+LLM_CACHE_TTL_SECONDS = int(os.getenv('LLM_CACHE_TTL_SECONDS', str(7 * 24 * 60 * 60)))
+
+# Read cache for idea details, idea iterations and first pages of chat session lists: an in-process
+# LRU bounded in bytes, whose entries expire after READ_CACHE_LOCAL_TTL_SECONDS so other workers'
+# writes show up, optionally backed by a tier shared between workers. Writes invalidate both tiers.
+READ_CACHE_ENABLED = os.getenv('READ_CACHE_ENABLED', 'True').lower() == 'true'
+READ_CACHE_MAX_BYTES = int(os.getenv('READ_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+READ_CACHE_MAX_ENTRY_BYTES = int(os.getenv('READ_CACHE_MAX_ENTRY_BYTES', str(1024 * 1024)))
+READ_CACHE_LOCAL_TTL_SECONDS = int(os.getenv('READ_CACHE_LOCAL_TTL_SECONDS', '10'))
+READ_CACHE_TTL_SECONDS = int(os.getenv('READ_CACHE_TTL_SECONDS', '300'))
+
+# Shared read cache tier: a redis:// URL, 'local' for an in-process stand-in (development and tests),
+# or empty for none
+READ_CACHE_SHARED_URL = os.getenv('READ_CACHE_SHARED_URL', '')
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+}
+if READ_CACHE_SHARED_URL == 'local':
+    CACHES['read_cache'] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'read-cache',
+    }
+elif READ_CACHE_SHARED_URL:
+    CACHES['read_cache'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': READ_CACHE_SHARED_URL,
+        'KEY_PREFIX': 'focalai-read',
+    }
+
+# Refine job queue (see `python manage.py run_job_worker`)
+JOB_WORKER_PROCESSES = int(os.getenv('JOB_WORKER_PROCESSES', '2'))
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv('JOB_POLL_INTERVAL_SECONDS', '1.0'))
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '600'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '2'))
+JOB_STREAM_POLL_SECONDS = float(os.getenv('JOB_STREAM_POLL_SECONDS', '1.0'))
+JOB_STREAM_TIMEOUT_SECONDS = int(os.getenv('JOB_STREAM_TIMEOUT_SECONDS', '300'))
+
+# Credit ledger entries are written to credit_transactions once this many are pending on a user
+CREDIT_OUTBOX_FLUSH_SIZE = int(os.getenv('CREDIT_OUTBOX_FLUSH_SIZE', '20'))
+
+# Bearer token Prometheus must send to scrape /metrics; unset leaves the endpoint open
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Structured logging: JSON lines written by a background thread. LOG_SAMPLE_RATE keeps that
+# fraction of requests' info/debug lines (warnings and errors are always kept) and
+# LOG_MAX_FIELD_CHARS caps the length of any one logged field
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '1.0'))
+LOG_MAX_FIELD_CHARS = int(os.getenv('LOG_MAX_FIELD_CHARS', '512'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'request_context': {
+            '()': 'api.structured_logging.RequestContextFilter',
+        },
+        'sampling': {
+            '()': 'api.structured_logging.SamplingFilter',
+            'rate': LOG_SAMPLE_RATE,
+        },
+    },
+    'formatters': {
+        'json': {
+            '()': 'api.structured_logging.JsonFormatter',
+            'max_field_chars': LOG_MAX_FIELD_CHARS,
+        },
+    },
+    'handlers': {
+        'queue': {
+            '()': 'api.structured_logging.BackgroundQueueHandler',
+            'formatter': 'json',
+            'filters': ['request_context', 'sampling'],
+        },
+    },
+    'loggers': {
+        'api': {
+            'handlers': ['queue'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
+        'django': {
+            'handlers': ['queue'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
+# require_auth caches verified tokens until they expire and user documents for a short TTL
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv('AUTH_CACHE_MAX_ENTRIES', '1024'))
+AUTH_USER_CACHE_TTL_SECONDS = int(os.getenv('AUTH_USER_CACHE_TTL_SECONDS', '30'))
+LAST_LOGIN_WRITE_INTERVAL_SECONDS = int(os.getenv('LAST_LOGIN_WRITE_INTERVAL_SECONDS', '300'))
+
 # Validate required environment variables
 if not MONGODB_URI:
     raise ValueError("MONGODB_URI environment variable is required")
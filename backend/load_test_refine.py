@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test: refine -> feedback -> history -> chat against local stand-ins.
+
+Boots the Django ASGI application in-process and drives it with concurrent
+simulated users. Nothing leaves the machine:
+  - the LLM is the stub provider (LLM_STUB_* latency, throughput and failures)
+  - ID tokens are signed by a local key that a local certs/tokeninfo server publishes
+  - data goes to a throwaway database on a local MongoDB, dropped afterwards
+    (--in-memory starts a temporary mongod through pymongo_inmemory instead;
+    mongomock cannot serve the async views, which use AsyncMongoClient)
+
+The report lists p50/p95/p99 latency, requests per second and MongoDB commands
+per request for every step. Save it with --output and pass an earlier report
+to --compare to see how a commit moved the numbers.
+
+Usage: python load_test_refine.py [--users 10] [--iterations 2] [--output report.json] [--compare baseline.json]
+"""
+
+import argparse
+import asyncio
+import contextvars
+import json
+import math
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from google.auth import crypt
+from google.auth import jwt as google_jwt
+
+# Add the project directory to the Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+CLIENT_ID = 'load-test-client'
+KEY_ID = 'load-test-key'
+STEPS = ('refine', 'feedback', 'history', 'chat_create', 'chat_message', 'chat_list', 'chat_get')
+IDEAS = (
+    "A mobile app that helps people find and book local fitness classes",
+    "A shared grocery list that plans meals around what is already in the fridge",
+    "A tool that turns customer support tickets into a prioritized product backlog",
+    "A marketplace connecting freelance translators with small e-commerce shops",
+)
+
+
+# Stand-in for Google's certs and tokeninfo endpoints
+class _SigningKey:
+    """RSA key that signs the load test's ID tokens"""
+
+    def __init__(self):
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.private_pem = key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption()
+        )
+        self.public_pem = key.public_key().public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo
+        ).decode()
+        self.signer = crypt.RSASigner.from_string(self.private_pem, key_id=KEY_ID)
+
+    def id_token(self, email):
+        now = int(time.time())
+        payload = {
+            'iss': 'https://accounts.google.com',
+            'aud': CLIENT_ID,
+            'sub': email,
+            'email': email,
+            'name': email.split('@')[0],
+            'picture': '',
+            'iat': now,
+            'exp': now + 3600,
+        }
+        return google_jwt.encode(self.signer, payload).decode()
+
+
+def start_google_stub(signing_key):
+    """Serve /certs and /tokeninfo on a free local port; returns the base URL"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == '/certs':
+                self._send(200, {KEY_ID: signing_key.public_pem})
+            elif url.path == '/tokeninfo':
+                token = parse_qs(url.query).get('id_token', [''])[0]
+                try:
+                    self._send(200, google_jwt.decode(token, certs={KEY_ID: signing_key.public_pem}, audience=CLIENT_ID))
+                except ValueError:
+                    self._send(400, {'error': 'invalid_token'})
+            else:
+                self._send(404, {})
+
+        def _send(self, status, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Cache-Control', 'public, max-age=3600')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# MongoDB command counting, attributed to the step that issued the command
+_current_sample = contextvars.ContextVar('current_sample', default=None)
+
+
+def register_command_counter():
+    """Count every MongoDB command against the request in flight; call before any client exists"""
+    from pymongo import monitoring
+
+    class CommandCounter(monitoring.CommandListener):
+        def started(self, event):
+            sample = _current_sample.get()
+            if sample is not None:
+                sample['mongo_ops'] += 1
+
+        def succeeded(self, event):
+            pass
+
+        def failed(self, event):
+            pass
+
+    monitoring.register(CommandCounter())
+
+
+# Load generation
+async def timed_request(client, samples, step, method, path, token, body=None):
+    """Issue one request, recording latency, status and Mongo commands; returns the JSON body"""
+    sample = {'step': step, 'mongo_ops': 0}
+    context_token = _current_sample.set(sample)
+    started = time.perf_counter()
+    try:
+        kwargs = {'headers': {'Authorization': f'Bearer {token}'}}
+        if body is not None:
+            kwargs.update(data=json.dumps(body), content_type='application/json')
+        response = await getattr(client, method)(path, **kwargs)
+        sample['status'] = response.status_code
+        try:
+            return json.loads(response.content)
+        except ValueError:
+            return {}
+    except Exception as e:
+        sample['status'] = 'exception'
+        sample['error'] = str(e)
+        return {}
+    finally:
+        sample['seconds'] = time.perf_counter() - started
+        _current_sample.reset(context_token)
+        samples.append(sample)
+
+
+async def run_user(client, samples, user_number, token, iterations):
+    """Drive one user through the refine -> feedback -> history -> chat flow"""
+    for iteration in range(iterations):
+        idea = f"{IDEAS[(user_number + iteration) % len(IDEAS)]} (user {user_number}, pass {iteration})"
+
+        refined = await timed_request(client, samples, 'refine', 'post', '/api/refine/', token, {'idea': idea})
+        idea_id = refined.get('idea_id')
+        if idea_id:
+            await timed_request(client, samples, 'feedback', 'post', '/api/refine-feedback/', token,
+                                {'idea_id': idea_id, 'feedback': 'Focus the first release on the core workflow'})
+
+        await timed_request(client, samples, 'history', 'get', '/api/history/', token)
+
+        created = await timed_request(client, samples, 'chat_create', 'post', '/api/chat/sessions/', token,
+                                      {'title': idea[:40], 'idea_summary': idea})
+        session_id = created.get('session_id')
+        if session_id:
+            await timed_request(client, samples, 'chat_message', 'post', '/api/chat/sessions/messages/', token,
+                                {'session_id': session_id, 'role': 'user', 'content': idea})
+        await timed_request(client, samples, 'chat_list', 'get', '/api/chat/sessions/list/', token)
+        if session_id:
+            await timed_request(client, samples, 'chat_get', 'get', f'/api/chat/sessions/{session_id}/', token)
+
+
+async def run_load(tokens, iterations):
+    """Run every user concurrently; returns (samples, wall_seconds)"""
+    from django.test import AsyncClient
+
+    client = AsyncClient()
+    samples = []
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        run_user(client, samples, user_number, token, iterations)
+        for user_number, token in enumerate(tokens)
+    ))
+    return samples, time.perf_counter() - started
+
+
+# Reporting
+def percentile(values, pct):
+    """Nearest-rank percentile of an unsorted list"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def summarize(samples, wall_seconds):
+    """Aggregate samples into per-step and overall statistics"""
+    steps = {}
+    for step in STEPS:
+        step_samples = [sample for sample in samples if sample['step'] == step]
+        if not step_samples:
+            continue
+        latencies_ms = [sample['seconds'] * 1000 for sample in step_samples]
+        steps[step] = {
+            'requests': len(step_samples),
+            'errors': sum(1 for sample in step_samples if sample['status'] == 'exception' or sample['status'] >= 400),
+            'p50_ms': round(percentile(latencies_ms, 50), 1),
+            'p95_ms': round(percentile(latencies_ms, 95), 1),
+            'p99_ms': round(percentile(latencies_ms, 99), 1),
+            'mongo_ops_per_request': round(sum(sample['mongo_ops'] for sample in step_samples) / len(step_samples), 2),
+        }
+    return {
+        'requests': len(samples),
+        'errors': sum(step['errors'] for step in steps.values()),
+        'wall_seconds': round(wall_seconds, 2),
+        'requests_per_second': round(len(samples) / wall_seconds, 2) if wall_seconds else 0.0,
+        'mongo_ops_per_request': round(sum(sample['mongo_ops'] for sample in samples) / len(samples), 2) if samples else 0.0,
+        'steps': steps,
+    }
+
+
+def git_revision():
+    """Short commit hash of the working tree, if it is a git checkout"""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+
+def print_report(report, baseline=None):
+    """Print the per-step table, with deltas against a baseline report when given"""
+    def delta(current, previous):
+        if previous in (None, 0):
+            return ''
+        return f" ({(current - previous) / previous * 100:+.0f}%)"
+
+    summary = report['summary']
+    base_summary = baseline['summary'] if baseline else {}
+    print(f"\n📊 Load test @ {report['revision'] or 'unknown revision'}: {report['config']['users']} users x "
+          f"{report['config']['iterations']} flows")
+    if baseline:
+        print(f"   compared with {baseline.get('revision') or 'baseline'}")
+    print("=" * 96)
+    print(f"{'step':<14}{'requests':>10}{'errors':>8}{'p50 (ms)':>18}{'p95 (ms)':>18}{'p99 (ms)':>18}{'mongo ops':>10}")
+    for step, stats in summary['steps'].items():
+        base = base_summary.get('steps', {}).get(step, {})
+        print(f"{step:<14}{stats['requests']:>10}{stats['errors']:>8}"
+              f"{stats['p50_ms']:>10.1f}{delta(stats['p50_ms'], base.get('p50_ms')):>8}"
+              f"{stats['p95_ms']:>10.1f}{delta(stats['p95_ms'], base.get('p95_ms')):>8}"
+              f"{stats['p99_ms']:>10.1f}{delta(stats['p99_ms'], base.get('p99_ms')):>8}"
+              f"{stats['mongo_ops_per_request']:>10.2f}")
+    print("=" * 96)
+    print(f"Throughput: {summary['requests_per_second']:.2f} req/s"
+          f"{delta(summary['requests_per_second'], base_summary.get('requests_per_second'))} "
+          f"over {summary['wall_seconds']:.1f}s, {summary['requests']} requests, {summary['errors']} errors, "
+          f"{summary['mongo_ops_per_request']:.2f} Mongo ops/request")
+
+
+def configure_environment(args, certs_base_url, mongodb_uri, db_name):
+    """Point settings at the local stand-ins before Django is set up"""
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'focalai_backend.settings'
+    os.environ['MONGODB_URI'] = mongodb_uri
+    os.environ['MONGODB_DB_NAME'] = db_name
+    os.environ['GOOGLE_CLIENT_ID'] = CLIENT_ID
+    os.environ.setdefault('GOOGLE_SECRET', 'load-test')
+    os.environ.setdefault('GEMINI_API_KEY', 'load-test')
+    os.environ['GOOGLE_CERTS_URL'] = f'{certs_base_url}/certs'
+    os.environ['GOOGLE_TOKENINFO_URL'] = f'{certs_base_url}/tokeninfo'
+    os.environ['ALLOWED_HOSTS'] = 'testserver,localhost'
+    os.environ['LLM_PROVIDER'] = 'stub'
+    os.environ['LLM_QUOTA_BACKEND'] = 'local'
+    os.environ['GEMINI_DAILY_QUOTA'] = '1000000'
+    os.environ['LLM_CACHE_ENABLED'] = 'False'
+    os.environ['LLM_STUB_LATENCY_MS'] = str(args.llm_latency_ms)
+    os.environ['LLM_STUB_LATENCY_JITTER_MS'] = str(args.llm_jitter_ms)
+    os.environ['LLM_STUB_LATENCY_DISTRIBUTION'] = args.llm_distribution
+    os.environ['LLM_STUB_TOKENS_PER_SECOND'] = str(args.llm_tokens_per_second)
+    os.environ['LLM_STUB_ERROR_RATE'] = str(args.llm_error_rate)
+    os.environ['LLM_STUB_RATE_LIMIT_RATE'] = str(args.llm_rate_limit_rate)
+    os.environ['LLM_STUB_SEED'] = str(args.seed)
+
+
+def seed_users(count):
+    """Create the load-test users with enough credits for every flow"""
+    from api.services.mongodb_service import get_mongodb_service
+
+    mongodb_service = get_mongodb_service()
+    emails = [f'load-user-{n}@example.com' for n in range(count)]
+    for email in emails:
+        if not mongodb_service.get_user_by_email(email):
+            mongodb_service.create_user({'email': email, 'name': email.split('@')[0]})
+    mongodb_service.users_collection.update_many({'email': {'$in': emails}}, {'$set': {'credits': 1_000_000}})
+    return emails
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10, help='Concurrent simulated users')
+    parser.add_argument('--iterations', type=int, default=2, help='Flows each user runs back to back')
+    parser.add_argument('--mongodb-uri', default=os.getenv('LOAD_TEST_MONGODB_URI', 'mongodb://localhost:27017/'))
+    parser.add_argument('--in-memory', action='store_true', help='Start a temporary mongod with pymongo_inmemory')
+    parser.add_argument('--keep-db', action='store_true', help='Keep the load-test database for inspection')
+    parser.add_argument('--llm-latency-ms', type=float, default=600, help='Stub LLM time to first token')
+    parser.add_argument('--llm-jitter-ms', type=float, default=0)
+    parser.add_argument('--llm-distribution', default='fixed', choices=('fixed', 'uniform', 'exponential', 'lognormal'))
+    parser.add_argument('--llm-tokens-per-second', type=float, default=150)
+    parser.add_argument('--llm-error-rate', type=float, default=0.0)
+    parser.add_argument('--llm-rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the report as JSON to this path')
+    parser.add_argument('--compare', help='Earlier JSON report to compare against')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    mongod = None
+    mongodb_uri = args.mongodb_uri
+    if args.in_memory:
+        try:
+            from pymongo_inmemory import Mongod
+        except ImportError:
+            parser.error('--in-memory needs pymongo_inmemory (pip install pymongo_inmemory)')
+        mongod = Mongod()
+        mongod.start()
+        mongodb_uri = mongod.connection_string
+
+    signing_key = _SigningKey()
+    db_name = f'focalai_load_test_{os.getpid()}'
+    configure_environment(args, start_google_stub(signing_key), mongodb_uri, db_name)
+
+    import django
+    django.setup()
+    from django.core.management import call_command
+
+    register_command_counter()
+    try:
+        call_command('init_db')
+        emails = seed_users(args.users)
+        tokens = [signing_key.id_token(email) for email in emails]
+
+        print(f"🚀 {args.users} users x {args.iterations} flows against {db_name}")
+        samples, wall_seconds = asyncio.run(run_load(tokens, args.iterations))
+
+        report = {
+            'revision': git_revision(),
+            'created_at': datetime.utcnow().isoformat(),
+            'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+            'summary': summarize(samples, wall_seconds),
+        }
+        print_report(report, baseline)
+
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"💾 Report written to {args.output}")
+    finally:
+        if not args.keep_db:
+            from api.services.mongodb_service import get_mongo_client
+            try:
+                get_mongo_client().drop_database(db_name)
+            except Exception as e:
+                print(f"⚠️ Warning: could not drop {db_name}: {str(e)}")
+        if mongod is not None:
+            mongod.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,84 +1,181 @@
 #!/usr/bin/env python3
 """
-Test script to verify the new PRD format works correctly.
+Tests for the PRD section parser and the structured PRD schema.
+
+Usage: python test_prd_format.py
 """
 
+import json
 import os
+import random
 import sys
-import django
+import unittest
 
 # Add the project directory to the Python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-# Set up Django
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'focalai_backend.settings')
-django.setup()
-
-from api.services.multi_agent import MultiAgentSystem
-
-def test_prd_format():
-    """Test the new PRD format"""
-    
-    print("🧪 Testing PRD Format")
-    print("=" * 50)
-    
-    # Create a test idea
-    test_idea = "A mobile app that helps people find and book local fitness classes"
-    
-    # Initialize the multi-agent system
-    agent_system = MultiAgentSystem()
-    
-    # Force quota exhaustion by setting max calls to 0
-    agent_system.max_api_calls = 0
-    agent_system.api_calls_made = 0
-    
-    print(f"📝 Test Idea: {test_idea}")
-    print(f"🔧 Max API calls: {agent_system.max_api_calls}")
-    print(f"📊 Current API calls: {agent_system.api_calls_made}")
-    
-    # Test the refinement
-    print("\n🔄 Running PRD generation...")
-    result = agent_system.refine_requirements(test_idea)
-    
-    print(f"\n✅ Result success: {result['success']}")
-    print(f"🔄 Used fallback: {result.get('used_fallback', False)}")
-    print(f"📊 API calls made: {result.get('api_calls_made', 0)}")
-    
-    if result['success']:
-        print(f"\n📋 PRD Content Preview:")
-        prd_content = result['prd_content']
-        print(prd_content[:1000] + "..." if len(prd_content) > 1000 else prd_content)
-        
-        # Check for PRD sections
-        sections_to_check = [
-            '1. OVERVIEW',
-            '2. PROBLEM STATEMENT', 
-            '3. DEBATE SUMMARY',
-            '4. OBJECTIVES',
-            '5. SCOPE',
-            '6. REQUIREMENTS',
-            '7. USER STORIES',
-            '8. TRADE-OFFS',
-            '9. NEXT STEPS',
-            '10. SUCCESS METRICS'
-        ]
-        
-        print(f"\n🔍 PRD Section Check:")
-        for section in sections_to_check:
-            if section in prd_content.upper():
-                print(f"  ✅ {section}")
-            else:
-                print(f"  ❌ {section} - Missing")
-        
-        print(f"\n🤖 Debate Log ({len(result['debate_log'])} entries):")
-        for i, debate in enumerate(result['debate_log'][:3]):  # Show first 3
-            print(f"  {i+1}. {debate['agent']}: {debate['response'][:100]}...")
-            if debate.get('fallback'):
-                print(f"     (Fallback response)")
-    else:
-        print(f"❌ Error: {result.get('error', 'Unknown error')}")
-    
-    print("\n🎯 PRD format test completed!")
+from api.services.prd_parser import SECTION_KEYS, PrdSectionParser, parse_prd_sections
+from api.services.prd_schema import PrdDocument, parse_structured_prd, render_prd_content
+
+PLAIN_PRD = """Based on the stakeholder analysis of: a fitness class booking app...
+
+1. OVERVIEW:
+A marketplace for local fitness classes.
+
+2. PROBLEM STATEMENT:
+Finding a class means checking several studio websites.
+
+3. DEBATE SUMMARY (AGENT PERSPECTIVES):
+Product Manager: Start with one city.
+Engineering Lead: Reuse studio calendars.
+
+4. OBJECTIVES:
+- Book a class in under a minute
+
+5. SCOPE:
+- In scope: search and booking
+- Out of scope: payments to instructors
+
+6. REQUIREMENTS:
+- Functional: search by time and place
+- Non-functional: search responds in 300ms
+
+7. USER STORIES:
+- As a member, I want to filter by distance, so that I can walk to class
+
+8. TRADE-OFFS & DECISIONS:
+- Payments deferred to the second release
+
+9. NEXT STEPS:
+- Interview ten studio owners
+
+10. SUCCESS METRICS:
+- 1,000 bookings in the first month
+"""
+
+
+class ParsePrdSectionsTests(unittest.TestCase):
+    def test_plain_headers(self):
+        sections = parse_prd_sections(PLAIN_PRD)
+
+        self.assertEqual(list(sections), list(SECTION_KEYS))
+        self.assertTrue(all(sections.values()))
+        self.assertEqual(sections['overview'], "A marketplace for local fitness classes.\n")
+        self.assertEqual(sections['debate_summary'], "Product Manager: Start with one city.\nEngineering Lead: Reuse studio calendars.\n")
+        self.assertEqual(sections['trade_offs_decisions'], "- Payments deferred to the second release\n")
+        self.assertEqual(sections['success_metrics'], "- 1,000 bookings in the first month\n")
+
+    def test_markdown_and_bold_headers(self):
+        prd = (
+            "## 1. Overview\nOverview text\n"
+            "### 2. **Problem Statement**\nProblem text\n"
+            "**6. Requirements:**\nRequirements text\n"
+            "**8. Trade-offs & Decisions**\nTrade-off text\n"
+            "## 10) Success Metrics:\nMetrics text\n"
+        )
+
+        sections = parse_prd_sections(prd)
+
+        self.assertEqual(sections['overview'], "Overview text\n")
+        self.assertEqual(sections['problem_statement'], "Problem text\n")
+        self.assertEqual(sections['requirements'], "Requirements text\n")
+        self.assertEqual(sections['trade_offs_decisions'], "Trade-off text\n")
+        self.assertEqual(sections['success_metrics'], "Metrics text\n")
+
+    def test_text_after_the_header_colon_belongs_to_the_section(self):
+        sections = parse_prd_sections("1. OVERVIEW: One line summary.\nMore detail.\n**4. Objectives:** Grow bookings")
+
+        self.assertEqual(sections['overview'], "One line summary.\nMore detail.\n")
+        self.assertEqual(sections['objectives'], "Grow bookings\n")
+
+    def test_list_items_and_mentions_are_not_headers(self):
+        prd = (
+            "6. REQUIREMENTS:\n"
+            "5. Scope creep: keep the first release small\n"
+            "See 9. Next Steps for the timeline\n"
+            "3. Overview of the calendar sync\n"
+        )
+
+        sections = parse_prd_sections(prd)
+
+        self.assertEqual(sections['requirements'], (
+            "5. Scope creep: keep the first release small\n"
+            "See 9. Next Steps for the timeline\n"
+            "3. Overview of the calendar sync\n"
+        ))
+        self.assertEqual(sections['scope'], "")
+        self.assertEqual(sections['next_steps'], "")
+
+    def test_text_before_the_first_header_is_ignored(self):
+        sections = parse_prd_sections("Preamble\n\n1. OVERVIEW:\nBody")
+
+        self.assertEqual(sections['overview'], "Body\n")
+        self.assertNotIn("Preamble", "".join(sections.values()))
+
+    def test_missing_sections_are_empty(self):
+        sections = parse_prd_sections("No headers at all")
+
+        self.assertEqual(sections, {key: "" for key in SECTION_KEYS})
+
+
+class PrdSectionParserTests(unittest.TestCase):
+    def test_chunked_feeding_matches_a_single_pass(self):
+        rng = random.Random(7)
+        for _ in range(20):
+            parser = PrdSectionParser()
+            position = 0
+            while position < len(PLAIN_PRD):
+                size = rng.randint(1, 40)
+                parser.feed(PLAIN_PRD[position:position + size])
+                position += size
+            parser.close()
+
+            self.assertEqual(parser.sections, parse_prd_sections(PLAIN_PRD))
+
+    def test_sections_complete_when_the_next_header_arrives(self):
+        parser = PrdSectionParser()
+
+        self.assertEqual(parser.feed("1. OVERVIEW:\nFirst"), [])
+        self.assertEqual(parser.feed(" line\n2. PROBLEM"), [])
+        self.assertEqual(parser.feed(" STATEMENT:\nSecond\n"), [('overview', "First line\n")])
+        self.assertEqual(parser.close(), [('problem_statement', "Second\n")])
+
+    def test_every_section_is_emitted_once_in_order(self):
+        parser = PrdSectionParser()
+        completed = []
+        for line in PLAIN_PRD.splitlines(keepends=True):
+            completed.extend(parser.feed(line))
+        completed.extend(parser.close())
+
+        self.assertEqual([key for key, _ in completed], list(SECTION_KEYS))
+        self.assertEqual(dict(completed), parser.sections)
+
+
+class StructuredPrdTests(unittest.TestCase):
+    def _document(self):
+        return PrdDocument(**{key: f"{key} line one\n\n  {key} line two  " for key in SECTION_KEYS}).model_dump_json()
+
+    def test_valid_json_becomes_normalized_sections(self):
+        sections = parse_structured_prd(self._document())
+
+        self.assertEqual(list(sections), list(SECTION_KEYS))
+        self.assertEqual(sections['scope'], "scope line one\nscope line two\n")
+
+    def test_code_fences_are_ignored(self):
+        self.assertIsNotNone(parse_structured_prd("```json\n" + self._document() + "\n```"))
+
+    def test_json_missing_a_section_is_rejected(self):
+        document = json.loads(self._document())
+        del document['next_steps']
+
+        self.assertIsNone(parse_structured_prd(json.dumps(document)))
+        self.assertIsNone(parse_structured_prd(PLAIN_PRD))
+
+    def test_rendered_text_parses_back_to_the_same_sections(self):
+        sections = parse_prd_sections(PLAIN_PRD)
+
+        self.assertEqual(parse_prd_sections(render_prd_content(sections)), sections)
+
 
 if __name__ == "__main__":
-    test_prd_format()
+    unittest.main()
@@ -181,7 +181,8 @@ export default function Dashboard() {
           'Content-Type': 'application/json',
           'Authorization': `Bearer ${session.idToken}`,
         },
-        body: JSON.stringify({ idea: ideaText }),
+        // The chat log and ResultsDisplay fall back to the numbered PRD text
+        body: JSON.stringify({ idea: ideaText, include_prd_content: true }),
       });
 
       const data = await response.json();
@@ -289,7 +290,8 @@ export default function Dashboard() {
         },
         body: JSON.stringify({ 
           idea_id: result.idea_id,
-          feedback: feedback 
+          feedback: feedback,
+          include_prd_content: true
         }),
       });
 